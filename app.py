@@ -1,24 +1,188 @@
 # app.py (Versão refatorada para PostgreSQL)
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, send_file
 from flask_cors import CORS
 from flask_jwt_extended import create_access_token, jwt_required, JWTManager, get_jwt_identity, get_jwt
-from werkzeug.security import generate_password_hash, check_password_hash
 import psycopg2 # Importa o driver do PostgreSQL
 from psycopg2 import errors # Importa os erros específicos para tratamento
+from psycopg2.extras import execute_values
 from config import *
 from db_functions import *
+from hashing import FilaHashCheia, TempoEsgotado as TempoHashEsgotado, gerar_hash, gerar_hashes, verificar_hash, precisa_rehash, calibrar
+from fotos import FotoInvalida, FotosDesativadas, salvar_foto, localizar_foto, urls_foto
+from cache_respostas import cache_resposta, invalidar_cache, estatisticas_cache
+from cache_atividades import COLUNAS_ATIVIDADE, JUNCAO_CACHE, parametros_cache, obter_atividade, invalidar_atividade, estatisticas_atividades
+import metricas
+from status_contas import status_conta, invalidar_status, CONSULTAS_STATUS
+from replicas import leitura_replica, marcar_escrita, usuario_atual
+from consultas_preparadas import preparar, executar, estatisticas_preparadas
+from inicializacao import relatorio_inicializacao
+import diario_conclusoes
+from moedas import SALDO_ALUNO, extrato_moedas, compactar_pendentes, iniciar_compactacao
+from progresso import registrar_conclusoes, reconstruir_resumos, analisar_turmas, versao_analises, calcular_moedas
+from progresso import reconstruir_progresso_periodos, ler_intervalo_serie, serie_progresso
+from datetime import datetime
+from streaming import resposta_json_streaming, lista_json, objeto_agrupado_json
 from flask import current_app
 import json as _json
 import os
+import time
+import base64
+import hmac
+import unicodedata
+import click
 
 app = Flask(__name__)
-CORS(app) 
+CORS(app, expose_headers=['X-Proximo-Cursor'])
 
 # Usa a chave secreta carregada do config.py
 app.config["JWT_SECRET_KEY"] = JWT_SECRET_KEY
 jwt = JWTManager(app)
 
+# --- STATUS DA CONTA EM CADA REQUISIÇÃO AUTENTICADA ---
+# Tokens de contas bloqueadas ou excluídas deixam de valer antes de expirar.
+# O status vem do cache por worker (status_contas.py); o banco só é consultado quando a entrada expira.
+COMANDOS_STATUS = {papel: preparar(f'status_{papel}', sql) for papel, sql in CONSULTAS_STATUS.items()}
+
+def carregar_status_conta(papel, id_conta):
+    conexao, cursor = conectar_db()
+    try:
+        executar(cursor, COMANDOS_STATUS[papel], (id_conta,))
+        linha = cursor.fetchone()
+        return linha['status'] if linha else None
+    finally:
+        encerrar_db(cursor, conexao)
+
+@jwt.token_in_blocklist_loader
+def token_de_conta_bloqueada(jwt_header, jwt_payload):
+    papel = jwt_payload.get('role')
+    if papel not in CONSULTAS_STATUS:  # adm não tem linha no banco
+        return False
+    try:
+        return status_conta(papel, jwt_payload['sub'], carregar_status_conta) != 'ativo'
+    except psycopg2.Error as e:
+        # Sem banco não há como confirmar; deixa passar e a própria rota trata o erro
+        print(f"Erro ao verificar status da conta: {e}")
+        return False
+
+@jwt.revoked_token_loader
+def conta_bloqueada(jwt_header, jwt_payload):
+    return jsonify({"msg": "Sua conta está bloqueada ou foi removida."}), 401
+
+# Parte da chave de cache por usuário (cache_resposta(variar_por=chave_usuario)): papel + id,
+# pois ids de Aluno e Professor podem coincidir. Sem argumentos usa o usuário do token.
+def chave_usuario(papel=None, id_usuario=None):
+    if papel is None:
+        papel, id_usuario = get_jwt().get('role'), get_jwt_identity()
+    return f"{papel}:{id_usuario}"
+
+# Devolve ao pool a conexão usada pela requisição (uma conexão por requisição)
+app.teardown_appcontext(liberar_conexao_db)
+
+# --- MÉTRICAS POR ROTA (ver metricas.py) ---
+# O rótulo é o padrão da rota (ex.: /api/aluno/atividades/<int:id_atividade>), não a URL concreta.
+if METRICAS_ATIVAS:
+    @app.before_request
+    def iniciar_cronometro():
+        g._inicio_requisicao = time.perf_counter()
+
+    @app.after_request
+    def registrar_metricas_requisicao(resposta):
+        inicio = g.get('_inicio_requisicao')
+        if inicio is not None:
+            rota = request.url_rule.rule if request.url_rule else 'sem_rota'
+            metricas.registrar_requisicao(rota, request.method, resposta.status_code, time.perf_counter() - inicio)
+        return resposta
+
+# --- ROTA DE MÉTRICAS NO FORMATO DO PROMETHEUS ---
+@app.route('/metrics', methods=['GET'])
+def exportar_metricas():
+    if METRICAS_TOKEN:
+        autorizacao = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(autorizacao, f"Bearer {METRICAS_TOKEN}"):
+            return jsonify({"msg": "Acesso negado."}), 403
+
+    pool = estatisticas_pool()
+    medidores = {
+        "db_pool_conexoes_em_uso": ("Conexões do pool em uso.", pool['em_uso']),
+        "db_pool_conexoes_ociosas": ("Conexões do pool ociosas.", pool['ociosas']),
+        "db_pool_esgotamentos": ("Vezes em que o pool não tinha conexão livre no prazo.", pool['esgotamentos']),
+    }
+    return Response(metricas.renderizar(medidores), mimetype='text/plain; version=0.0.4')
+
+# Quantos comandos a requisição mandou ao banco (ligado só no benchmark, via EXPOR_IDAS_DB=1).
+# Respostas em streaming (streaming.py) saem como "nao-medido": os headers são enviados antes de o
+# gerador rodar, e os FETCH do cursor do lado do servidor não passam pelo CursorContado.execute.
+if EXPOR_IDAS_DB:
+    @app.after_request
+    def expor_idas_db(resposta):
+        resposta.headers['X-DB-Idas'] = 'nao-medido' if resposta.is_streamed else str(idas_ao_banco())
+        return resposta
+
+# "Ler o que escreveu": depois de uma escrita bem-sucedida as leituras do usuário ficam
+# no primário por ESCRITA_RECENTE_SEGUNDOS (ver replicas.py)
+if DATABASE_REPLICA_URLS:
+    @app.after_request
+    def registrar_escrita_recente(resposta):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and resposta.status_code < 400:
+            marcar_escrita(usuario_atual())
+        return resposta
+
+# Pool sem conexões livres: melhor responder 503 rápido do que travar o worker
+@app.errorhandler(PoolEsgotado)
+def pool_esgotado(e):
+    print(f"Pool de conexões esgotado: {e}")
+    return jsonify({"msg": "Servidor sobrecarregado, tente novamente em instantes."}), 503
+
+# Muitos hashes de senha pendentes: recusa em vez de enfileirar indefinidamente
+@app.errorhandler(FilaHashCheia)
+def fila_hash_cheia(e):
+    print(f"Fila de hash cheia: {e}")
+    return jsonify({"msg": "Servidor sobrecarregado, tente novamente em instantes."}), 503
+
+# Hash de senha que passou do prazo (HASH_TIMEOUT, ou HASH_LOTE_TIMEOUT na importação): mesma resposta
+@app.errorhandler(TempoHashEsgotado)
+def tempo_hash_esgotado(e):
+    print(f"Hash de senha passou do prazo: {e}")
+    return jsonify({"msg": "Servidor sobrecarregado, tente novamente em instantes."}), 503
+
+# --- COMANDO: flask calibrar-hash ---
+# Sugere um HASH_METODO cujo custo atinge o tempo alvo nesta máquina.
+@app.cli.command('calibrar-hash')
+@click.option('--alvo-ms', default=250, help='Tempo alvo por hash, em milissegundos.')
+@click.option('--algoritmo', type=click.Choice(['scrypt', 'pbkdf2']), default='scrypt')
+def calibrar_hash_comando(alvo_ms, algoritmo):
+    metodo, tempo_ms = calibrar(alvo_ms, algoritmo)
+    print(f"HASH_METODO={metodo}  (~{tempo_ms} ms por hash nesta máquina)")
+
+# --- ROTA PARA ESTATÍSTICAS INTERNAS DO WORKER (APENAS ADM) ---
+# Útil para dimensionar DB_POOL_MAX por worker do gunicorn.
+@app.route('/api/admin/estatisticas', methods=['GET'])
+@jwt_required()
+def estatisticas_admin():
+    claims = get_jwt()
+    if claims.get('role') != 'adm':
+        return jsonify({"msg": "Acesso negado."}), 403
+    return jsonify({
+        "pool": estatisticas_pool(),
+        "cache": estatisticas_cache(),
+        "atividades": estatisticas_atividades(),
+        "preparadas": estatisticas_preparadas(),
+        "inicializacao": relatorio_inicializacao(),
+        "diario": diario_conclusoes.estatisticas_diario(),
+    }), 200
+
+# Atualização do hash de senha por papel (rehash no login)
+COMANDOS_REHASH = {
+    'professor': 'UPDATE Professor SET senhaProfessor = %s WHERE idProfessor = %s',
+    'aluno': 'UPDATE Aluno SET senhaAluno = %s WHERE idAluno = %s',
+}
+
+# Professor e Aluno em uma única ida ao banco (view CredencialUsuario); professor tem prioridade
+CONSULTA_LOGIN = preparar('login_credencial', '''
+    SELECT papel, id, nome, senha, status FROM CredencialUsuario WHERE email = %s ORDER BY prioridade
+''')
+
 # --- ROTA DE LOGIN ATUALIZADA (ADM, PROFESSOR E ALUNO) ---
 @app.route('/api/login', methods=['POST'])
 def login():
@@ -40,38 +204,39 @@ def login():
     cursor = None
     try:
         conexao, cursor = conectar_db()
-        
-        # 2. Tenta como Professor
-        cursor.execute('SELECT idProfessor, nomeProfessor, senhaProfessor, status FROM Professor WHERE emailProfessor = %s', (email,))
-        professor = cursor.fetchone()
-        if professor and check_password_hash(professor['senhaprofessor'], senha):
-            if professor['status'] != 'ativo':
-                return jsonify({"msg": "Sua conta de professor está bloqueada."}), 403
-            
-            # --- CORREÇÃO APLICADA AQUI ---
-            # Converte o ID (inteiro) para uma string antes de criar o token
-            identity = str(professor['idprofessor']) 
-            additional_claims = {"role": "professor"}
-            access_token = create_access_token(identity=identity, additional_claims=additional_claims)
-            return jsonify(access_token=access_token, user_role="professor", user_name=professor['nomeprofessor'])
 
-        # 3. Tenta como Aluno
-        cursor.execute('SELECT idAluno, nomeAluno, senhaAluno, status FROM Aluno WHERE emailAluno = %s', (email,))
-        aluno = cursor.fetchone()
-        if aluno and check_password_hash(aluno['senhaaluno'], senha):
-            if aluno['status'] != 'ativo':
-                return jsonify({"msg": "Sua conta de aluno está bloqueada."}), 403
-
-            # --- CORREÇÃO APLICADA AQUI TAMBÉM (BOA PRÁTICA) ---
-            # Converte o ID do aluno para string também
-            identity = str(aluno['idaluno'])
-            additional_claims = {"role": "aluno"}
+        # 2 e 3. Professor e Aluno em uma única ida ao banco (view CredencialUsuario).
+        # Professor tem prioridade, como antes; email inexistente não paga nenhum hash.
+        executar(cursor, CONSULTA_LOGIN, (email,))
+        for credencial in cursor.fetchall():
+            if not verificar_hash(credencial['senha'], senha):
+                continue
+            if credencial['status'] != 'ativo':
+                return jsonify({"msg": f"Sua conta de {credencial['papel']} está bloqueada."}), 403
+
+            # Os parâmetros do hash mudaram: aproveita a senha correta para refazer o hash.
+            # Uma falha aqui não impede o login; o hash antigo continua válido.
+            if precisa_rehash(credencial['senha']):
+                try:
+                    cursor.execute(COMANDOS_REHASH[credencial['papel']], (gerar_hash(senha), credencial['id']))
+                    conexao.commit()
+                except (psycopg2.Error, FilaHashCheia, TempoHashEsgotado) as e:
+                    conexao.rollback()
+                    print(f"Erro ao refazer hash de senha: {e}")
+
+            # O ID (inteiro) é convertido para string antes de criar o token
+            identity = str(credencial['id'])
+            additional_claims = {"role": credencial['papel']}
             access_token = create_access_token(identity=identity, additional_claims=additional_claims)
-            return jsonify(access_token=access_token, user_role="aluno", user_name=aluno['nomealuno'])
-            
+            return jsonify(access_token=access_token, user_role=credencial['papel'], user_name=credencial['nome'])
+
         # 4. Se não encontrou ninguém
         return jsonify({"msg": "Email ou senha inválidos."}), 401
 
+    except (FilaHashCheia, TempoHashEsgotado) as e:
+        # Fila de hash cheia ou hash passou de HASH_TIMEOUT: sobrecarga, não senha errada
+        print(f"Hash de senha indisponível no login: {e}")
+        return jsonify({"msg": "Servidor sobrecarregado, tente novamente em instantes."}), 503
     except psycopg2.Error as e:
         print(f"Erro de Banco de Dados no login: {e}")
         return jsonify({"msg": "Erro interno no servidor."}), 500
@@ -96,15 +261,15 @@ def register_aluno():
     conexao, cursor = None, None
     try:
         conexao, cursor = conectar_db()
-        
-        # Hash da senha
-        hashed_senha = generate_password_hash(senha)
 
         # Verificar se email ou CPF já existem
         cursor.execute("SELECT idAluno FROM Aluno WHERE emailAluno = %s OR cpfAluno = %s;", (email, cpf))
         if cursor.fetchone():
             return jsonify({"msg": "Email ou CPF já cadastrados."}), 409
 
+        # Hash da senha (só depois da verificação, para não gastar CPU com duplicados)
+        hashed_senha = gerar_hash(senha)
+
         # Inserir o novo aluno, incluindo o anoAluno
         cursor.execute(
             """
@@ -125,6 +290,8 @@ def register_aluno():
     except errors.UniqueViolation as e:
         conexao.rollback()
         return jsonify({"msg": "Erro: Já existe um cadastro com este email ou CPF."}), 409
+    except (FilaHashCheia, TempoHashEsgotado):
+        raise # Tratados pelos errorhandlers (503)
     except Exception as e:
         print(f"Erro ao cadastrar aluno: {e}")
         if conexao:
@@ -135,9 +302,23 @@ def register_aluno():
             encerrar_db(cursor, conexao)
 
 
+# Dados do aluno, nome do professor e o resumo de progresso (mantido por completar_atividade).
+# As moedas vêm do extrato (saldo compactado + movimentos pendentes, ver moedas.py).
+CONSULTA_PERFIL_ALUNO = preparar('perfil_aluno', f"""
+    SELECT 
+        a.nomeAluno, a.emailAluno, {SALDO_ALUNO} AS moedas, a.nivel, a.anoAluno, a.urlFotoPerfil,
+        p.nomeProfessor,
+        r.total_concluidas, r.total_pontuadas, r.soma_pontuacao, r.melhor_pontuacao, r.ultima_atividade
+    FROM Aluno a
+    LEFT JOIN Professor p ON a.idProfessor = p.idProfessor
+    LEFT JOIN ResumoProgressoAluno r ON r.idAluno = a.idAluno
+    WHERE a.idAluno = %s
+""")
+
 # --- ROTA PARA OBTER DADOS DO PERFIL DO ALUNO LOGADO (VERSÃO COMPLETA) ---
 @app.route('/api/aluno/perfil', methods=['GET'])
 @jwt_required()
+@leitura_replica
 def get_aluno_perfil():
     claims = get_jwt()
     if claims.get('role') != 'aluno':
@@ -149,36 +330,20 @@ def get_aluno_perfil():
     try:
         conexao, cursor = conectar_db()
         
-        # Query principal para pegar dados do aluno e nome do professor
-        query_aluno = """
-            SELECT 
-                a.nomeAluno, a.emailAluno, a.moedas, a.nivel, a.anoAluno, a.urlFotoPerfil,
-                p.nomeProfessor
-            FROM Aluno a
-            LEFT JOIN Professor p ON a.idProfessor = p.idProfessor
-            WHERE a.idAluno = %s
-        """
-        cursor.execute(query_aluno, (aluno_id,))
+        executar(cursor, CONSULTA_PERFIL_ALUNO, (aluno_id,))
         aluno_data = cursor.fetchone()
 
         if not aluno_data:
             return jsonify({"msg": "Aluno não encontrado."}), 404
-            
-        # Query secundária para calcular estatísticas de progresso
-        query_progresso = """
-            SELECT 
-                COUNT(*) AS total_atividades, 
-                AVG(pontuacao) AS media_pontuacao
-            FROM AtividadeFeita
-            WHERE idAluno = %s
-        """
-        cursor.execute(query_progresso, (aluno_id,))
-        progresso_data = cursor.fetchone()
 
-        # Adiciona os dados de progresso ao dicionário principal
-        aluno_data['total_atividades_concluidas'] = progresso_data['total_atividades'] or 0
-        # Formata a média para um número inteiro
-        aluno_data['media_geral'] = int(progresso_data['media_pontuacao']) if progresso_data['media_pontuacao'] else 0
+        total_concluidas = aluno_data.pop('total_concluidas') or 0
+        total_pontuadas = aluno_data.pop('total_pontuadas') or 0
+        soma_pontuacao = aluno_data.pop('soma_pontuacao') or 0
+        aluno_data['total_atividades_concluidas'] = total_concluidas
+        # Média inteira, como o antigo int(AVG(pontuacao))
+        aluno_data['media_geral'] = int(soma_pontuacao / total_pontuadas) if total_pontuadas else 0
+        # A linha guarda só a referência da foto; o JSON leva as URLs do endpoint de fotos
+        aluno_data['urlfotoperfil'], aluno_data['urlfotominiatura'] = urls_foto(aluno_data['urlfotoperfil'])
 
         return jsonify(aluno_data), 200
 
@@ -221,8 +386,13 @@ def update_aluno_perfil():
         if cursor and conexao:
             encerrar_db(cursor, conexao)
             
+# Falha ao gravar no armazenamento de fotos (disco cheio, diretório sem permissão...)
+def armazenamento_fotos_indisponivel(e):
+    print(f"Erro ao gravar foto: {e}")
+    return jsonify({"msg": "Não foi possível salvar a foto agora, tente novamente mais tarde."}), 503
+
 # --- ROTA PARA "UPLOAD" DE FOTO DO ALUNO ---
-# Versão simplificada que apenas salva a URL da imagem.
+# Recebe a imagem em base64 e a guarda no armazenamento de fotos (fotos.py).
 @app.route('/api/aluno/perfil/foto', methods=['POST'])
 @jwt_required()
 def update_aluno_foto():
@@ -237,13 +407,24 @@ def update_aluno_foto():
     if not url_foto:
         return jsonify({"msg": "URL da foto é obrigatória."}), 400
 
+    # Grava a imagem no armazenamento de fotos; o banco recebe só a referência curta
+    try:
+        referencia = salvar_foto(url_foto)
+    except FotoInvalida as e:
+        return jsonify({"msg": str(e)}), 400
+    except FotosDesativadas as e:
+        return jsonify({"msg": str(e)}), 503
+    except OSError as e:
+        return armazenamento_fotos_indisponivel(e)
+
     conexao = None
     cursor = None
     try:
         conexao, cursor = conectar_db()
-        cursor.execute('UPDATE Aluno SET urlFotoPerfil = %s WHERE idAluno = %s', (url_foto, aluno_id))
+        cursor.execute('UPDATE Aluno SET urlFotoPerfil = %s WHERE idAluno = %s', (referencia, aluno_id))
         conexao.commit()
-        return jsonify({"msg": "Foto de perfil atualizada!"}), 200
+        url_perfil, url_miniatura = urls_foto(referencia)
+        return jsonify({"msg": "Foto de perfil atualizada!", "urlFotoPerfil": url_perfil, "urlFotoMiniatura": url_miniatura}), 200
 
     except psycopg2.Error as e:
         if conexao: conexao.rollback()
@@ -252,6 +433,68 @@ def update_aluno_foto():
         if cursor and conexao:
             encerrar_db(cursor, conexao)
 
+INT_MAX = 2 ** 31 - 1  # limite das colunas INT do Postgres
+
+# Converte um item recebido do frontend no formato de progresso.registrar_conclusoes.
+# Levanta ValueError com a mensagem para o usuário se o item for inválido. Confere também os
+# limites das colunas (INT, VARCHAR(100)): no modo buffer o item já foi confirmado ao aluno quando
+# chega ao banco, então nada que passe daqui pode ser recusado pelo formato.
+def ler_conclusao(dado):
+    if not isinstance(dado, dict) or not dado.get('idAtividade'):
+        raise ValueError("ID da atividade é obrigatório.")
+    try:
+        id_atividade = int(dado['idAtividade'])
+    except (TypeError, ValueError):
+        raise ValueError("ID da atividade inválido.")
+    if not 0 < id_atividade <= INT_MAX:
+        raise ValueError("ID da atividade inválido.")
+    try:
+        pontuacao = int(dado.get('pontuacao') or 0)
+    except (TypeError, ValueError):
+        raise ValueError("Pontuação inválida.")
+    if not -INT_MAX <= pontuacao <= INT_MAX:
+        raise ValueError("Pontuação inválida.")
+    feedback = dado.get('feedback') or ''
+    if not isinstance(feedback, str) or '\x00' in feedback:
+        raise ValueError("Feedback inválido.")
+    chave = str(dado['idempotency_key']) if dado.get('idempotency_key') else None
+    if chave is not None and (len(chave) > 100 or '\x00' in chave):
+        raise ValueError("idempotency_key inválida.")
+    momento = None
+    if dado.get('client_timestamp'):
+        try:
+            momento = datetime.fromisoformat(str(dado['client_timestamp']).replace('Z', '+00:00'))
+        except ValueError:
+            raise ValueError("client_timestamp inválido.")
+    return {
+        "idAtividade": id_atividade,
+        "pontuacao": pontuacao,
+        "feedback": feedback,
+        "momento": momento,
+        "chave": chave,
+    }
+
+# --- MODO BUFFER DAS CONCLUSÕES (CONCLUSOES_MODO=buffer, ver diario_conclusoes.py) ---
+# O diário é iniciado em cada worker na primeira requisição (reaplicando o que sobrou de uma queda).
+# Com o modo síncrono ele só é iniciado se houver sobras de quando o modo buffer estava ligado.
+def invalidar_analises_professor(id_professor):
+    invalidar_cache('analises', sub=chave_usuario('professor', id_professor))
+
+if CONCLUSOES_MODO == 'buffer' or diario_conclusoes.ha_diario_pendente():
+    @app.before_request
+    def iniciar_diario_conclusoes():
+        diario_conclusoes.iniciar(invalidar_analises_professor)
+
+# Grava as conclusões no diário; devolve False se não der (ex.: disco cheio) e a rota
+# deve seguir pelo caminho síncrono
+def enfileirar_conclusoes(aluno_id, conclusoes):
+    try:
+        diario_conclusoes.registrar(aluno_id, conclusoes)
+        return True
+    except OSError as e:
+        print(f"Erro ao gravar no diário de conclusões, gravando direto no banco: {e}")
+        return False
+
 @app.route('/api/atividades/completar', methods=['POST'])
 @jwt_required()
 def completar_atividade():
@@ -261,41 +504,47 @@ def completar_atividade():
     
     aluno_id = get_jwt_identity()
     data = request.get_json()
-    id_atividade = data.get('idAtividade')
-    pontuacao = data.get('pontuacao', 0)
-    feedback = data.get('feedback', '')
-
-    if not id_atividade:
-        return jsonify({"msg": "ID da atividade é obrigatório."}), 400
-
-    # Lógica de recompensa: 10 moedas base + 1 moeda para cada 10 pontos
-    moedas_ganhas = 10 + (pontuacao // 10)
 
-    # CORREÇÃO: Garante que idAtividade seja int
     try:
-        id_atividade = int(id_atividade)
-    except ValueError:
-        return jsonify({"msg": "ID da atividade inválido."}), 400
+        conclusao = ler_conclusao(data)
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 400
+
+    # Modo buffer: confirma depois do fsync no diário; moedas e progresso aparecem após o próximo lote
+    if CONCLUSOES_MODO == 'buffer' and enfileirar_conclusoes(aluno_id, [conclusao]):
+        moedas = calcular_moedas(conclusao['pontuacao'])
+        return jsonify({
+            "msg": f"Parabéns! Você ganhou {moedas} moedas!",
+            "moedasGanhas": moedas,
+            "novoTotalMoedas": None,
+            "pendente": True,
+            "idempotency_key": conclusao['chave']
+        }), 202
 
     conexao = None
     cursor = None
     try:
         conexao, cursor = conectar_db()
-        
-        # 1. Insere na tabela AtividadeFeita para registrar o progresso
-        comando_insert = 'INSERT INTO AtividadeFeita (idAluno, idAtividade, pontuacao, feedback_gemini) VALUES (%s, %s, %s, %s)'
-        cursor.execute(comando_insert, (aluno_id, id_atividade, pontuacao, feedback))
 
-        # 2. Atualiza as moedas do aluno e retorna o novo total
-        comando_update = 'UPDATE Aluno SET moedas = moedas + %s WHERE idAluno = %s RETURNING moedas'
-        cursor.execute(comando_update, (moedas_ganhas, aluno_id))
-        
-        resultado_update = cursor.fetchone()
-        novo_total_moedas = resultado_update['moedas'] if resultado_update else None
-        
+        # Registra a AtividadeFeita, o resumo de progresso e as moedas na mesma transação
+        resultados, moedas_ganhas, novo_total_moedas, id_professor = registrar_conclusoes(cursor, aluno_id, [conclusao])
+        resultado = resultados[0]
+        if resultado['status'] == 'erro':
+            conexao.rollback()
+            return jsonify({"msg": resultado['msg']}), 404
+
         conexao.commit()
-        print(f"Moedas ganhas: {moedas_ganhas} para aluno {aluno_id} na atividade {id_atividade}")  # Log para debug
-        
+        if moedas_ganhas and id_professor:
+            invalidar_cache('analises', sub=chave_usuario('professor', id_professor))
+        print(f"Moedas ganhas: {moedas_ganhas} para aluno {aluno_id} na atividade {conclusao['idAtividade']}")  # Log para debug
+
+        if resultado['status'] == 'duplicado':
+            return jsonify({
+                "msg": "Esta conclusão já tinha sido registrada.",
+                "moedasGanhas": 0,
+                "novoTotalMoedas": novo_total_moedas
+            }), 200
+
         return jsonify({
             "msg": f"Parabéns! Você ganhou {moedas_ganhas} moedas!",
             "moedasGanhas": moedas_ganhas,
@@ -311,6 +560,172 @@ def completar_atividade():
         if cursor and conexao:
             encerrar_db(cursor, conexao)
 
+# --- ROTA: SINCRONIZAÇÃO EM LOTE DE ATIVIDADES FEITAS OFFLINE ---
+# Recebe {"conclusoes": [{idAtividade, pontuacao, feedback, client_timestamp, idempotency_key}, ...]}.
+# Tudo em uma transação: um INSERT de várias linhas, uma única soma de moedas e um commit.
+# Itens com idempotency_key já registrada voltam como "duplicado" (reenvio seguro).
+@app.route('/api/atividades/completar/lote', methods=['POST'])
+@jwt_required()
+def completar_atividades_lote():
+    claims = get_jwt()
+    if claims.get('role') != 'aluno':
+        return jsonify({"msg": "Apenas alunos podem completar atividades."}), 403
+
+    aluno_id = get_jwt_identity()
+    data = request.get_json(silent=True) or {}
+    recebidos = data.get('conclusoes') if isinstance(data, dict) else data
+    if not isinstance(recebidos, list) or not recebidos:
+        return jsonify({"msg": "Envie a lista 'conclusoes'."}), 400
+    if len(recebidos) > 200:
+        return jsonify({"msg": "Máximo de 200 conclusões por envio."}), 400
+
+    # Itens inválidos recebem erro individual; os válidos seguem para o banco
+    resultados = [None] * len(recebidos)
+    validos = []
+    for posicao, dado in enumerate(recebidos):
+        try:
+            validos.append((posicao, ler_conclusao(dado)))
+        except ValueError as e:
+            resultados[posicao] = {"status": "erro", "msg": str(e)}
+
+    # Modo buffer: os itens válidos voltam como "recebido" (duplicados são ignorados na gravação)
+    if validos and CONCLUSOES_MODO == 'buffer' and enfileirar_conclusoes(aluno_id, [c for _, c in validos]):
+        for posicao, conclusao in validos:
+            resultados[posicao] = {"status": "recebido", "chave": conclusao['chave'],
+                                   "moedasGanhas": calcular_moedas(conclusao['pontuacao'])}
+        for posicao, resultado in enumerate(resultados):
+            dado = recebidos[posicao] if isinstance(recebidos[posicao], dict) else {}
+            resultado['idAtividade'] = dado.get('idAtividade')
+            resultado['idempotency_key'] = resultado.pop('chave', dado.get('idempotency_key'))
+        return jsonify({
+            "resultados": resultados,
+            "moedasGanhas": sum(r.get('moedasGanhas', 0) for r in resultados),
+            "novoTotalMoedas": None,
+            "pendente": True
+        }), 202
+
+    conexao = None
+    cursor = None
+    try:
+        conexao, cursor = conectar_db()
+        registrados, moedas_ganhas, novo_total_moedas, id_professor = registrar_conclusoes(cursor, aluno_id, [c for _, c in validos])
+        conexao.commit()
+        if moedas_ganhas and id_professor:
+            invalidar_cache('analises', sub=chave_usuario('professor', id_professor))
+
+        for (posicao, conclusao), resultado in zip(validos, registrados):
+            resultados[posicao] = resultado
+        for posicao, resultado in enumerate(resultados):
+            dado = recebidos[posicao] if isinstance(recebidos[posicao], dict) else {}
+            resultado['idAtividade'] = dado.get('idAtividade')
+            resultado['idempotency_key'] = resultado.pop('chave', dado.get('idempotency_key'))
+
+        return jsonify({
+            "resultados": resultados,
+            "moedasGanhas": moedas_ganhas,
+            "novoTotalMoedas": novo_total_moedas
+        }), 200
+
+    except psycopg2.Error as e:
+        if conexao:
+            conexao.rollback()
+        print(f"Erro ao sincronizar atividades: {e}")
+        return jsonify({"msg": "Erro interno ao salvar seu progresso."}), 500
+    finally:
+        if cursor and conexao:
+            encerrar_db(cursor, conexao)
+
+# --- ROTA PÚBLICA PARA SERVIR AS FOTOS DE PERFIL ---
+# O nome do arquivo é o hash do conteúdo, então a ETag é forte e o cache pode ser "immutable".
+# send_file(conditional=True) responde 304 quando o If-None-Match bate com a ETag.
+@app.route('/api/fotos/<referencia>', methods=['GET'])
+def obter_foto(referencia):
+    encontrada = localizar_foto(referencia, miniatura=request.args.get('tamanho') == 'mini')
+    if not encontrada:
+        return jsonify({"msg": "Foto não encontrada."}), 404
+
+    caminho, mimetype, etag = encontrada
+    resposta = send_file(caminho, mimetype=mimetype, etag=etag, conditional=True, max_age=31536000)
+    resposta.cache_control.public = True
+    resposta.cache_control.immutable = True
+    return resposta
+
+# --- COMANDO: flask migrar-fotos ---
+# Move as fotos antigas (data URL em base64 dentro da linha) para o armazenamento de fotos.
+@app.cli.command('migrar-fotos')
+def migrar_fotos_comando():
+    conexao, cursor = conectar_db()
+    try:
+        for tabela, coluna_id in (('Aluno', 'idAluno'), ('Professor', 'idProfessor')):
+            cursor.execute(f"SELECT {coluna_id} AS id, urlFotoPerfil FROM {tabela} WHERE urlFotoPerfil LIKE 'data:%%'")
+            migradas = 0
+            for linha in cursor.fetchall():
+                try:
+                    referencia = salvar_foto(linha['urlfotoperfil'])
+                except FotoInvalida as e:
+                    print(f"{tabela} {linha['id']}: foto ignorada ({e})")
+                    continue
+                cursor.execute(f"UPDATE {tabela} SET urlFotoPerfil = %s WHERE {coluna_id} = %s", (referencia, linha['id']))
+                migradas += 1
+            conexao.commit()
+            print(f"{tabela}: {migradas} fotos migradas.")
+    finally:
+        encerrar_db(cursor, conexao)
+
+# --- COMANDO: flask reconstruir-resumos ---
+# Recalcula ResumoProgressoAluno a partir de AtividadeFeita (backfill ou correção).
+@app.cli.command('reconstruir-resumos')
+@click.option('--aluno', type=int, default=None, help='Reconstrói só o resumo deste aluno.')
+def reconstruir_resumos_comando(aluno):
+    conexao, cursor = conectar_db()
+    try:
+        total = reconstruir_resumos(cursor, aluno)
+        conexao.commit()
+        print(f"{total} resumos de progresso reconstruídos.")
+    finally:
+        encerrar_db(cursor, conexao)
+
+# --- COMANDO: flask reconstruir-progresso ---
+# Recalcula os totais por dia e por semana (ProgressoPeriodoAluno/Turma) a partir de AtividadeFeita.
+@app.cli.command('reconstruir-progresso')
+def reconstruir_progresso_comando():
+    conexao, cursor = conectar_db()
+    try:
+        total = reconstruir_progresso_periodos(cursor)
+        conexao.commit()
+        print(f"{total} períodos de progresso de alunos reconstruídos.")
+    finally:
+        encerrar_db(cursor, conexao)
+
+# --- COMANDO: flask compactar-moedas ---
+# Soma os movimentos pendentes do extrato nos saldos e atualiza Aluno.moedas (ver moedas.py).
+# Para rodar em um cron quando a compactação periódica está desligada (MOEDAS_COMPACTAR_SEGUNDOS=0).
+@app.cli.command('compactar-moedas')
+def compactar_moedas_comando():
+    total = compactar_pendentes()
+    print(f"Saldos de moedas de {total} alunos compactados.")
+
+# --- ROTA: COMPACTAÇÃO DAS MOEDAS PELO CRON ---
+# O mesmo que "flask compactar-moedas", para onde não há como rodar o CLI: na Vercel é chamada
+# pelo "crons" do vercel.json, com o CRON_SECRET no cabeçalho Authorization.
+@app.route('/api/cron/compactar-moedas', methods=['GET'])
+def compactar_moedas_cron():
+    autorizacao = request.headers.get('Authorization', '')
+    if not CRON_SECRET or not hmac.compare_digest(autorizacao, f"Bearer {CRON_SECRET}"):
+        return jsonify({"msg": "Acesso negado."}), 403
+    try:
+        total = compactar_pendentes()
+    except psycopg2.Error as e:
+        print(f"Erro na compactação de moedas: {e}")
+        return jsonify({"msg": "Erro interno ao compactar as moedas."}), 500
+    return jsonify({"alunos": total}), 200
+
+# Compactação periódica do extrato de moedas, iniciada em cada worker na primeira requisição
+if MOEDAS_COMPACTAR_SEGUNDOS > 0:
+    @app.before_request
+    def iniciar_compactacao_moedas():
+        iniciar_compactacao()
+
 # --- ROTA DE CADASTRO DE Professor (ATUALIZADA) ---
 # CORREÇÃO: A rota foi alterada para corresponder ao fetch() do frontend
 @app.route('/api/professor', methods=['POST'])
@@ -331,7 +746,7 @@ def cadastrar_professor():
     if not all([nome, cpf, email, senha]):
         return jsonify({"msg": "Nome, CPF, email e senha são obrigatórios"}), 400
 
-    hashed_password = generate_password_hash(senha)
+    hashed_password = gerar_hash(senha)
     
     # Inicializa as variáveis de conexão fora do try para estarem disponíveis no finally
     conexao = None
@@ -342,6 +757,7 @@ def cadastrar_professor():
         comandoSQL = 'INSERT INTO Professor (nomeProfessor, cpfProfessor, emailProfessor, senhaProfessor, status) VALUES (%s, %s, %s, %s, %s)'
         cursor.execute(comandoSQL, (nome, cpf, email, hashed_password, 'ativo'))
         conexao.commit()
+        invalidar_cache('professores_publico')
         return jsonify({"msg": f"Professor '{nome}' cadastrado com sucesso!"}), 201
 
     except errors.UniqueViolation as e:
@@ -374,12 +790,22 @@ def update_professor_foto():
     if not url_foto:
         return jsonify({"msg": "URL da foto é obrigatória."}), 400
 
+    try:
+        referencia = salvar_foto(url_foto)
+    except FotoInvalida as e:
+        return jsonify({"msg": str(e)}), 400
+    except FotosDesativadas as e:
+        return jsonify({"msg": str(e)}), 503
+    except OSError as e:
+        return armazenamento_fotos_indisponivel(e)
+
     conexao, cursor = None, None
     try:
         conexao, cursor = conectar_db()
-        cursor.execute('UPDATE Professor SET urlFotoPerfil = %s WHERE idProfessor = %s', (url_foto, professor_id))
+        cursor.execute('UPDATE Professor SET urlFotoPerfil = %s WHERE idProfessor = %s', (referencia, professor_id))
         conexao.commit()
-        return jsonify({"msg": "Foto de perfil atualizada com sucesso!"}), 200
+        url_perfil, url_miniatura = urls_foto(referencia)
+        return jsonify({"msg": "Foto de perfil atualizada com sucesso!", "urlFotoPerfil": url_perfil, "urlFotoMiniatura": url_miniatura}), 200
 
     except psycopg2.Error as e:
         if conexao:
@@ -412,7 +838,7 @@ def cadastrar_aluno():
     if not all([nome, cpf, email, senha]):
         return jsonify({"msg": "Nome, CPF, email e senha são obrigatórios"}), 400
 
-    hashed_password = generate_password_hash(senha)
+    hashed_password = gerar_hash(senha)
     
     # Inicializa as variáveis de conexão fora do try para estarem disponíveis no finally
     conexao = None
@@ -442,6 +868,7 @@ def cadastrar_aluno():
 # --- ROTA PARA LISTAR TODOS OS PROFESSORES ---
 @app.route('/api/professores', methods=['GET'])
 @jwt_required()
+@leitura_replica
 def listar_professores():
     # Verifica se o usuário tem a permissão de administrador
     claims = get_jwt()
@@ -456,11 +883,11 @@ def listar_professores():
         
         # Seleciona as colunas importantes da tabela Professor, ordenando por nome
         comandoSQL = 'SELECT idProfessor, nomeProfessor, emailProfessor, status FROM Professor ORDER BY nomeProfessor'
-        cursor.execute(comandoSQL)
-        professores = cursor.fetchall() # Pega todos os resultados
+        professores = cursor_servidor(conexao, 'lista_professores')
+        professores.execute(comandoSQL)
 
-        # Retorna a lista de professores em formato JSON
-        return jsonify(professores), 200
+        # Retorna a lista de professores em formato JSON, enviada aos poucos (ver streaming.py)
+        return resposta_json_streaming(lista_json(professores)), 200
 
     except psycopg2.Error as e:
         print(f"Erro de Banco de Dados ao listar professores: {e}")
@@ -492,6 +919,8 @@ def deletar_professor(id):
         # Se existe, executa o comando de exclusão
         cursor.execute('DELETE FROM Professor WHERE idProfessor = %s', (id,))
         conexao.commit()
+        invalidar_cache('professores_publico')
+        invalidar_status('professor', id)
         
         return jsonify({"msg": f"Professor '{professor['nomeprofessor']}' excluído com sucesso."}), 200
 
@@ -530,6 +959,8 @@ def mudar_status_professor(id):
         # Atualiza o status no banco de dados
         cursor.execute('UPDATE Professor SET status = %s WHERE idProfessor = %s', (novo_status, id))
         conexao.commit()
+        invalidar_cache('professores_publico')
+        invalidar_status('professor', id)
         
         return jsonify({"msg": f"Status alterado para '{novo_status}'.", "novoStatus": novo_status}), 200
 
@@ -542,7 +973,11 @@ def mudar_status_professor(id):
         if cursor and conexao:
             encerrar_db(cursor, conexao)
 
+# Lista pública (telas de login e cadastro): servida do cache em memória com ETag.
+# As rotas que alteram professores chamam invalidar_cache('professores_publico').
 @app.route('/api/professores/lista', methods=['GET'])
+@cache_resposta('professores_publico', ttl=300)
+@leitura_replica
 def listar_professores_publico():
     conexao = None
     cursor = None
@@ -562,6 +997,7 @@ def listar_professores_publico():
 # --- ROTA PARA O PROFESSOR VER SEUS ALUNOS (AGORA AGRUPADOS POR TURMA) ---
 @app.route('/api/professor/alunos', methods=['GET'])
 @jwt_required()
+@leitura_replica
 def listar_alunos_do_professor():
     claims = get_jwt()
     if claims.get('role') != 'professor':
@@ -573,31 +1009,24 @@ def listar_alunos_do_professor():
     cursor = None
     try:
         conexao, cursor = conectar_db()
-        # Busca todos os alunos vinculados, ordenando por turma e depois por nome
-        comando = """
-            SELECT idAluno, nomeAluno, emailAluno, status, moedas, nivel, anoAluno 
-            FROM Aluno 
+        # Busca todos os alunos vinculados, ordenando por turma e depois por nome.
+        # Turma nula ou vazia vira 'Alunos Sem Turma' já no ORDER BY, para que cada turma
+        # venha contígua e o agrupamento possa ser feito durante o streaming.
+        comando = f"""
+            SELECT idAluno, nomeAluno, emailAluno, status, {SALDO_ALUNO} AS moedas, nivel, anoAluno
+            FROM Aluno a
             WHERE idProfessor = %s 
-            ORDER BY anoAluno, nomeAluno
+            ORDER BY COALESCE(NULLIF(anoAluno, ''), 'Alunos Sem Turma'), nomeAluno
         """
-        cursor.execute(comando, (professor_id,))
-        alunos = cursor.fetchall()
-        
+        alunos = cursor_servidor(conexao, 'alunos_do_professor')
+        alunos.execute(comando, (professor_id,))
+
         # --- LÓGICA DE AGRUPAMENTO ---
-        turmas = {}
-        for aluno in alunos:
-            # Usa 'Sem Turma' como padrão se o campo for nulo ou vazio
-            turma_nome = aluno.get('anoaluno') or 'Alunos Sem Turma' 
-            
-            # Se a turma ainda não existe no nosso dicionário, cria a chave com uma lista vazia
-            if turma_nome not in turmas:
-                turmas[turma_nome] = []
-            
-            # Adiciona o aluno à lista da sua respectiva turma
-            turmas[turma_nome].append(aluno)
-            
+        # Usa 'Alunos Sem Turma' como padrão se o campo for nulo ou vazio.
         # O resultado final será um objeto, ex: {"1º Ano A": [...alunos], "2º Ano B": [...alunos]}
-        return jsonify(turmas), 200
+        return resposta_json_streaming(
+            objeto_agrupado_json(alunos, lambda aluno: aluno.get('anoaluno') or 'Alunos Sem Turma')
+        ), 200
 
     except psycopg2.Error as e:
         print(f"Erro ao buscar alunos do professor: {e}")
@@ -607,6 +1036,326 @@ def listar_alunos_do_professor():
             encerrar_db(cursor, conexao)
 
 
+# --- ROTAS: HISTÓRICO DE PROGRESSO PARA GRÁFICOS ---
+# ?periodo=dia|semana&de=AAAA-MM-DD&ate=AAAA-MM-DD. Lê só os totais por período
+# (ProgressoPeriodoAluno/Turma), no máximo um ponto por dia/semana do intervalo.
+@app.route('/api/aluno/progresso', methods=['GET'])
+@jwt_required()
+@leitura_replica
+def obter_progresso_aluno():
+    claims = get_jwt()
+    if claims.get('role') != 'aluno':
+        return jsonify({"msg": "Acesso negado. Apenas alunos."}), 403
+
+    try:
+        periodo, de, ate = ler_intervalo_serie(request.args)
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 400
+
+    conexao = None
+    cursor = None
+    try:
+        conexao, cursor = conectar_db()
+        serie = serie_progresso(cursor, periodo, de, ate, id_aluno=get_jwt_identity())
+        return jsonify({"periodo": periodo, "de": de.isoformat(), "ate": ate.isoformat(), "serie": serie}), 200
+
+    except psycopg2.Error as e:
+        print(f"Erro ao buscar progresso do aluno: {e}")
+        return jsonify({"msg": "Erro interno ao buscar o progresso."}), 500
+    finally:
+        if cursor and conexao:
+            encerrar_db(cursor, conexao)
+
+# Professor: todas as suas turmas somadas, uma turma (?turma=<anoAluno>, vazio = sem turma)
+# ou um dos seus alunos (?aluno=<idAluno>).
+@app.route('/api/professor/progresso', methods=['GET'])
+@jwt_required()
+@leitura_replica
+def obter_progresso_professor():
+    claims = get_jwt()
+    if claims.get('role') != 'professor':
+        return jsonify({"msg": "Acesso negado. Apenas para professores."}), 403
+
+    try:
+        periodo, de, ate = ler_intervalo_serie(request.args)
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 400
+    id_aluno = request.args.get('aluno', type=int)
+    if request.args.get('aluno') and id_aluno is None:
+        return jsonify({"msg": "Aluno inválido."}), 400
+
+    professor_id = get_jwt_identity()
+    conexao = None
+    cursor = None
+    try:
+        conexao, cursor = conectar_db()
+        if id_aluno is not None:
+            cursor.execute('SELECT 1 FROM Aluno WHERE idAluno = %s AND idProfessor = %s', (id_aluno, professor_id))
+            if not cursor.fetchone():
+                return jsonify({"msg": "Aluno não encontrado."}), 404
+            serie = serie_progresso(cursor, periodo, de, ate, id_aluno=id_aluno)
+        else:
+            serie = serie_progresso(cursor, periodo, de, ate, id_professor=professor_id, turma=request.args.get('turma'))
+        return jsonify({"periodo": periodo, "de": de.isoformat(), "ate": ate.isoformat(), "serie": serie}), 200
+
+    except psycopg2.Error as e:
+        print(f"Erro ao buscar progresso da turma: {e}")
+        return jsonify({"msg": "Erro interno ao buscar o progresso."}), 500
+    finally:
+        if cursor and conexao:
+            encerrar_db(cursor, conexao)
+
+# --- ROTA: EXTRATO DE MOEDAS DO ALUNO ---
+# Movimentos do mais recente para o mais antigo; ?limit (padrão 50) e ?cursor = "proximo_cursor"
+# da página anterior.
+@app.route('/api/aluno/moedas/extrato', methods=['GET'])
+@jwt_required()
+@leitura_replica
+def obter_extrato_moedas():
+    claims = get_jwt()
+    if claims.get('role') != 'aluno':
+        return jsonify({"msg": "Acesso negado. Apenas alunos."}), 403
+
+    try:
+        limite = min(max(int(request.args.get('limit', 50)), 1), 100)
+        antes = request.args.get('cursor', type=int)
+    except ValueError:
+        return jsonify({"msg": "Parâmetros de paginação inválidos."}), 400
+
+    conexao = None
+    cursor = None
+    try:
+        conexao, cursor = conectar_db()
+        movimentos = extrato_moedas(cursor, get_jwt_identity(), antes, limite + 1)
+
+        # Buscamos um item a mais só para saber se existe próxima página
+        tem_mais = len(movimentos) > limite
+        movimentos = movimentos[:limite]
+        return jsonify({
+            "movimentos": movimentos,
+            "proximo_cursor": movimentos[-1]['id'] if tem_mais else None
+        }), 200
+
+    except psycopg2.Error as e:
+        print(f"Erro ao buscar extrato de moedas: {e}")
+        return jsonify({"msg": "Erro interno ao buscar o extrato."}), 500
+    finally:
+        if cursor and conexao:
+            encerrar_db(cursor, conexao)
+
+# --- ROTA: RANKING DE MOEDAS (TOP-N E "MINHA POSIÇÃO") ---
+# Aluno: ranking dos alunos do seu professor; com ?escopo=turma, só da sua turma (anoAluno).
+# Professor: ranking dos seus alunos; com ?turma=<anoAluno>, só daquela turma.
+# Lê direto dos índices idx_aluno_ranking_*, sem ordenar a turma inteira.
+# A lista usa Aluno.moedas, que só muda quando o extrato de moedas é compactado (ver moedas.py):
+# até MOEDAS_COMPACTAR_SEGUNDOS de atraso, ou o intervalo do cron (/api/cron/compactar-moedas ou
+# "flask compactar-moedas") quando a compactação periódica está desligada (serverless.py). "meu" usa o saldo atual do aluno (o mesmo
+# do perfil), e a posição compara esse saldo com o valor compactado dos colegas.
+@app.route('/api/ranking', methods=['GET'])
+@jwt_required()
+@leitura_replica
+def obter_ranking():
+    claims = get_jwt()
+    role = claims.get('role')
+    if role not in ('aluno', 'professor'):
+        return jsonify({"msg": "Acesso negado."}), 403
+
+    usuario_id = get_jwt_identity()
+    try:
+        limite = min(max(int(request.args.get('limit', 10)), 1), 100)
+    except ValueError:
+        return jsonify({"msg": "Parâmetro limit inválido."}), 400
+
+    conexao = None
+    cursor = None
+    try:
+        conexao, cursor = conectar_db()
+        meu = None
+        if role == 'aluno':
+            por_turma = request.args.get('escopo') == 'turma'
+            # Dados do aluno e sua posição: 1 + quantos têm mais moedas (empates dividem a posição).
+            # Aluno sem turma cai no escopo do professor, como a lista abaixo.
+            cursor.execute(f"""
+                SELECT a.idProfessor, a.anoAluno, s.moedas,
+                       1 + (SELECT COUNT(*) FROM Aluno o
+                            WHERE o.idProfessor = a.idProfessor AND o.status = 'ativo' AND o.moedas > s.moedas
+                              AND o.idAluno <> a.idAluno
+                            {"AND (COALESCE(a.anoAluno, '') = '' OR o.anoAluno = a.anoAluno)" if por_turma else ''}) AS posicao
+                FROM Aluno a
+                CROSS JOIN LATERAL (SELECT {SALDO_ALUNO} AS moedas) s
+                WHERE a.idAluno = %s
+            """, (usuario_id,))
+            aluno = cursor.fetchone()
+            if not aluno:
+                return jsonify({"msg": "Aluno não encontrado."}), 404
+            professor_id = aluno['idprofessor']
+            turma = aluno['anoaluno'] if por_turma else None
+            meu = {"posicao": aluno['posicao'], "moedas": aluno['moedas']}
+        else:
+            professor_id = usuario_id
+            turma = request.args.get('turma') or None
+
+        cursor.execute(f"""
+            SELECT idAluno, nomeAluno, anoAluno, moedas
+            FROM Aluno
+            WHERE idProfessor = %s AND status = 'ativo' {'AND anoAluno = %s' if turma else ''}
+            ORDER BY moedas DESC, idAluno
+            LIMIT %s
+        """, (professor_id, turma, limite) if turma else (professor_id, limite))
+        linhas = cursor.fetchall()
+
+        # Posição com empates ("1, 2, 2, 4"), como na contagem usada para "meu"
+        ranking = []
+        for indice, linha in enumerate(linhas):
+            if indice and linha['moedas'] == linhas[indice - 1]['moedas']:
+                linha['posicao'] = ranking[-1]['posicao']
+            else:
+                linha['posicao'] = indice + 1
+            ranking.append(linha)
+
+        return jsonify({
+            "escopo": "turma" if turma else "professor",
+            "turma": turma,
+            "ranking": ranking,
+            "meu": meu
+        }), 200
+
+    except psycopg2.Error as e:
+        print(f"Erro ao buscar ranking: {e}")
+        return jsonify({"msg": "Erro interno ao buscar ranking."}), 500
+    finally:
+        if cursor and conexao:
+            encerrar_db(cursor, conexao)
+
+# --- ROTA: ANÁLISE DAS TURMAS DO PROFESSOR ---
+# Por turma e por atividade: taxa de conclusão, média e mediana das pontuações e alunos que
+# ainda não concluíram nada (ver progresso.analisar_turmas, um único comando SQL).
+# Cache por professor, conferido a cada requisição com versao_analises (no primário), então
+# conclusões, atividades e importações registradas por qualquer worker valem na hora.
+# Sem @leitura_replica: a versão e os dados vêm do primário. Uma réplica atrasada devolveria
+# análises antigas que ficariam no cache com a versão atual e passariam por novas.
+def versao_analises_professor():
+    if get_jwt().get('role') != 'professor':
+        return None
+    conexao, cursor = conectar_db()
+    try:
+        return versao_analises(cursor, get_jwt_identity())
+    except psycopg2.Error as e:
+        print(f"Erro ao ler a versão das análises: {e}")
+        return object()  # versão que nunca se repete: a rota recalcula e trata o erro
+    finally:
+        encerrar_db(cursor, conexao)
+
+@app.route('/api/professor/analises', methods=['GET'])
+@jwt_required()
+@cache_resposta('analises', ttl=600, variar_por=chave_usuario, versao=versao_analises_professor)
+def obter_analises_professor():
+    claims = get_jwt()
+    if claims.get('role') != 'professor':
+        return jsonify({"msg": "Acesso negado. Apenas para professores."}), 403
+
+    professor_id = get_jwt_identity()
+    conexao = None
+    cursor = None
+    try:
+        conexao, cursor = conectar_db()
+        return jsonify(analisar_turmas(cursor, professor_id)), 200
+
+    except psycopg2.Error as e:
+        print(f"Erro ao calcular análises do professor: {e}")
+        return jsonify({"msg": "Erro interno ao calcular as análises."}), 500
+    finally:
+        if cursor and conexao:
+            encerrar_db(cursor, conexao)
+
+# --- ROTA: PROFESSOR IMPORTA A TURMA EM LOTE (CSV OU JSON) ---
+# Tudo em poucas idas ao banco: uma consulta de duplicados, um INSERT de várias linhas e um commit.
+# As senhas são processadas em paralelo no pool de hash. Responde com um relatório por linha.
+@app.route('/api/professor/alunos/importar', methods=['POST'])
+@jwt_required()
+def importar_alunos():
+    claims = get_jwt()
+    if claims.get('role') != 'professor':
+        return jsonify({"msg": "Acesso negado. Apenas para professores."}), 403
+
+    # Import adiado: a importação em lote é rara e não precisa pesar na inicialização (serverless.py)
+    from importacao import ImportacaoInvalida, ler_linhas, validar_linhas
+
+    professor_id = get_jwt_identity()
+    try:
+        linhas = ler_linhas(request)
+    except ImportacaoInvalida as e:
+        return jsonify({"msg": str(e)}), 400
+
+    validas, relatorio = validar_linhas(linhas)
+
+    conexao = None
+    cursor = None
+    try:
+        conexao, cursor = conectar_db()
+
+        # 1. Duplicados já cadastrados, em uma única consulta
+        if validas:
+            cursor.execute(
+                "SELECT emailAluno, cpfAluno FROM Aluno WHERE emailAluno = ANY(%s) OR cpfAluno = ANY(%s)",
+                ([a['emailAluno'] for a in validas], [a['cpfAluno'] for a in validas])
+            )
+            existentes = cursor.fetchall()
+            emails = {e['emailaluno'] for e in existentes}
+            cpfs = {e['cpfaluno'] for e in existentes}
+            novos = []
+            for aluno in validas:
+                if aluno['emailAluno'] in emails or aluno['cpfAluno'] in cpfs:
+                    relatorio.append({"linha": aluno['linha'], "status": "duplicado", "msg": "Email ou CPF já cadastrados."})
+                else:
+                    novos.append(aluno)
+            validas = novos
+
+        # 2. Hash das senhas em paralelo, 3. INSERT de várias linhas em um único comando.
+        # ON CONFLICT cobre quem foi cadastrado entre a verificação e o INSERT.
+        if validas:
+            hashes = gerar_hashes([a['senhaAluno'] for a in validas])
+            inseridos = execute_values(
+                cursor,
+                """
+                INSERT INTO Aluno (nomeAluno, cpfAluno, emailAluno, senhaAluno, idProfessor, anoAluno)
+                VALUES %s
+                ON CONFLICT DO NOTHING
+                RETURNING idAluno, emailAluno
+                """,
+                [(a['nomeAluno'], a['cpfAluno'], a['emailAluno'], h, professor_id, a['anoAluno'])
+                 for a, h in zip(validas, hashes)],
+                page_size=len(validas),
+                fetch=True
+            )
+            conexao.commit()
+            invalidar_cache('analises', sub=chave_usuario('professor', professor_id))
+
+            ids_por_email = {r['emailaluno']: r['idaluno'] for r in inseridos}
+            for aluno in validas:
+                if aluno['emailAluno'] in ids_por_email:
+                    relatorio.append({"linha": aluno['linha'], "status": "criado", "idAluno": ids_por_email[aluno['emailAluno']]})
+                else:
+                    relatorio.append({"linha": aluno['linha'], "status": "duplicado", "msg": "Email ou CPF já cadastrados."})
+
+        relatorio.sort(key=lambda item: item['linha'])
+        criados = sum(1 for item in relatorio if item['status'] == 'criado')
+        return jsonify({
+            "msg": f"{criados} de {len(linhas)} alunos importados.",
+            "criados": criados,
+            "falhas": len(relatorio) - criados,
+            "relatorio": relatorio
+        }), 200
+
+    except psycopg2.Error as e:
+        if conexao:
+            conexao.rollback()
+        print(f"Erro ao importar alunos: {e}")
+        return jsonify({"msg": "Erro interno ao importar alunos."}), 500
+    finally:
+        if cursor and conexao:
+            encerrar_db(cursor, conexao)
+
 # --- ROTA: PROFESSOR CRIA ATIVIDADE (salva no banco) ---
 @app.route('/api/professor/atividades', methods=['POST'])
 @jwt_required()
@@ -644,16 +1393,29 @@ def criar_atividade_professor():
             turmas_json = _json.dumps(turmas)
         else:
             turmas_json = '[]'
+            turmas = []
+        # Turmas alvo normalizadas (sem repetição nem vazias) para a tabela AtividadeTurma
+        turmas_alvo = sorted({str(t).strip() for t in turmas if str(t).strip()})
 
+        # Atividade e suas turmas alvo em um único comando
         comando = '''
-            INSERT INTO Atividade (titulo, tipo, descricao, conteudo_json, icon, idProfessor, status, turmas)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s) RETURNING idAtividade
+            WITH nova AS (
+                INSERT INTO Atividade (titulo, tipo, descricao, conteudo_json, icon, idProfessor, status, turmas, direcionada)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING idAtividade
+            ), alvos AS (
+                INSERT INTO AtividadeTurma (idAtividade, turma)
+                SELECT nova.idAtividade, t.turma FROM nova, unnest(%s::text[]) AS t(turma)
+            )
+            SELECT idAtividade FROM nova
         '''
         cursor.execute(comando, (
-            titulo, tipo, descricao, conteudo_json, icon, professor_id, 'available', turmas_json
+            titulo, tipo, descricao, conteudo_json, icon, professor_id, 'available', turmas_json,
+            bool(turmas_alvo), turmas_alvo
         ))
         novo_id = cursor.fetchone()['idatividade']
         conexao.commit()
+        invalidar_atividade(novo_id)
+        invalidar_cache('analises', sub=chave_usuario('professor', professor_id))
         
         return jsonify({
             "msg": "Atividade criada com sucesso!", 
@@ -669,9 +1431,38 @@ def criar_atividade_professor():
         if cursor and conexao:
             encerrar_db(cursor, conexao)
 
+# Atividades visíveis para a turma do aluno (alias "at"): as sem turma alvo e as direcionadas à turma.
+# O EXISTS é uma busca pela chave primária de AtividadeTurma. FILTRO_TURMA usa o parâmetro
+# %(turma)s; FILTRO_TURMA_ALUNO lê a turma de uma CTE "aluno" (com a coluna anoAluno).
+FILTRO_TURMA = """(NOT at.direcionada OR EXISTS (
+    SELECT 1 FROM AtividadeTurma t WHERE t.idAtividade = at.idAtividade AND t.turma = %(turma)s))"""
+FILTRO_TURMA_ALUNO = """(NOT at.direcionada OR EXISTS (
+    SELECT 1 FROM AtividadeTurma t WHERE t.idAtividade = at.idAtividade AND t.turma = (SELECT anoAluno FROM aluno)))"""
+
+# Atividade no formato do frontend, como (dict, texto JSON), a partir do cache de atividades.
+# Se a linha veio sem conteúdo (estava no cache) e a entrada foi removida nesse meio tempo,
+# busca a atividade de novo. Devolve None se ela não existe mais.
+def carregar_atividade(linha):
+    pronta = obter_atividade(linha, current_app.json.dumps)
+    if pronta is not None:
+        return pronta
+    conexao, cursor = conectar_db()
+    try:
+        cursor.execute(f"SELECT {COLUNAS_ATIVIDADE} FROM Atividade at {JUNCAO_CACHE} WHERE at.idAtividade = %(id)s",
+                       {'id': linha['idatividade'], 'cache_ids': [], 'cache_versoes': []})
+        linha = cursor.fetchone()
+    finally:
+        encerrar_db(cursor, conexao)
+    return obter_atividade(linha, current_app.json.dumps) if linha else None
+
+def texto_atividade(linha):
+    pronta = carregar_atividade(linha)
+    return pronta[1] if pronta else None
+
 # --- ROTA: RETORNAR ATIVIDADES PARA O ALUNO LOGADO ---
 @app.route('/api/aluno/atividades', methods=['GET'])
 @jwt_required()
+@leitura_replica
 def listar_atividades_para_aluno():
     claims = get_jwt()
     if claims.get('role') != 'aluno':
@@ -682,33 +1473,26 @@ def listar_atividades_para_aluno():
     cursor = None
     try:
         conexao, cursor = conectar_db()
-        # Pega o idProfessor associado ao aluno (coluna idProfessor na tabela Aluno)
-        cursor.execute('SELECT idProfessor FROM Aluno WHERE idAluno = %s', (aluno_id,))
+        # Pega o idProfessor e a turma do aluno (colunas idProfessor e anoAluno na tabela Aluno)
+        cursor.execute('SELECT idProfessor, anoAluno FROM Aluno WHERE idAluno = %s', (aluno_id,))
         aluno = cursor.fetchone()
         id_prof = aluno['idprofessor'] if aluno else None
-
-        # Seleciona atividades do professor ou públicas (idProfessor is null)
-        # Ajuste conforme sua modelagem (por ex. turmas json)
-        cursor.execute("""
-            SELECT idAtividade, titulo, tipo, descricao, conteudo_json, icon, idProfessor, status, turmas
-            FROM Atividade
-            WHERE (idProfessor = %s) OR (idProfessor IS NULL)
-            ORDER BY idAtividade DESC
-        """, (id_prof,))
-        rows = cursor.fetchall()
-        activities = []
-        for r in rows:
-            activities.append({
-                "id": r['idatividade'],
-                "titulo": r['titulo'],
-                "tipo": r['tipo'],
-                "descricao": r['descricao'],
-                "conteudo_especifico": _json.loads(r['conteudo_json']) if r.get('conteudo_json') else None,
-                "icon": r.get('icon') or 'puzzle',
-                "status": r.get('status') or 'available',
-                "turmas": _json.loads(r['turmas']) if r.get('turmas') else []
-            })
-        return jsonify(activities), 200
+        turma = aluno['anoaluno'] if aluno else None
+
+        # Seleciona atividades do professor ou públicas (idProfessor is null),
+        # só as sem turma alvo ou direcionadas à turma do aluno (ver FILTRO_TURMA)
+        # O conteúdo só vem do banco para as atividades que não estão no cache (cache_atividades.py)
+        atividades = cursor_servidor(conexao, 'atividades_do_aluno', itersize=100)
+        atividades.execute(f"""
+            SELECT {COLUNAS_ATIVIDADE}
+            FROM Atividade at
+            {JUNCAO_CACHE}
+            WHERE ((at.idProfessor = %(professor)s) OR (at.idProfessor IS NULL))
+              AND {FILTRO_TURMA}
+            ORDER BY at.idAtividade DESC
+        """, {'professor': id_prof, 'turma': turma, **parametros_cache(id_professor=id_prof)})
+        # conteudo_json pode ser grande: itersize menor e cada atividade formatada só na hora de enviar
+        return resposta_json_streaming(lista_json(atividades, serializar=texto_atividade)), 200
 
     except Exception as e:
         print("Erro ao listar atividades para aluno:", e)
@@ -719,9 +1503,139 @@ def listar_atividades_para_aluno():
 
 
 
+# Dois ramos ordenados (do professor e públicas) que o Postgres junta com Merge Append
+# sobre idx_atividade_professor_id, parando assim que atinge o LIMIT.
+CONSULTA_RESUMO_ATIVIDADES = preparar('resumo_atividades', f"""
+    WITH aluno AS (SELECT idProfessor, anoAluno FROM Aluno WHERE idAluno = %(aluno)s)
+    (SELECT idAtividade, titulo, tipo, icon, status FROM Atividade at
+     WHERE idProfessor = (SELECT idProfessor FROM aluno) AND idAtividade < %(cursor)s
+       AND {FILTRO_TURMA_ALUNO})
+    UNION ALL
+    (SELECT idAtividade, titulo, tipo, icon, status FROM Atividade at
+     WHERE idProfessor IS NULL AND idAtividade < %(cursor)s
+       AND {FILTRO_TURMA_ALUNO})
+    ORDER BY idAtividade DESC
+    LIMIT %(limite)s
+""")
+
+# --- ROTA: LISTA LEVE E PAGINADA DE ATIVIDADES DO ALUNO ---
+# Só o necessário para a tela de lista (sem conteudo_json). Paginação por keyset:
+# ?limit=20&cursor=<idAtividade do último item recebido>. O conteúdo vem da rota de detalhe.
+@app.route('/api/aluno/atividades/resumo', methods=['GET'])
+@jwt_required()
+@leitura_replica
+def listar_resumo_atividades_aluno():
+    claims = get_jwt()
+    if claims.get('role') != 'aluno':
+        return jsonify({"msg": "Acesso negado. Apenas alunos."}), 403
+
+    aluno_id = get_jwt_identity()
+    try:
+        limite = min(max(int(request.args.get('limit', 20)), 1), 100)
+        cursor_id = int(request.args.get('cursor', 2147483647))
+    except ValueError:
+        return jsonify({"msg": "Parâmetros de paginação inválidos."}), 400
+
+    conexao = None
+    cursor = None
+    try:
+        conexao, cursor = conectar_db()
+        executar(cursor, CONSULTA_RESUMO_ATIVIDADES, {'aluno': aluno_id, 'cursor': cursor_id, 'limite': limite + 1})
+        rows = cursor.fetchall()
+
+        # Buscamos um item a mais só para saber se existe próxima página
+        tem_mais = len(rows) > limite
+        rows = rows[:limite]
+        atividades = [{
+            "id": r['idatividade'],
+            "titulo": r['titulo'],
+            "tipo": r['tipo'],
+            "icon": r.get('icon') or 'puzzle',
+            "status": r.get('status') or 'available',
+        } for r in rows]
+        return jsonify({
+            "atividades": atividades,
+            "proximo_cursor": rows[-1]['idatividade'] if tem_mais else None
+        }), 200
+
+    except psycopg2.Error as e:
+        print(f"Erro ao listar resumo de atividades: {e}")
+        return jsonify({"msg": "Erro interno ao buscar atividades."}), 500
+    finally:
+        if cursor and conexao:
+            encerrar_db(cursor, conexao)
+
+# --- ROTA: DETALHE (CONTEÚDO COMPLETO) DE UMA ATIVIDADE PARA O ALUNO ---
+@app.route('/api/aluno/atividades/<int:id_atividade>', methods=['GET'])
+@jwt_required()
+@leitura_replica
+def obter_atividade_aluno(id_atividade):
+    claims = get_jwt()
+    if claims.get('role') != 'aluno':
+        return jsonify({"msg": "Acesso negado. Apenas alunos."}), 403
+
+    aluno_id = get_jwt_identity()
+    conexao = None
+    cursor = None
+    try:
+        conexao, cursor = conectar_db()
+        # Só devolve atividades do professor do aluno ou públicas
+        cursor.execute(f"""
+            WITH aluno AS (SELECT idProfessor, anoAluno FROM Aluno WHERE idAluno = %(aluno)s)
+            SELECT {COLUNAS_ATIVIDADE}
+            FROM Atividade at
+            {JUNCAO_CACHE}
+            WHERE at.idAtividade = %(id)s
+              AND (at.idProfessor IS NULL
+                   OR at.idProfessor = (SELECT idProfessor FROM aluno))
+              AND {FILTRO_TURMA_ALUNO}
+        """, {'id': id_atividade, 'aluno': aluno_id, **parametros_cache(id_atividade=id_atividade)})
+        linha = cursor.fetchone()
+        atividade = carregar_atividade(linha) if linha else None
+        if not atividade:
+            return jsonify({"msg": "Atividade não encontrada."}), 404
+        return jsonify(atividade[0]), 200
+
+    except Exception as e:
+        print("Erro ao buscar atividade:", e)
+        return jsonify({"msg": "Erro interno ao buscar atividade."}), 500
+    finally:
+        if cursor and conexao:
+            encerrar_db(cursor, conexao)
+
+# Normaliza o termo do mesmo jeito que o índice: minúsculo e sem acentos ("João" -> "joao")
+def normalizar_busca(texto):
+    sem_acento = ''.join(c for c in unicodedata.normalize('NFKD', texto) if not unicodedata.combining(c))
+    return sem_acento.lower()
+
+# Escapa os curingas do LIKE para que "%" e "_" digitados sejam tratados como texto
+def escapar_like(texto):
+    return texto.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+# Cursor da busca: a chave de ordenação da última linha devolvida (faixa, similaridade, nome, id),
+# em base64 para o frontend tratá-lo como um texto opaco
+def codificar_cursor_busca(linha):
+    chave = [linha['faixa'], linha['semelhanca'], linha['nomealuno'], linha['idaluno']]
+    return base64.urlsafe_b64encode(_json.dumps(chave).encode('utf-8')).decode('ascii')
+
+# Levanta ValueError se o cursor não veio de codificar_cursor_busca
+def ler_cursor_busca(texto):
+    chave = _json.loads(base64.urlsafe_b64decode(texto.encode('ascii')))
+    if (not isinstance(chave, list) or len(chave) != 4 or not isinstance(chave[0], int)
+            or not isinstance(chave[1], (int, float)) or not isinstance(chave[2], str) or not isinstance(chave[3], int)):
+        raise ValueError("Cursor inválido.")
+    return chave
+
 # --- NOVA ROTA PARA BUSCAR ALUNOS POR NOME ---
+# Busca sem acento usando o índice de trigramas (idx_aluno_nome_trgm).
+# Ordem: nome começando pelo termo, depois alguma palavra começando pelo termo, depois similaridade.
+# Parâmetros: nome (obrigatório), limit (padrão 20), cursor (vem do header X-Proximo-Cursor)
+# e email=1 para procurar também no email (automático quando o termo tem "@").
+# Paginação por keyset: a próxima página começa depois da chave da última linha, então alunos
+# cadastrados ou alterados entre as páginas não fazem linhas se repetirem ou sumirem.
 @app.route('/api/professor/alunos/buscar', methods=['GET'])
 @jwt_required()
+@leitura_replica
 def buscar_alunos_por_nome():
     claims = get_jwt()
     if claims.get('role') != 'professor':
@@ -736,26 +1650,71 @@ def buscar_alunos_por_nome():
     if len(termo_busca) < 2:
         return jsonify([]) # Retorna uma lista vazia se a busca for muito curta
 
+    try:
+        limite = min(max(int(request.args.get('limit', 20)), 1), 50)
+        apos = ler_cursor_busca(request.args['cursor']) if request.args.get('cursor') else None
+    except ValueError:
+        return jsonify({"msg": "Parâmetros de paginação inválidos."}), 400
+
+    termo = normalizar_busca(termo_busca)
+    termo_like = escapar_like(termo)
+    incluir_email = '@' in termo_busca or request.args.get('email') == '1'
+
     conexao = None
     cursor = None
     try:
         conexao, cursor = conectar_db()
-        
-        # O operador ILIKE é case-insensitive (não diferencia maiúsculas/minúsculas)
-        # Os '%' são curingas: buscam qualquer coisa antes e depois do termo
-        query = """
-            SELECT idAluno, nomeAluno, emailAluno, status, moedas, nivel, anoAluno 
-            FROM Aluno 
-            WHERE idProfessor = %s AND nomeAluno ILIKE %s
-            ORDER BY nomeAluno
+
+        filtro_email = "OR lower(emailAluno) LIKE %(contem)s" if incluir_email else ""
+        # A similaridade é decrescente: comparada negada para caber em uma única comparação de linhas
+        filtro_cursor = """
+            WHERE (a.faixa, -a.semelhanca, a.nomeAluno, a.idAluno)
+                > (%(apos_faixa)s::int, -%(apos_semelhanca)s::real, %(apos_nome)s::varchar, %(apos_id)s::int)
+        """ if apos else ""
+        query = f"""
+            SELECT a.idAluno, a.nomeAluno, a.emailAluno, a.status, {SALDO_ALUNO} AS moedas, a.nivel, a.anoAluno,
+                   a.faixa, a.semelhanca
+            FROM (
+                SELECT idAluno, nomeAluno, emailAluno, status, moedas, nivel, anoAluno,
+                    CASE
+                        WHEN lower(f_unaccent(nomeAluno)) LIKE %(prefixo)s THEN 0
+                        WHEN lower(f_unaccent(nomeAluno)) LIKE %(prefixo_palavra)s THEN 1
+                        ELSE 2
+                    END AS faixa,
+                    similarity(lower(f_unaccent(nomeAluno)), %(termo)s) AS semelhanca
+                FROM Aluno
+                WHERE idProfessor = %(professor)s
+                  AND (lower(f_unaccent(nomeAluno)) LIKE %(contem)s {filtro_email})
+            ) a
+            {filtro_cursor}
+            ORDER BY a.faixa, a.semelhanca DESC, a.nomeAluno, a.idAluno
+            LIMIT %(limite)s
         """
-        # Formata o termo de busca para a query SQL
-        termo_formatado = f"%{termo_busca}%"
-        
-        cursor.execute(query, (professor_id, termo_formatado))
+        apos_faixa, apos_semelhanca, apos_nome, apos_id = apos or (None, None, None, None)
+        cursor.execute(query, {
+            'professor': professor_id,
+            'termo': termo,
+            'contem': f"%{termo_like}%",
+            'prefixo': f"{termo_like}%",
+            'prefixo_palavra': f"% {termo_like}%",
+            'limite': limite + 1,
+            'apos_faixa': apos_faixa,
+            'apos_semelhanca': apos_semelhanca,
+            'apos_nome': apos_nome,
+            'apos_id': apos_id,
+        })
         alunos_encontrados = cursor.fetchall()
-        
-        return jsonify(alunos_encontrados), 200
+        pagina = alunos_encontrados[:limite]
+        proximo_cursor = codificar_cursor_busca(pagina[-1]) if len(alunos_encontrados) > limite else None
+        for aluno in pagina:
+            del aluno['faixa'], aluno['semelhanca']
+
+        # Um item a mais indica que há próxima página; o cursor vai no header
+        # para manter a resposta como uma lista simples
+        resposta = jsonify(pagina)
+        if proximo_cursor:
+            resposta.headers['X-Proximo-Cursor'] = proximo_cursor
+        return resposta, 200
 
     except psycopg2.Error as e:
         print(f"Erro ao buscar alunos: {e}")
@@ -767,6 +1726,7 @@ def buscar_alunos_por_nome():
 # --- ROTA PARA OBTER DADOS DO PERFIL DO PROFESSOR LOGADO ---
 @app.route('/api/professor/perfil', methods=['GET'])
 @jwt_required()
+@leitura_replica
 def get_professor_perfil():
     claims = get_jwt()
     if claims.get('role') != 'professor':
@@ -790,6 +1750,7 @@ def get_professor_perfil():
         turmas_raw = cursor.fetchall()
         # Converte a lista de dicionários para uma lista de strings
         professor_data['turmas'] = [turma['anoaluno'] for turma in turmas_raw if turma['anoaluno']]
+        professor_data['urlfotoperfil'], professor_data['urlfotominiatura'] = urls_foto(professor_data['urlfotoperfil'])
 
         return jsonify(professor_data), 200
 
@@ -822,6 +1783,7 @@ def update_professor_perfil():
         conexao, cursor = conectar_db()
         cursor.execute('UPDATE Professor SET nomeProfessor = %s WHERE idProfessor = %s', (novo_nome, professor_id))
         conexao.commit()
+        invalidar_cache('professores_publico')
         
         # Atualiza o nome no localStorage do frontend
         return jsonify({"msg": "Perfil atualizado com sucesso!", "novoNome": novo_nome}), 200
@@ -0,0 +1,340 @@
+# asgi.py
+# Modo de serviço assíncrono (ASGI):  uvicorn asgi:app --workers 2
+#
+# As rotas mais quentes dos alunos (login, perfil, lista de atividades e lista pública de
+# professores) rodam nativamente em um event loop com asyncpg, e o hash de senha fica no
+# pool de processos de hashing.py, então um processo segura milhares de conexões abertas.
+# Todas as outras rotas continuam sendo atendidas pelo app Flask (app.py), executado em
+# threads pelo adaptador WSGI. Rotas, claims do JWT e formato dos JSON são os mesmos;
+# o modo síncrono (gunicorn app:app) continua disponível para comparação no benchmark.py.
+
+import asyncio
+import contextvars
+import hashlib
+import itertools
+import json
+import time
+from contextlib import asynccontextmanager
+from datetime import date
+from decimal import Decimal
+
+import asyncpg
+import jwt as pyjwt
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Mount, Route
+from werkzeug.http import http_date
+from flask_jwt_extended import create_access_token, decode_token
+
+import metricas
+from app import app as app_flask, FILTRO_TURMA_ALUNO
+from config import (DATABASE_URL, DATABASE_REPLICA_URLS, MASTER_EMAIL, MASTER_PASSWORD, ASGI_DB_POOL_MIN,
+                    ASGI_DB_POOL_MAX, EXPOR_IDAS_DB, METRICAS_ATIVAS)
+from hashing import FilaHashCheia, gerar_hash_async, verificar_hash_async, precisa_rehash
+from fotos import urls_foto
+from status_contas import obter_em_cache, guardar_status, CONSULTAS_STATUS
+from replicas import escrita_recente
+from moedas import SALDO_ALUNO
+
+_pool = None
+_pools_replica = []
+_proxima_replica = itertools.count()
+_idas_db = contextvars.ContextVar('idas_db', default=0)
+
+COMANDOS_REHASH = {
+    'professor': 'UPDATE Professor SET senhaProfessor = $1 WHERE idProfessor = $2',
+    'aluno': 'UPDATE Aluno SET senhaAluno = $1 WHERE idAluno = $2',
+}
+
+
+# --- Banco (asyncpg) ---
+# Um pool por processo do uvicorn (mais um por réplica de leitura), aberto no startup e fechado no shutdown
+@asynccontextmanager
+async def ciclo_de_vida(aplicacao):
+    global _pool
+    _pool = await asyncpg.create_pool(DATABASE_URL, min_size=ASGI_DB_POOL_MIN, max_size=ASGI_DB_POOL_MAX)
+    for url in DATABASE_REPLICA_URLS:
+        try:
+            _pools_replica.append(await asyncpg.create_pool(url, min_size=ASGI_DB_POOL_MIN, max_size=ASGI_DB_POOL_MAX))
+        except (OSError, asyncpg.PostgresError) as e:
+            print(f"Réplica de leitura indisponível, ignorada: {e}")
+    try:
+        yield
+    finally:
+        for pool in _pools_replica:
+            await pool.close()
+        _pools_replica.clear()
+        await _pool.close()
+
+
+# Pool para rotas só de leitura (mesma regra do @leitura_replica do app.py): réplica em rodízio,
+# exceto logo após uma escrita do usuário. As escritas passam pelo app Flask montado, que marca a
+# janela em replicas.marcar_escrita() (tabela compartilhada entre os processos da máquina).
+def pool_leitura(claims=None):
+    if not _pools_replica:
+        return _pool
+    if claims is not None and escrita_recente(f"{claims.get('role')}:{claims.get('sub')}"):
+        return _pool
+    return _pools_replica[next(_proxima_replica) % len(_pools_replica)]
+
+
+async def _medir(conexao, metodo, sql, *args):
+    _idas_db.set(_idas_db.get() + 1)
+    inicio = time.perf_counter()
+    resultado = await getattr(conexao, metodo)(sql, *args)
+    if METRICAS_ATIVAS:
+        linhas = len(resultado) if isinstance(resultado, list) else int(resultado is not None)
+        metricas.registrar_consulta(sql, time.perf_counter() - inicio, linhas)
+    return resultado
+
+
+async def buscar_um(conexao, sql, *args):
+    linha = await _medir(conexao, 'fetchrow', sql, *args)
+    return dict(linha) if linha else None
+
+
+async def buscar_todos(conexao, sql, *args):
+    return [dict(linha) for linha in await _medir(conexao, 'fetch', sql, *args)]
+
+
+async def executar(conexao, sql, *args):
+    return await _medir(conexao, 'execute', sql, *args)
+
+
+# --- Respostas no mesmo formato do jsonify do Flask ---
+def _padrao_json(valor):
+    if isinstance(valor, date):
+        return http_date(valor)
+    if isinstance(valor, Decimal):
+        return str(valor)
+    raise TypeError(f"Objeto do tipo {type(valor).__name__} não é serializável em JSON")
+
+
+def resposta_json(dados, status=200):
+    corpo = json.dumps(dados, default=_padrao_json, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return Response(corpo, status_code=status, media_type='application/json')
+
+
+# --- JWT: mesmos tokens e mensagens de erro do flask_jwt_extended ---
+class ErroAutenticacao(Exception):
+    def __init__(self, msg, status):
+        super().__init__(msg)
+        self.msg = msg
+        self.status = status
+
+
+def claims_do_token(request):
+    autorizacao = request.headers.get('Authorization')
+    if not autorizacao:
+        raise ErroAutenticacao("Missing Authorization Header", 401)
+    partes = autorizacao.split()
+    if len(partes) != 2 or partes[0] != 'Bearer':
+        raise ErroAutenticacao("Bad Authorization header. Expected 'Authorization: Bearer <JWT>'", 422)
+    try:
+        with app_flask.app_context():
+            claims = decode_token(partes[1])
+    except pyjwt.ExpiredSignatureError:
+        raise ErroAutenticacao("Token has expired", 401)
+    except pyjwt.InvalidTokenError as e:
+        raise ErroAutenticacao(str(e), 422)
+    if claims.get('type') != 'access':
+        raise ErroAutenticacao("Only non-refresh tokens are allowed", 422)
+    return claims
+
+
+# Mesma regra do token_in_blocklist_loader do app.py, com o mesmo cache de status
+async def verificar_status_conta(claims):
+    papel = claims.get('role')
+    if papel not in CONSULTAS_STATUS:
+        return
+    encontrado, status, versao = obter_em_cache(papel, claims['sub'])
+    if not encontrado:
+        async with _pool.acquire() as conexao:
+            linha = await buscar_um(conexao, CONSULTAS_STATUS[papel].replace('%s', '$1'), int(claims['sub']))
+        status = linha['status'] if linha else None
+        guardar_status(papel, claims['sub'], status, versao)
+    if status != 'ativo':
+        raise ErroAutenticacao("Sua conta está bloqueada ou foi removida.", 401)
+
+
+def criar_token(identity, role):
+    with app_flask.app_context():
+        return create_access_token(identity=identity, additional_claims={"role": role})
+
+
+# Envolve as rotas nativas: métricas, CORS (o preflight OPTIONS continua com o Flask-CORS),
+# contagem de idas ao banco e os mesmos erros padrão do app Flask.
+def rota_nativa(handler):
+    async def envolvida(request):
+        inicio = time.perf_counter()
+        _idas_db.set(0)
+        try:
+            resposta = await handler(request)
+        except ErroAutenticacao as e:
+            resposta = resposta_json({"msg": e.msg}, e.status)
+        except (FilaHashCheia, asyncio.TimeoutError) as e:
+            # Antes do OSError: no Python 3.11+ o TimeoutError do hash (HASH_TIMEOUT) é um OSError
+            print(f"Hash de senha indisponível: {e!r}")
+            resposta = resposta_json({"msg": "Servidor sobrecarregado, tente novamente em instantes."}, 503)
+        except (asyncpg.PostgresError, OSError) as e:
+            print(f"Erro de Banco de Dados em {request.url.path}: {e}")
+            resposta = resposta_json({"msg": "Erro interno no servidor."}, 500)
+        resposta.headers['Access-Control-Allow-Origin'] = '*'
+        if EXPOR_IDAS_DB:
+            resposta.headers['X-DB-Idas'] = str(_idas_db.get())
+        if METRICAS_ATIVAS:
+            # As rotas nativas não têm parâmetros no caminho, então a URL já é o padrão da rota
+            metricas.registrar_requisicao(request.url.path, request.method, resposta.status_code, time.perf_counter() - inicio)
+        return resposta
+    return envolvida
+
+
+# --- ROTAS NATIVAS ---
+@rota_nativa
+async def login(request: Request):
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        return resposta_json({"msg": "Email e senha são obrigatórios."}, 400)
+    email = data.get('email', None)
+    senha = data.get('senha', None)
+
+    if not email or not senha:
+        return resposta_json({"msg": "Email e senha são obrigatórios."}, 400)
+
+    if email == MASTER_EMAIL and senha == MASTER_PASSWORD:
+        return resposta_json({"access_token": criar_token("admin_01", "adm"), "user_role": "adm", "user_name": "Administrador"})
+
+    # A conexão é devolvida antes do hash: ninguém segura conexão do pool esperando o KDF
+    async with _pool.acquire() as conexao:
+        credenciais = await buscar_todos(
+            conexao,
+            'SELECT papel, id, nome, senha, status FROM CredencialUsuario WHERE email = $1 ORDER BY prioridade',
+            email
+        )
+
+    for credencial in credenciais:
+        if not await verificar_hash_async(credencial['senha'], senha):
+            continue
+        if credencial['status'] != 'ativo':
+            return resposta_json({"msg": f"Sua conta de {credencial['papel']} está bloqueada."}, 403)
+
+        if precisa_rehash(credencial['senha']):
+            try:
+                novo_hash = await gerar_hash_async(senha)
+                async with _pool.acquire() as conexao:
+                    await executar(conexao, COMANDOS_REHASH[credencial['papel']], novo_hash, credencial['id'])
+            except (asyncpg.PostgresError, FilaHashCheia, asyncio.TimeoutError) as e:
+                print(f"Erro ao refazer hash de senha: {e!r}")
+
+        return resposta_json({
+            "access_token": criar_token(str(credencial['id']), credencial['papel']),
+            "user_role": credencial['papel'],
+            "user_name": credencial['nome']
+        })
+
+    return resposta_json({"msg": "Email ou senha inválidos."}, 401)
+
+
+@rota_nativa
+async def get_aluno_perfil(request: Request):
+    claims = claims_do_token(request)
+    await verificar_status_conta(claims)
+    if claims.get('role') != 'aluno':
+        return resposta_json({"msg": "Acesso negado. Apenas para alunos."}, 403)
+
+    async with pool_leitura(claims).acquire() as conexao:
+        aluno_data = await buscar_um(conexao, f"""
+            SELECT
+                a.nomeAluno, a.emailAluno, {SALDO_ALUNO} AS moedas, a.nivel, a.anoAluno, a.urlFotoPerfil,
+                p.nomeProfessor,
+                r.total_concluidas, r.total_pontuadas, r.soma_pontuacao, r.melhor_pontuacao, r.ultima_atividade
+            FROM Aluno a
+            LEFT JOIN Professor p ON a.idProfessor = p.idProfessor
+            LEFT JOIN ResumoProgressoAluno r ON r.idAluno = a.idAluno
+            WHERE a.idAluno = $1
+        """, int(claims['sub']))
+
+    if not aluno_data:
+        return resposta_json({"msg": "Aluno não encontrado."}, 404)
+
+    total_pontuadas = aluno_data.pop('total_pontuadas') or 0
+    soma_pontuacao = aluno_data.pop('soma_pontuacao') or 0
+    aluno_data['total_atividades_concluidas'] = aluno_data.pop('total_concluidas') or 0
+    aluno_data['media_geral'] = int(soma_pontuacao / total_pontuadas) if total_pontuadas else 0
+    aluno_data['urlfotoperfil'], aluno_data['urlfotominiatura'] = urls_foto(aluno_data['urlfotoperfil'], str(request.base_url))
+    return resposta_json(aluno_data)
+
+
+@rota_nativa
+async def listar_resumo_atividades_aluno(request: Request):
+    claims = claims_do_token(request)
+    await verificar_status_conta(claims)
+    if claims.get('role') != 'aluno':
+        return resposta_json({"msg": "Acesso negado. Apenas alunos."}, 403)
+
+    try:
+        limite = min(max(int(request.query_params.get('limit', 20)), 1), 100)
+        cursor_id = int(request.query_params.get('cursor', 2147483647))
+    except ValueError:
+        return resposta_json({"msg": "Parâmetros de paginação inválidos."}, 400)
+
+    async with pool_leitura(claims).acquire() as conexao:
+        rows = await buscar_todos(conexao, f"""
+            WITH aluno AS (SELECT idProfessor, anoAluno FROM Aluno WHERE idAluno = $1)
+            (SELECT idAtividade, titulo, tipo, icon, status FROM Atividade at
+             WHERE idProfessor = (SELECT idProfessor FROM aluno) AND idAtividade < $2
+               AND {FILTRO_TURMA_ALUNO})
+            UNION ALL
+            (SELECT idAtividade, titulo, tipo, icon, status FROM Atividade at
+             WHERE idProfessor IS NULL AND idAtividade < $2
+               AND {FILTRO_TURMA_ALUNO})
+            ORDER BY idAtividade DESC
+            LIMIT $3
+        """, int(claims['sub']), cursor_id, limite + 1)
+
+    tem_mais = len(rows) > limite
+    rows = rows[:limite]
+    return resposta_json({
+        "atividades": [{
+            "id": r['idatividade'],
+            "titulo": r['titulo'],
+            "tipo": r['tipo'],
+            "icon": r.get('icon') or 'puzzle',
+            "status": r.get('status') or 'available',
+        } for r in rows],
+        "proximo_cursor": rows[-1]['idatividade'] if tem_mais else None
+    })
+
+
+@rota_nativa
+async def listar_professores_publico(request: Request):
+    async with pool_leitura().acquire() as conexao:
+        professores = await buscar_todos(
+            conexao, "SELECT idProfessor, nomeProfessor FROM Professor WHERE status = 'ativo' ORDER BY nomeProfessor"
+        )
+    # Mesma ETag forte + revalidação da versão Flask (cache_respostas.py)
+    resposta = resposta_json(professores)
+    etag = hashlib.sha1(resposta.body).hexdigest()
+    if etag in request.headers.get('If-None-Match', '').replace('"', '').replace('W/', '').split(', '):
+        resposta = Response(status_code=304)
+    resposta.headers['ETag'] = f'"{etag}"'
+    resposta.headers['Cache-Control'] = 'no-cache'
+    return resposta
+
+
+app = Starlette(
+    routes=[
+        Route('/api/login', login, methods=['POST']),
+        Route('/api/aluno/perfil', get_aluno_perfil, methods=['GET']),
+        Route('/api/aluno/atividades/resumo', listar_resumo_atividades_aluno, methods=['GET']),
+        Route('/api/professores/lista', listar_professores_publico, methods=['GET']),
+        # Todo o resto (e outros métodos nas mesmas URLs) vai para o app Flask
+        Mount('/', app=WSGIMiddleware(app_flask)),
+    ],
+    lifespan=ciclo_de_vida,
+)
@@ -0,0 +1,435 @@
+# benchmark.py
+# Benchmark HTTP reprodutível das rotas do app.py, 100% offline em uma máquina Linux.
+#
+# Sobe um PostgreSQL descartável (initdb em um diretório temporário), aplica o init.sql,
+# popula com dados sintéticos, inicia o app e executa jornadas de usuário com várias threads.
+# Para cada rota mede requisições/s, latência p50/p95/p99 e idas ao banco por requisição
+# (header X-DB-Idas; "n/m" nas rotas em streaming, que o app não consegue contar), e salva tudo
+# em JSON para comparar entre commits.
+#
+# Uso:
+#   python benchmark.py                                  # roda tudo com os padrões
+#   python benchmark.py --duracao 20 --concorrencia 32
+#   python benchmark.py --jornadas login,conclusoes
+#   python benchmark.py --servidor gunicorn --workers 4
+#   python benchmark.py --servidor uvicorn --workers 2        # modo assíncrono (asgi.py)
+#   python benchmark.py --comparar benchmark_resultados/anterior.json
+#   python benchmark.py --replica                        # leituras em uma réplica local (streaming)
+#
+# Requer os binários do PostgreSQL (initdb, pg_ctl) com as extensões contrib (unaccent, pg_trgm).
+
+import argparse
+import glob
+import http.client
+import json
+import math
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from urllib.parse import quote
+
+DIRETORIO = os.path.dirname(os.path.abspath(__file__))
+SENHA_PADRAO = 'senha123'
+
+
+# --- PostgreSQL descartável ---
+def localizar_binario(nome):
+    caminho = shutil.which(nome)
+    if caminho:
+        return caminho
+    candidatos = sorted(glob.glob(f'/usr/lib/postgresql/*/bin/{nome}')) + glob.glob(f'/usr/local/pgsql/bin/{nome}')
+    if not candidatos:
+        sys.exit(f"Binário '{nome}' do PostgreSQL não encontrado (instale o servidor PostgreSQL).")
+    return candidatos[-1]
+
+
+def porta_livre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class PostgresDescartavel:
+    def __init__(self):
+        self.diretorio = tempfile.mkdtemp(prefix='bench_pg_')
+        self.dados = os.path.join(self.diretorio, 'dados')
+        self.porta = porta_livre()
+        self.url = f'postgresql://postgres@127.0.0.1:{self.porta}/postgres'
+
+    # Com "primario", a instância é uma réplica física dele (pg_basebackup -R + streaming),
+    # para testar o roteamento de leituras (DATABASE_REPLICA_URLS) com dois PostgreSQL locais.
+    def iniciar(self, primario=None):
+        if primario is None:
+            subprocess.run([localizar_binario('initdb'), '-D', self.dados, '-U', 'postgres', '--auth=trust', '-E', 'UTF8'],
+                           check=True, stdout=subprocess.DEVNULL)
+        else:
+            subprocess.run([localizar_binario('pg_basebackup'), '-h', '127.0.0.1', '-p', str(primario.porta),
+                            '-U', 'postgres', '-D', self.dados, '-R', '-X', 'stream'],
+                           check=True, stdout=subprocess.DEVNULL)
+        opcoes = f"-p {self.porta} -k {self.diretorio} -c listen_addresses=127.0.0.1 -c fsync=off -c max_connections=300"
+        subprocess.run([localizar_binario('pg_ctl'), '-D', self.dados, '-o', opcoes, '-w', '-l',
+                        os.path.join(self.diretorio, 'postgres.log'), 'start'], check=True, stdout=subprocess.DEVNULL)
+
+    def parar(self):
+        subprocess.run([localizar_binario('pg_ctl'), '-D', self.dados, '-m', 'fast', 'stop'],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        shutil.rmtree(self.diretorio, ignore_errors=True)
+
+
+def popular_banco(url, professores, alunos, atividades):
+    import psycopg2
+    from werkzeug.security import generate_password_hash
+    from config import HASH_METODO
+
+    conexao = psycopg2.connect(url)
+    cursor = conexao.cursor()
+    with open(os.path.join(DIRETORIO, 'init.sql'), encoding='utf-8') as arquivo:
+        cursor.execute(arquivo.read())
+
+    # Um único hash reaproveitado por todos: o custo do KDF não interessa na carga inicial
+    senha_hash = generate_password_hash(SENHA_PADRAO, HASH_METODO)
+    cursor.execute("""
+        INSERT INTO Professor (nomeProfessor, cpfProfessor, emailProfessor, senhaProfessor)
+        SELECT 'Professor ' || i, lpad(i::text, 11, '0'), 'prof' || i || '@bench', %(hash)s
+        FROM generate_series(1, %(professores)s) i
+    """, {'hash': senha_hash, 'professores': professores})
+    cursor.execute("""
+        INSERT INTO Aluno (nomeAluno, cpfAluno, emailAluno, senhaAluno, idProfessor, anoAluno, moedas)
+        SELECT (ARRAY['João', 'Maria', 'José', 'Ana', 'Antônio', 'Letícia', 'Conceição', 'Luís'])[1 + i %% 8]
+                   || ' Silva ' || i,
+               lpad((100000000 + i)::text, 11, '0'), 'aluno' || i || '@bench', %(hash)s,
+               1 + i %% %(professores)s, (1 + i %% 3) || 'º Ano', 100 + (i * 37) %% 500
+        FROM generate_series(1, %(alunos)s) i
+    """, {'hash': senha_hash, 'professores': professores, 'alunos': alunos})
+    cursor.execute("""
+        INSERT INTO Atividade (titulo, tipo, descricao, conteudo_json, icon, idProfessor, status, turmas, direcionada)
+        SELECT 'Atividade ' || i, 'acentuacao', 'Descrição da atividade ' || i,
+               json_build_object('frases', (SELECT json_agg('Frase de exemplo número ' || j) FROM generate_series(1, 20) j))::text,
+               'puzzle', 1 + i %% %(professores)s, 'available', json_build_array((1 + i %% 3) || 'º Ano')::text, TRUE
+        FROM generate_series(1, %(atividades)s) i
+    """, {'professores': professores, 'atividades': atividades})
+    cursor.execute("""
+        INSERT INTO AtividadeTurma (idAtividade, turma)
+        SELECT idAtividade, jsonb_array_elements_text(turmas::jsonb) FROM Atividade
+    """)
+    conexao.commit()
+    cursor.execute('ANALYZE')
+    conexao.close()
+
+
+# Espera a réplica aplicar tudo o que o primário já gravou (dados de teste incluídos)
+def aguardar_replica(url_primario, url_replica, limite=60):
+    import psycopg2
+    with psycopg2.connect(url_primario) as conexao, conexao.cursor() as cursor:
+        cursor.execute('SELECT pg_current_wal_lsn()')
+        lsn = cursor.fetchone()[0]
+    prazo = time.monotonic() + limite
+    with psycopg2.connect(url_replica) as conexao, conexao.cursor() as cursor:
+        while time.monotonic() < prazo:
+            cursor.execute('SELECT pg_last_wal_replay_lsn() >= %s::pg_lsn', (lsn,))
+            if cursor.fetchone()[0]:
+                return
+            conexao.rollback()
+            time.sleep(0.2)
+    sys.exit("A réplica não alcançou o primário a tempo.")
+
+
+# --- Servidor ---
+def iniciar_servidor(args, porta):
+    if args.servidor == 'gunicorn':
+        processo = subprocess.Popen(
+            ['gunicorn', '-w', str(args.workers), '--threads', str(args.threads), '-b', f'127.0.0.1:{porta}', 'app:app'],
+            cwd=DIRETORIO, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        aguardar_porta(porta)
+        return processo.terminate
+
+    if args.servidor == 'uvicorn':
+        processo = subprocess.Popen(
+            ['uvicorn', 'asgi:app', '--workers', str(args.workers), '--host', '127.0.0.1', '--port', str(porta),
+             '--log-level', 'warning', '--no-access-log'],
+            cwd=DIRETORIO, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        aguardar_porta(porta)
+        return processo.terminate
+
+    from werkzeug.serving import make_server
+    from app import app
+    servidor = make_server('127.0.0.1', porta, app, threaded=True)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    aguardar_porta(porta)
+    return servidor.shutdown
+
+
+def aguardar_porta(porta, limite=30):
+    prazo = time.monotonic() + limite
+    while time.monotonic() < prazo:
+        try:
+            socket.create_connection(('127.0.0.1', porta), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    sys.exit(f"O servidor não respondeu na porta {porta}.")
+
+
+# --- Cliente HTTP ---
+class Cliente:
+    def __init__(self, porta):
+        self.porta = porta
+        self.conexao = http.client.HTTPConnection('127.0.0.1', porta, timeout=60)
+
+    def requisitar(self, metodo, caminho, corpo=None, token=None):
+        cabecalhos = {'Content-Type': 'application/json'}
+        if token:
+            cabecalhos['Authorization'] = f'Bearer {token}'
+        dados = json.dumps(corpo) if corpo is not None else None
+        for tentativa in range(2):
+            try:
+                self.conexao.request(metodo, caminho, body=dados, headers=cabecalhos)
+                resposta = self.conexao.getresponse()
+                conteudo = resposta.read()
+                idas = resposta.getheader('X-DB-Idas', '0')
+                return resposta.status, conteudo, int(idas) if idas.isdigit() else None
+            except (http.client.HTTPException, OSError):
+                # Conexão keep-alive fechada pelo servidor: reabre e tenta de novo uma vez
+                self.conexao.close()
+                self.conexao = http.client.HTTPConnection('127.0.0.1', self.porta, timeout=60)
+                if tentativa:
+                    raise
+
+
+def login(cliente, email, senha):
+    status, conteudo, _ = cliente.requisitar('POST', '/api/login', {'email': email, 'senha': senha})
+    if status != 200:
+        sys.exit(f"Login de {email} falhou ({status}): {conteudo[:200]!r}")
+    return json.loads(conteudo)['access_token']
+
+
+# --- Jornadas ---
+# Cada passo devolve (rótulo, método, caminho, corpo, token). Os rótulos usam o padrão da rota,
+# não a URL concreta, para agregar as medições por endpoint.
+# "aleatorio" é o random.Random do usuário virtual, semeado a partir de --semente.
+def jornadas(contexto):
+    def admin(aleatorio):
+        yield ('POST /api/login (adm)', 'POST', '/api/login', {'email': contexto['admin_email'], 'senha': contexto['admin_senha']}, None)
+        yield ('GET /api/professores', 'GET', '/api/professores', None, contexto['token_admin'])
+        yield ('GET /api/professores/lista', 'GET', '/api/professores/lista', None, None)
+
+    def professor(aleatorio):
+        token = aleatorio.choice(contexto['tokens_professor'])
+        yield ('GET /api/professor/alunos', 'GET', '/api/professor/alunos', None, token)
+        yield ('GET /api/professor/perfil', 'GET', '/api/professor/perfil', None, token)
+        termo = aleatorio.choice(['jo', 'joão', 'mar', 'conc', 'silva 1'])
+        yield ('GET /api/professor/alunos/buscar', 'GET', f'/api/professor/alunos/buscar?nome={quote(termo)}', None, token)
+        yield ('GET /api/ranking (professor)', 'GET', '/api/ranking?limit=10', None, token)
+
+    def aluno(aleatorio):
+        token = aleatorio.choice(contexto['tokens_aluno'])
+        yield ('GET /api/aluno/perfil', 'GET', '/api/aluno/perfil', None, token)
+        yield ('GET /api/aluno/atividades', 'GET', '/api/aluno/atividades', None, token)
+        yield ('GET /api/aluno/atividades/resumo', 'GET', '/api/aluno/atividades/resumo?limit=20', None, token)
+        yield ('GET /api/aluno/atividades/<id>', 'GET', f"/api/aluno/atividades/{aleatorio.choice(contexto['atividades'])}", None, token)
+        yield ('GET /api/ranking (aluno)', 'GET', '/api/ranking?escopo=turma', None, token)
+
+    def conclusoes(aleatorio):
+        token = aleatorio.choice(contexto['tokens_aluno'])
+        corpo = {'idAtividade': aleatorio.choice(contexto['atividades']), 'pontuacao': aleatorio.randint(0, 100), 'feedback': 'ok'}
+        yield ('POST /api/atividades/completar', 'POST', '/api/atividades/completar', corpo, token)
+        lote = [{'idAtividade': aleatorio.choice(contexto['atividades']), 'pontuacao': aleatorio.randint(0, 100),
+                 'idempotency_key': f'{time.time_ns()}-{i}-{aleatorio.random()}'} for i in range(10)]
+        yield ('POST /api/atividades/completar/lote', 'POST', '/api/atividades/completar/lote', {'conclusoes': lote}, token)
+
+    def login_alunos(aleatorio):
+        email = f"aluno{aleatorio.randint(1, contexto['alunos'])}@bench"
+        yield ('POST /api/login (aluno)', 'POST', '/api/login', {'email': email, 'senha': SENHA_PADRAO}, None)
+        yield ('POST /api/login (email inexistente)', 'POST', '/api/login', {'email': 'ninguem@bench', 'senha': 'x'}, None)
+
+    return {'admin': admin, 'professor': professor, 'aluno': aluno, 'conclusoes': conclusoes, 'login': login_alunos}
+
+
+def executar_jornada(nome, gerador, porta, duracao, concorrencia, semente):
+    medicoes = {}
+    lock = threading.Lock()
+    prazo = time.monotonic() + duracao
+
+    def trabalhador(indice):
+        cliente = Cliente(porta)
+        # Um gerador por usuário virtual: a sequência de cada um se repete com a mesma --semente
+        aleatorio = random.Random(semente + indice)
+        locais = {}
+        while time.monotonic() < prazo:
+            for rotulo, metodo, caminho, corpo, token in gerador(aleatorio):
+                inicio = time.perf_counter()
+                status, _, idas = cliente.requisitar(metodo, caminho, corpo, token)
+                duracao_ms = (time.perf_counter() - inicio) * 1000
+                registro = locais.setdefault(rotulo, {'latencias': [], 'erros': 0, 'idas': 0, 'nao_medidas': 0, 'status': {}})
+                registro['latencias'].append(duracao_ms)
+                if idas is None:
+                    registro['nao_medidas'] += 1
+                else:
+                    registro['idas'] += idas
+                registro['status'][status] = registro['status'].get(status, 0) + 1
+                if status >= 400:
+                    registro['erros'] += 1
+        with lock:
+            for rotulo, registro in locais.items():
+                total = medicoes.setdefault(rotulo, {'latencias': [], 'erros': 0, 'idas': 0, 'nao_medidas': 0, 'status': {}})
+                total['latencias'] += registro['latencias']
+                total['erros'] += registro['erros']
+                total['idas'] += registro['idas']
+                total['nao_medidas'] += registro['nao_medidas']
+                for status, quantidade in registro['status'].items():
+                    total['status'][status] = total['status'].get(status, 0) + quantidade
+
+    inicio = time.monotonic()
+    threads = [threading.Thread(target=trabalhador, args=(indice,)) for indice in range(concorrencia)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    decorrido = time.monotonic() - inicio
+
+    resultado = {}
+    for rotulo, registro in medicoes.items():
+        latencias = sorted(registro['latencias'])
+        quantidade = len(latencias)
+        resultado[rotulo] = {
+            'jornada': nome,
+            'requisicoes': quantidade,
+            'requisicoes_por_s': round(quantidade / decorrido, 1),
+            'erros': registro['erros'],
+            'status': {str(k): v for k, v in sorted(registro['status'].items())},
+            'p50_ms': round(percentil(latencias, 50), 2),
+            'p95_ms': round(percentil(latencias, 95), 2),
+            'p99_ms': round(percentil(latencias, 99), 2),
+            'media_ms': round(sum(latencias) / quantidade, 2),
+            # None: a rota respondeu em streaming e as idas ao banco não foram contadas
+            'idas_banco_por_req': None if registro['nao_medidas'] else round(registro['idas'] / quantidade, 2),
+        }
+    return resultado
+
+
+def percentil(valores_ordenados, p):
+    # Método "nearest rank"
+    if not valores_ordenados:
+        return 0.0
+    posicao = max(0, min(len(valores_ordenados) - 1, math.ceil(p / 100 * len(valores_ordenados)) - 1))
+    return valores_ordenados[posicao]
+
+
+# --- Relatórios ---
+def commit_atual():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=DIRETORIO,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'desconhecido'
+
+
+def imprimir(resultados, anterior=None):
+    print(f"\n{'rota':45} {'req/s':>9} {'p50':>8} {'p95':>8} {'p99':>8} {'idas':>6} {'erros':>6}")
+    for rotulo, r in resultados.items():
+        idas = 'n/m' if r['idas_banco_por_req'] is None else f"{r['idas_banco_por_req']:.2f}"
+        linha = (f"{rotulo:45} {r['requisicoes_por_s']:9.1f} {r['p50_ms']:8.2f} {r['p95_ms']:8.2f} "
+                 f"{r['p99_ms']:8.2f} {idas:>6} {r['erros']:6d}")
+        if anterior and rotulo in anterior:
+            a = anterior[rotulo]
+            variacao_rps = (r['requisicoes_por_s'] / a['requisicoes_por_s'] - 1) * 100 if a['requisicoes_por_s'] else 0
+            variacao_p99 = (r['p99_ms'] / a['p99_ms'] - 1) * 100 if a['p99_ms'] else 0
+            linha += f"   req/s {variacao_rps:+.1f}%  p99 {variacao_p99:+.1f}%"
+        print(linha)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark HTTP das rotas do app.py contra um PostgreSQL descartável.')
+    parser.add_argument('--duracao', type=float, default=10, help='Segundos por jornada.')
+    parser.add_argument('--concorrencia', type=int, default=16, help='Usuários simultâneos (threads).')
+    parser.add_argument('--jornadas', default='admin,professor,aluno,conclusoes,login')
+    parser.add_argument('--professores', type=int, default=20)
+    parser.add_argument('--alunos', type=int, default=2000)
+    parser.add_argument('--atividades', type=int, default=500)
+    parser.add_argument('--servidor', choices=['werkzeug', 'gunicorn', 'uvicorn'], default='werkzeug')
+    parser.add_argument('--workers', type=int, default=4, help='Workers do gunicorn/uvicorn.')
+    parser.add_argument('--threads', type=int, default=8, help='Threads por worker do gunicorn.')
+    parser.add_argument('--saida', default=os.path.join(DIRETORIO, 'benchmark_resultados'))
+    parser.add_argument('--comparar', help='JSON de uma execução anterior para mostrar a variação.')
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--replica', action='store_true', help='Sobe uma réplica de leitura e a usa em DATABASE_REPLICA_URLS.')
+    args = parser.parse_args()
+    random.seed(args.semente)
+
+    banco = PostgresDescartavel()
+    banco.iniciar()
+    replica = None
+    parar_servidor = None
+    try:
+        if args.replica:
+            replica = PostgresDescartavel()
+            replica.iniciar(primario=banco)
+            os.environ['DATABASE_REPLICA_URLS'] = replica.url
+        # O app lê a configuração do ambiente no import, então tudo é definido antes
+        os.environ.update({
+            'DATABASE_URL': banco.url,
+            'MASTER_EMAIL': 'admin@bench',
+            'MASTER_PASSWORD': 'admin-bench',
+            'JWT_SECRET_KEY': 'chave-do-benchmark-com-tamanho-suficiente',
+            'EXPOR_IDAS_DB': '1',
+            'FOTOS_DIR': os.path.join(banco.diretorio, 'fotos'),
+        })
+        sys.path.insert(0, DIRETORIO)
+        popular_banco(banco.url, args.professores, args.alunos, args.atividades)
+        if replica:
+            aguardar_replica(banco.url, replica.url)
+
+        porta = porta_livre()
+        parar_servidor = iniciar_servidor(args, porta)
+
+        cliente = Cliente(porta)
+        contexto = {
+            'admin_email': 'admin@bench',
+            'admin_senha': 'admin-bench',
+            'alunos': args.alunos,
+            'atividades': list(range(1, args.atividades + 1)),
+        }
+        contexto['token_admin'] = login(cliente, 'admin@bench', 'admin-bench')
+        contexto['tokens_professor'] = [login(cliente, f'prof{i}@bench', SENHA_PADRAO) for i in range(1, min(args.professores, 10) + 1)]
+        contexto['tokens_aluno'] = [login(cliente, f'aluno{i}@bench', SENHA_PADRAO) for i in range(1, min(args.alunos, 50) + 1)]
+
+        disponiveis = jornadas(contexto)
+        resultados = {}
+        for nome in args.jornadas.split(','):
+            print(f"Jornada '{nome}' ({args.duracao}s, {args.concorrencia} usuários)...")
+            resultados.update(executar_jornada(nome, disponiveis[nome], porta, args.duracao, args.concorrencia, args.semente))
+    finally:
+        if parar_servidor:
+            parar_servidor()
+        if replica:
+            replica.parar()
+        banco.parar()
+
+    anterior = None
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as arquivo:
+            anterior = json.load(arquivo)['resultados']
+    imprimir(resultados, anterior)
+
+    commit = commit_atual()
+    os.makedirs(args.saida, exist_ok=True)
+    caminho = os.path.join(args.saida, f"{datetime.now():%Y%m%d-%H%M%S}-{commit}.json")
+    with open(caminho, 'w', encoding='utf-8') as arquivo:
+        json.dump({
+            'commit': commit,
+            'data': datetime.now().isoformat(timespec='seconds'),
+            'parametros': vars(args),
+            'resultados': resultados,
+        }, arquivo, indent=2, ensure_ascii=False)
+    print(f"\nResultados salvos em {caminho}")
+
+
+if __name__ == '__main__':
+    main()
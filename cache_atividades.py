@@ -0,0 +1,136 @@
+# cache_atividades.py
+# Cache LRU (por worker) das atividades já convertidas para o formato do frontend.
+# A chave é (idAtividade, versao): a coluna versao é incrementada por trigger em qualquer UPDATE
+# de Atividade (ver init.sql), então uma entrada de versão antiga nunca é servida, mesmo que a
+# escrita tenha acontecido em outro worker. invalidar_atividade() libera a memória na hora.
+#
+# As consultas só trazem os textos grandes (conteudo_json, descricao, turmas) das atividades que
+# não estão no cache: parametros_cache() lista as versões guardadas e o SQL devolve NULL no lugar
+# do conteúdo das que batem (ver COLUNAS_ATIVIDADE/JUNCAO_CACHE). Uma turma de 40 alunos abrindo
+# a mesma atividade custa um parse, não 40.
+
+import json
+import threading
+from collections import OrderedDict
+
+from config import ATIVIDADES_CACHE_MAX_BYTES
+
+_lock = threading.Lock()
+_entradas = OrderedDict()  # idAtividade -> (versao, idProfessor, atividade, texto, tamanho); fim = mais recente
+_bytes = 0
+_contadores = {"hits": 0, "misses": 0, "remocoes": 0, "invalidacoes": 0}
+
+# Colunas e junção para as consultas de atividades (alias "at"). Espera os parâmetros nomeados
+# devolvidos por parametros_cache().
+COLUNAS_ATIVIDADE = """
+    at.idAtividade, at.versao, at.idProfessor, at.titulo, at.tipo, at.icon, at.status,
+    c.id IS NOT NULL AS em_cache,
+    CASE WHEN c.id IS NULL THEN at.descricao END AS descricao,
+    CASE WHEN c.id IS NULL THEN at.conteudo_json END AS conteudo_json,
+    CASE WHEN c.id IS NULL THEN at.turmas END AS turmas
+"""
+JUNCAO_CACHE = """
+    LEFT JOIN unnest(%(cache_ids)s::int[], %(cache_versoes)s::int[]) AS c(id, versao)
+           ON c.id = at.idAtividade AND c.versao = at.versao
+"""
+
+
+def _ler_json(texto, padrao, id_atividade, campo):
+    if not texto:
+        return padrao
+    try:
+        return json.loads(texto)
+    except ValueError:
+        # Registros antigos podem ter sido gravados com str() em vez de JSON: devolve o texto cru
+        print(f"Atividade {id_atividade}: {campo} não é um JSON válido.")
+        return texto if padrao is None else padrao
+
+
+# Formato completo de uma atividade como o frontend espera (com conteúdo)
+def formatar_atividade(r):
+    turmas = _ler_json(r.get('turmas'), [], r['idatividade'], 'turmas')
+    return {
+        "id": r['idatividade'],
+        "titulo": r['titulo'],
+        "tipo": r['tipo'],
+        "descricao": r['descricao'],
+        "conteudo_especifico": _ler_json(r.get('conteudo_json'), None, r['idatividade'], 'conteudo_json'),
+        "icon": r.get('icon') or 'puzzle',
+        "status": r.get('status') or 'available',
+        "turmas": turmas if isinstance(turmas, list) else [],
+    }
+
+
+# Ids e versões guardados das atividades visíveis para o professor (e das públicas),
+# como parâmetros nomeados para COLUNAS_ATIVIDADE/JUNCAO_CACHE.
+def parametros_cache(id_professor=None, id_atividade=None):
+    with _lock:
+        if id_atividade is not None:
+            entrada = _entradas.get(id_atividade)
+            pares = [(id_atividade, entrada[0])] if entrada else []
+        else:
+            pares = [(id_ativ, e[0]) for id_ativ, e in _entradas.items()
+                     if e[1] is None or str(e[1]) == str(id_professor)]
+    return {"cache_ids": [p[0] for p in pares], "cache_versoes": [p[1] for p in pares]}
+
+
+# Devolve (atividade, texto JSON) de uma linha vinda da consulta com COLUNAS_ATIVIDADE.
+# "dumps" serializa a atividade (o texto guardado é reaproveitado pelas respostas em streaming).
+# Devolve None se a linha veio sem conteúdo (em_cache) mas a entrada foi removida nesse meio tempo;
+# quem chama deve buscar a atividade de novo.
+def obter_atividade(linha, dumps):
+    global _bytes
+    id_atividade, versao = linha['idatividade'], linha['versao']
+    if linha['em_cache']:
+        with _lock:
+            entrada = _entradas.get(id_atividade)
+            if entrada and entrada[0] == versao:
+                _entradas.move_to_end(id_atividade)
+                _contadores["hits"] += 1
+                return entrada[2], entrada[3]
+        return None
+
+    atividade = formatar_atividade(linha)
+    texto = dumps(atividade)
+    # Estimativa do custo em memória: o texto mais os objetos Python equivalentes
+    tamanho = 2 * len(texto)
+    with _lock:
+        _contadores["misses"] += 1
+        if tamanho <= ATIVIDADES_CACHE_MAX_BYTES:
+            anterior = _entradas.pop(id_atividade, None)
+            if anterior:
+                _bytes -= anterior[4]
+            _entradas[id_atividade] = (versao, linha.get('idprofessor'), atividade, texto, tamanho)
+            _bytes += tamanho
+            while _bytes > ATIVIDADES_CACHE_MAX_BYTES:
+                _, removida = _entradas.popitem(last=False)
+                _bytes -= removida[4]
+                _contadores["remocoes"] += 1
+    return atividade, texto
+
+
+# Gancho de invalidação, chamado depois do commit de qualquer escrita em Atividade.
+# Sem id esvazia o cache inteiro.
+def invalidar_atividade(id_atividade=None):
+    global _bytes
+    with _lock:
+        if id_atividade is None:
+            _entradas.clear()
+            _bytes = 0
+        else:
+            removida = _entradas.pop(id_atividade, None)
+            if removida:
+                _bytes -= removida[4]
+        _contadores["invalidacoes"] += 1
+
+
+def estatisticas_atividades():
+    with _lock:
+        consultas = _contadores["hits"] + _contadores["misses"]
+        return {
+            "entradas": len(_entradas),
+            "bytes": _bytes,
+            "max_bytes": ATIVIDADES_CACHE_MAX_BYTES,
+            "taxa_acerto": round(_contadores["hits"] / consultas, 4) if consultas else None,
+            **_contadores,
+        }
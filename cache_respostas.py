@@ -0,0 +1,111 @@
+# cache_respostas.py
+# Cache em memória (por worker) de respostas de rotas que quase só são lidas.
+# Guarda o corpo já serializado com uma ETag forte; o cliente revalida com If-None-Match
+# e recebe 304 sem corpo. Escritas chamam invalidar_cache() para derrubar as entradas na hora.
+# A invalidação só alcança o worker que fez a escrita; rotas que precisam enxergar escritas feitas
+# em outros workers passam "versao" (uma consulta barata ao banco) e a entrada só vale com a mesma versão.
+
+import hashlib
+import threading
+import time
+from functools import wraps
+
+from flask import Response, g, make_response, request
+
+from config import ESCRITA_RECENTE_SEGUNDOS
+
+MAX_ENTRADAS = 1000
+
+_lock = threading.Lock()
+_entradas = {}    # (namespace, sub, caminho) -> (expira_em, corpo, etag, mimetype, versao)
+_geracoes = {}    # namespace -> contador incrementado a cada invalidação
+_contadores = {}  # namespace -> {"hits", "misses", "nao_modificados", "invalidacoes"}
+_invalidado_em = {}  # namespace -> momento da última invalidação
+
+
+def _contar(namespace, campo):
+    with _lock:
+        contadores = _contadores.setdefault(namespace, {"hits": 0, "misses": 0, "nao_modificados": 0, "invalidacoes": 0})
+        contadores[campo] += 1
+
+
+def _responder(namespace, corpo, etag, mimetype):
+    if request.if_none_match.contains(etag):
+        _contar(namespace, "nao_modificados")
+        resposta = Response(status=304)
+    else:
+        resposta = Response(corpo, mimetype=mimetype)
+    resposta.set_etag(etag)
+    # "no-cache" = o navegador pode guardar, mas sempre revalida (e uma invalidação vale na hora)
+    resposta.cache_control.no_cache = True
+    return resposta
+
+
+# Decorador para rotas de leitura. "variar_por" é uma função que devolve uma parte extra
+# da chave (ex.: o id do usuário logado), para rotas cuja resposta depende de quem pede.
+# "versao" é uma função que devolve a versão atual dos dados da resposta (ex.: lida do banco);
+# uma entrada guardada com outra versão é tratada como ausente.
+# Só respostas 200 são guardadas. Deve ficar abaixo de @jwt_required().
+def cache_resposta(namespace, ttl=60, variar_por=None, versao=None):
+    def decorador(view):
+        @wraps(view)
+        def envolvida(*args, **kwargs):
+            sub = variar_por() if variar_por else None
+            chave = (namespace, sub, request.full_path)
+            agora = time.monotonic()
+            versao_atual = versao() if versao else None
+
+            entrada = _entradas.get(chave)
+            if entrada and entrada[0] > agora and entrada[4] == versao_atual:
+                _contar(namespace, "hits")
+                return _responder(namespace, *entrada[1:4])
+
+            _contar(namespace, "misses")
+            geracao = _geracoes.get(namespace, 0)
+            resposta = make_response(view(*args, **kwargs))
+            if resposta.status_code != 200 or resposta.is_streamed:
+                return resposta
+
+            corpo = resposta.get_data()
+            etag = hashlib.sha1(corpo).hexdigest()
+            # Lido de uma réplica logo após uma invalidação: a réplica pode ainda não ter a escrita.
+            # O _invalidado_em só vê as invalidações deste worker; com "versao" (lida no primário)
+            # nada que veio de réplica é guardado, senão dados atrasados passariam pela versão atual.
+            lido_de_replica = g.get('_usar_replica') and (
+                versao is not None
+                or agora - _invalidado_em.get(namespace, float('-inf')) < ESCRITA_RECENTE_SEGUNDOS)
+            with _lock:
+                # Se houve invalidação enquanto a view rodava, o resultado pode estar velho: não guarda
+                if _geracoes.get(namespace, 0) == geracao and not lido_de_replica:
+                    if len(_entradas) >= MAX_ENTRADAS:
+                        _remover_expiradas(agora)
+                    if len(_entradas) >= MAX_ENTRADAS:
+                        _entradas.pop(min(_entradas, key=lambda c: _entradas[c][0]))
+                    _entradas[chave] = (agora + ttl, corpo, etag, resposta.mimetype, versao_atual)
+            return _responder(namespace, corpo, etag, resposta.mimetype)
+        return envolvida
+    return decorador
+
+
+def _remover_expiradas(agora):
+    for chave in [c for c, e in _entradas.items() if e[0] <= agora]:
+        del _entradas[chave]
+
+
+# Gancho de invalidação: chamado pelas rotas de escrita depois do commit.
+# Sem "sub" derruba o namespace inteiro; com "sub" só as entradas daquela variação.
+def invalidar_cache(namespace, sub=None):
+    with _lock:
+        _geracoes[namespace] = _geracoes.get(namespace, 0) + 1
+        _invalidado_em[namespace] = time.monotonic()
+        for chave in [c for c in _entradas if c[0] == namespace and (sub is None or c[1] == sub)]:
+            del _entradas[chave]
+    _contar(namespace, "invalidacoes")
+
+
+def estatisticas_cache():
+    with _lock:
+        return {
+            "entradas": len(_entradas),
+            "namespaces": {nome: dict(contadores) for nome, contadores in _contadores.items()},
+        }
@@ -1,14 +1,26 @@
 # config.py (Versão corrigida e segura para PostgreSQL)
 
 import os
-from dotenv import load_dotenv
+import tempfile
 
-# Carrega as variáveis do arquivo .env para o ambiente
-load_dotenv()
+# Carrega as variáveis do arquivo .env para o ambiente.
+# Na Vercel (VERCEL=1) elas já vêm do painel: pula o import do dotenv e a busca pelo arquivo.
+if not os.getenv('VERCEL'):
+    from dotenv import load_dotenv
+    load_dotenv()
 
 # Lendo a URL de conexão do banco de dados a partir das variáveis de ambiente
 DATABASE_URL = os.getenv('DATABASE_URL')
 
+# Réplicas de leitura (opcional): DSNs separados por vírgula. Rotas marcadas com @leitura_replica
+# leem delas; escritas e leituras logo após uma escrita do mesmo usuário vão para o primário (ver replicas.py).
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+ESCRITA_RECENTE_SEGUNDOS = float(os.getenv('ESCRITA_RECENTE_SEGUNDOS', '5'))  # janela "ler o que escreveu"
+# Tabela da janela acima, compartilhada pelos workers da máquina (memória em /dev/shm quando existir)
+ESCRITA_RECENTE_ARQUIVO = os.getenv('ESCRITA_RECENTE_ARQUIVO', os.path.join(
+    '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'tcc-escritas-recentes'))
+REPLICA_PAUSA_FALHA = float(os.getenv('REPLICA_PAUSA_FALHA', '30'))            # segundos fora após falhar
+
 # Lendo o acesso do admin a partir das variáveis de ambiente
 MASTER_EMAIL = os.getenv('MASTER_EMAIL', 'admin@adm')
 MASTER_PASSWORD = os.getenv('MASTER_PASSWORD')
@@ -16,6 +28,76 @@ MASTER_PASSWORD = os.getenv('MASTER_PASSWORD')
 # A chave secreta do JWT também deve vir do ambiente
 JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY')
 
+# Pool de conexões com o PostgreSQL (valores por worker do gunicorn)
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', '0'))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))          # segundos esperando conexão livre
+DB_POOL_IDADE_MAXIMA = int(os.getenv('DB_POOL_IDADE_MAXIMA', '1800'))  # segundos até reciclar a conexão
+DB_POOL_CHECAR_APOS = int(os.getenv('DB_POOL_CHECAR_APOS', '30'))      # segundos ociosa antes do SELECT 1
+
+# Hash de senhas (ver hashing.py). HASH_METODO segue o formato do werkzeug e pode ser
+# calibrado para esta máquina com "flask calibrar-hash --alvo-ms 250".
+HASH_METODO = os.getenv('HASH_METODO', 'scrypt:32768:8:1')
+HASH_PROCESSOS = int(os.getenv('HASH_PROCESSOS', '2'))    # 0 = calcula na própria thread
+HASH_FILA_MAX = int(os.getenv('HASH_FILA_MAX', '32'))     # hashes pendentes antes de responder 503
+HASH_TIMEOUT = float(os.getenv('HASH_TIMEOUT', '10'))     # segundos
+# Importação em lote (gerar_hashes): processos próprios, para não atrasar os logins, e prazo total
+HASH_PROCESSOS_LOTE = int(os.getenv('HASH_PROCESSOS_LOTE', '1'))
+HASH_LOTE_TIMEOUT = float(os.getenv('HASH_LOTE_TIMEOUT', '60'))  # segundos para a importação inteira
+
+# Armazenamento das fotos de perfil (ver fotos.py)
+FOTOS_DIR = os.getenv('FOTOS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fotos'))
+FOTOS_TAMANHO_MAX = int(os.getenv('FOTOS_TAMANHO_MAX', str(5 * 1024 * 1024)))  # bytes
+FOTOS_LADO_MINIATURA = int(os.getenv('FOTOS_LADO_MINIATURA', '128'))           # pixels
+# Envio de fotos ligado (0 = desligado, ex.: serverless.py, onde o disco é só leitura e não persiste)
+FOTOS_ENVIO_ATIVO = os.getenv('FOTOS_ENVIO_ATIVO', '1') == '1'
+FOTOS_PIXELS_MAX = int(os.getenv('FOTOS_PIXELS_MAX', str(16 * 1000 * 1000)))  # resolução máxima decodificada
+
+# Expõe no header X-DB-Idas quantos comandos cada requisição mandou ao banco (benchmark)
+EXPOR_IDAS_DB = os.getenv('EXPOR_IDAS_DB', '0') == '1'
+
+# Métricas por rota e por consulta, expostas em /metrics (ver metricas.py)
+METRICAS_ATIVAS = os.getenv('METRICAS_ATIVAS', '1') == '1'
+METRICAS_CONSULTA_LENTA_MS = float(os.getenv('METRICAS_CONSULTA_LENTA_MS', '200'))  # limite do log de consultas lentas
+METRICAS_TOKEN = os.getenv('METRICAS_TOKEN')  # se definido, /metrics exige "Authorization: Bearer <token>"
+
+# Pool do asyncpg usado pelo modo assíncrono (asgi.py), por processo do uvicorn
+ASGI_DB_POOL_MIN = int(os.getenv('ASGI_DB_POOL_MIN', '2'))
+ASGI_DB_POOL_MAX = int(os.getenv('ASGI_DB_POOL_MAX', '20'))
+
+# Segundos que o status de uma conta fica em cache em cada worker (ver status_contas.py)
+STATUS_CACHE_TTL = float(os.getenv('STATUS_CACHE_TTL', '30'))
+
+# Fuso horário usado para separar as conclusões por dia/semana nos gráficos de progresso (ver progresso.py)
+PROGRESSO_FUSO = os.getenv('PROGRESSO_FUSO', 'America/Sao_Paulo')
+
+# Memória máxima (estimada) do cache de atividades já processadas, por worker (ver cache_atividades.py)
+ATIVIDADES_CACHE_MAX_BYTES = int(os.getenv('ATIVIDADES_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+
+# Comandos preparados por conexão para as consultas quentes (ver consultas_preparadas.py).
+# Desligue (0) atrás de um pooler em modo transaction, que não preserva a sessão.
+CONSULTAS_PREPARADAS = os.getenv('CONSULTAS_PREPARADAS', '1') == '1'
+
+# Conclusões de atividades: "sincrono" grava no banco dentro da requisição; "buffer" responde depois
+# de gravar em um diário local e grava no banco em lotes (ver diario_conclusoes.py).
+CONCLUSOES_MODO = os.getenv('CONCLUSOES_MODO', 'sincrono')
+CONCLUSOES_DIARIO_DIR = os.getenv('CONCLUSOES_DIARIO_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'diario'))
+CONCLUSOES_FSYNC_MS = float(os.getenv('CONCLUSOES_FSYNC_MS', '2'))      # janela para juntar linhas em um fsync
+CONCLUSOES_FLUSH_MS = float(os.getenv('CONCLUSOES_FLUSH_MS', '200'))    # intervalo máximo entre lotes
+CONCLUSOES_LOTE_MAX = int(os.getenv('CONCLUSOES_LOTE_MAX', '500'))      # conclusões por commit
+CONCLUSOES_SEGMENTO_MAX_BYTES = int(os.getenv('CONCLUSOES_SEGMENTO_MAX_BYTES', str(4 * 1024 * 1024)))
+
+if CONCLUSOES_MODO not in ('sincrono', 'buffer'):
+    raise ValueError("CONCLUSOES_MODO deve ser 'sincrono' ou 'buffer'.")
+
+# Compactação do extrato de moedas (ver moedas.py): intervalo em segundos (0 = só pelo
+# "flask compactar-moedas", ex.: em um cron) e quantos alunos por commit
+MOEDAS_COMPACTAR_SEGUNDOS = float(os.getenv('MOEDAS_COMPACTAR_SEGUNDOS', '60'))
+MOEDAS_COMPACTAR_LOTE = int(os.getenv('MOEDAS_COMPACTAR_LOTE', '1000'))
+# Segredo da rota /api/cron/compactar-moedas (o Vercel Cron manda "Authorization: Bearer <CRON_SECRET>");
+# sem ele a rota fica desligada
+CRON_SECRET = os.getenv('CRON_SECRET')
+
 # Verificações de segurança para garantir que as variáveis críticas foram configuradas
 if not DATABASE_URL or not MASTER_PASSWORD or not JWT_SECRET_KEY:
     raise ValueError("Erro Crítico: DATABASE_URL, MASTER_PASSWORD, ou JWT_SECRET_KEY não foram definidas no arquivo .env!")
\ No newline at end of file
@@ -0,0 +1,117 @@
+# consultas_preparadas.py
+# Registro de comandos preparados para as consultas quentes (login, perfil, conclusões, listas).
+# Cada comando é preparado (PREPARE) uma vez por conexão do pool e depois executado pelo nome
+# (EXECUTE), sem o Postgres analisar e planejar o texto a cada requisição.
+#
+# - O SQL é registrado no formato do psycopg2 (%s ou %(nome)s) e convertido para $1, $2...
+# - Os nomes já preparados ficam na própria conexão (ConexaoPool.preparadas); uma conexão
+#   reciclada pelo pool começa vazia e prepara de novo no primeiro uso.
+# - Se a sessão perdeu os comandos (ex.: DISCARD ALL de um pooler externo), o EXECUTE falha com
+#   InvalidSqlStatementName. Não dá para saber quais nomes a sessão ainda tem, então ela é limpa
+#   com DEALLOCATE ALL antes de preparar de novo (um PREPARE de um nome que sobrou falharia com
+#   DuplicatePreparedStatement). No início de uma transação o comando é preparado e repetido na
+#   hora; no meio dela o erro sobe e a limpeza fica para o próximo uso da conexão.
+# - Com CONSULTAS_PREPARADAS=0 (ex.: pgbouncer em modo transaction) tudo roda como SQL comum.
+# - O tempo de cada comando aparece em /metrics com o rótulo "preparada <nome>".
+
+import re
+import threading
+
+from psycopg2 import errors, extensions
+
+from config import CONSULTAS_PREPARADAS
+
+_PARAMETRO = re.compile(r'%\((\w+)\)s|%s|%%')
+
+_lock = threading.Lock()
+_registro = {}  # nome -> (sql original, sql com $n, ordem dos parâmetros nomeados ou quantidade)
+_comandos = {}  # nome -> "EXECUTE nome (%s::tipo, ...)", montado com os tipos deduzidos no PREPARE
+_contadores = {"preparacoes": 0, "execucoes": 0, "repreparacoes": 0}
+
+
+def _converter(sql):
+    nomes = []
+    posicionais = 0
+
+    def trocar(encontrado):
+        nonlocal posicionais
+        texto = encontrado.group(0)
+        if texto == '%%':
+            return '%'
+        if texto == '%s':
+            posicionais += 1
+            return f'${posicionais}'
+        nome = encontrado.group(1)
+        if nome not in nomes:
+            nomes.append(nome)
+        return f'${nomes.index(nome) + 1}'
+
+    convertido = _PARAMETRO.sub(trocar, sql)
+    if nomes and posicionais:
+        raise ValueError("Use só %s ou só %(nome)s em um comando preparado.")
+    return convertido, (nomes if nomes else posicionais)
+
+
+# Registra um comando e devolve o seu nome (para usar em executar())
+def preparar(nome, sql):
+    _registro[nome] = (sql,) + _converter(sql)
+    return nome
+
+
+def _preparar_na_conexao(cursor, nome):
+    _, convertido, _ = _registro[nome]
+    cursor.execute(f"PREPARE {nome} AS {convertido}")
+    cursor.connection.preparadas.add(nome)
+    if nome not in _comandos:
+        # Os argumentos do EXECUTE levam o tipo de cada parâmetro: sem isso, um valor como
+        # ARRAY[NULL] (text[]) não seria convertido para timestamptz[] como no SQL original.
+        cursor.execute("SELECT parameter_types::text[] AS tipos FROM pg_prepared_statements WHERE name = %s", (nome,))
+        tipos = cursor.fetchone()['tipos']
+        argumentos = ', '.join(f'%s::{tipo}' for tipo in tipos)
+        _comandos[nome] = f"EXECUTE {nome} ({argumentos})" if tipos else f"EXECUTE {nome}"
+    with _lock:
+        _contadores["preparacoes"] += 1
+
+
+# Descarta todos os comandos preparados da sessão, para que os próximos PREPARE comecem do zero
+def _desalocar(cursor):
+    cursor.execute("DEALLOCATE ALL")
+    cursor.connection.preparadas.clear()
+    cursor.connection.desalocar = False
+
+
+# Executa o comando registrado "nome" no cursor (mesmos parâmetros que o cursor.execute usaria)
+def executar(cursor, nome, parametros=()):
+    original, _, ordem = _registro[nome]
+    conexao = cursor.connection
+    preparadas = getattr(conexao, 'preparadas', None)
+    if not CONSULTAS_PREPARADAS or preparadas is None:  # desligado ou conexão fora do pool
+        return cursor.execute(original, parametros)
+
+    valores = [parametros[chave] for chave in ordem] if isinstance(ordem, list) else list(parametros)
+    inicio_de_transacao = conexao.get_transaction_status() == extensions.TRANSACTION_STATUS_IDLE
+
+    if conexao.desalocar:
+        _desalocar(cursor)
+    if nome not in preparadas:
+        _preparar_na_conexao(cursor, nome)
+    with _lock:
+        _contadores["execucoes"] += 1
+    try:
+        return cursor.execute_rotulado(_comandos[nome], valores or None, f"preparada {nome}")
+    except errors.InvalidSqlStatementName:
+        preparadas.clear()
+        conexao.desalocar = True
+        if not inicio_de_transacao:
+            raise  # a transação já tinha outros comandos; não dá para repetir só este
+        conexao.rollback()
+        with _lock:
+            _contadores["repreparacoes"] += 1
+        _desalocar(cursor)
+        _preparar_na_conexao(cursor, nome)
+        return cursor.execute_rotulado(_comandos[nome], valores or None, f"preparada {nome}")
+
+
+def estatisticas_preparadas():
+    with _lock:
+        return {"ativo": CONSULTAS_PREPARADAS, "comandos": sorted(_registro), **_contadores}
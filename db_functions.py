@@ -1,23 +1,148 @@
+import os
+import threading
+import time
+
 import psycopg2
 from psycopg2.extras import RealDictCursor # Importante para obter resultados como dicionários
-from config import DATABASE_URL # Importando a URL de conexão
+from flask import g, has_app_context
+from config import DATABASE_URL, DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, DB_POOL_IDADE_MAXIMA, DB_POOL_CHECAR_APOS, METRICAS_ATIVAS
+from pool_conexoes import PoolConexoes, PoolEsgotado
+from metricas import registrar_consulta, registrar_espera_conexao
+from replicas import obter_conexao_replica, estatisticas_replicas
+
+# Cursor que conta quantos comandos a requisição mandou ao banco (idas ao banco) e,
+# com METRICAS_ATIVAS, mede a duração e as linhas de cada comando (ver metricas.py).
+# O total fica em g._idas_db e pode ser exposto no header X-DB-Idas (usado pelo benchmark.py).
+class CursorContado(RealDictCursor):
+    def execute(self, query, vars=None):
+        return self.execute_rotulado(query, vars)
+
+    # "rotulo" substitui o rótulo derivado do texto do SQL nas métricas (ex.: comandos preparados,
+    # cujo texto é só "EXECUTE nome (...)"; ver consultas_preparadas.py)
+    def execute_rotulado(self, query, vars=None, rotulo=None):
+        if has_app_context():
+            g._idas_db = g.get('_idas_db', 0) + 1
+        if not METRICAS_ATIVAS:
+            return super().execute(query, vars)
+        inicio = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            registrar_consulta(query, time.perf_counter() - inicio, self.rowcount, rotulo)
+
+    def executemany(self, query, vars_list):
+        if has_app_context():
+            g._idas_db = g.get('_idas_db', 0) + 1
+        if not METRICAS_ATIVAS:
+            return super().executemany(query, vars_list)
+        inicio = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            registrar_consulta(query, time.perf_counter() - inicio, self.rowcount)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# Retorna o pool deste processo, criando-o no primeiro uso.
+# Depois de um fork (gunicorn --preload) o pid muda e um pool novo é criado,
+# pois conexões não podem ser compartilhadas entre processos.
+def obter_pool():
+    global _pool
+    if _pool is None or _pool.pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool.pid != os.getpid():
+                _pool = PoolConexoes(
+                    DATABASE_URL,
+                    minimo=DB_POOL_MIN,
+                    maximo=DB_POOL_MAX,
+                    timeout=DB_POOL_TIMEOUT,
+                    idade_maxima=DB_POOL_IDADE_MAXIMA,
+                    checar_apos=DB_POOL_CHECAR_APOS,
+                )
+    return _pool
+
+def _obter_conexao():
+    if not METRICAS_ATIVAS:
+        return obter_pool().obter()
+    inicio = time.perf_counter()
+    conexao = obter_pool().obter()
+    registrar_espera_conexao(time.perf_counter() - inicio)
+    return conexao
+
+# Conexão de réplica da requisição (rotas com @leitura_replica, ver replicas.py).
+# Sem réplica disponível a requisição volta a usar o primário.
+def _conexao_replica_da_requisicao():
+    conexao = g.get('_conexao_replica')
+    if conexao is not None and not conexao.closed:
+        return conexao
+    conexao, pool = obter_conexao_replica()
+    if conexao is None:
+        g._usar_replica = False
+        return None
+    g._conexao_replica, g._pool_replica = conexao, pool
+    return conexao
 
 # Estabelecer conexão com o banco de dados PostgreSQL
+# Dentro de uma requisição, todas as chamadas usam a mesma conexão do pool (guardada em g);
+# ela só é devolvida no teardown da requisição (ver liberar_conexao_db).
 def conectar_db():
-    # psycopg2.connect usa a URL diretamente, o que simplifica a conexão
-    conexao = psycopg2.connect(DATABASE_URL)
+    if has_app_context():
+        conexao = _conexao_replica_da_requisicao() if g.get('_usar_replica') else None
+        if conexao is None:
+            conexao = g.get('_conexao_db')
+            if conexao is None or conexao.closed:
+                conexao = _obter_conexao()
+                g._conexao_db = conexao
+    else:
+        conexao = _obter_conexao()
     # Usamos RealDictCursor para que os resultados das queries venham como dicionários
     # (Ex: {'nomeProfessor': 'Ana', 'emailProfessor': 'ana@email.com'})
     # Isso é o equivalente ao 'dictionary=True' do mysql.connector
-    cursor = conexao.cursor(cursor_factory=RealDictCursor)
+    cursor = conexao.cursor(cursor_factory=CursorContado)
     return conexao, cursor
 
+# Cursor do lado do servidor (named cursor) para respostas em streaming (ver streaming.py):
+# o Postgres guarda o resultado e o cliente busca "itersize" linhas por vez ao iterar,
+# em vez de trazer tudo para a memória no execute. Vive dentro da transação da conexão
+# da requisição e deve ser fechado por quem o consome.
+def cursor_servidor(conexao, nome, itersize=500):
+    cursor = conexao.cursor(nome, cursor_factory=CursorContado)
+    cursor.itersize = itersize
+    return cursor
+
 # Encerrar conexão com o db
+# Fecha só o cursor; a conexão da requisição volta para o pool no teardown.
 def encerrar_db(cursor, conexao):
-    cursor.close()
-    conexao.close()
+    try:
+        cursor.close()
+    except psycopg2.Error:
+        pass
+    if not has_app_context() or conexao not in (g.get('_conexao_db'), g.get('_conexao_replica')):
+        obter_pool().devolver(conexao)
+
+# Registrado com app.teardown_appcontext: devolve as conexões da requisição aos seus pools.
+# Transações não finalizadas sofrem rollback e conexões quebradas são descartadas.
+def liberar_conexao_db(exc=None):
+    descartar = isinstance(exc, psycopg2.OperationalError)
+    conexao = g.pop('_conexao_db', None)
+    if conexao is not None:
+        obter_pool().devolver(conexao, descartar=descartar)
+    replica = g.pop('_conexao_replica', None)
+    if replica is not None:
+        g.pop('_pool_replica').devolver(replica, descartar=descartar)
+
+def idas_ao_banco():
+    return g.get('_idas_db', 0) if has_app_context() else 0
+
+def estatisticas_pool():
+    estatisticas = obter_pool().estatisticas()
+    replicas = estatisticas_replicas()
+    if replicas:
+        estatisticas['replicas'] = replicas
+    return estatisticas
 
 # Esta função não precisa de alteração
 def limpar_input(campo):
     campolimpo = campo.replace(".","").replace("/","").replace("-","").replace(" ","").replace("(","").replace(")","").replace("R$","")
-    return campolimpo
\ No newline at end of file
+    return campolimpo
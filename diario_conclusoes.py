@@ -0,0 +1,353 @@
+# diario_conclusoes.py
+# Modo "buffer" das conclusões de atividades (CONCLUSOES_MODO=buffer): a rota responde logo depois
+# de gravar a conclusão em um diário local (arquivo só de acréscimo) e uma thread de cada worker
+# grava no banco em lotes, com um commit para várias conclusões de vários alunos.
+#
+# - Durabilidade: cada requisição só recebe a resposta depois do fsync da sua linha. Os fsyncs são
+#   agrupados: quem chega enquanto um fsync está em andamento espera o próximo, que cobre todas as
+#   linhas escritas até ali (CONCLUSOES_FSYNC_MS é a janela para juntar mais linhas em um fsync).
+# - Cada worker escreve no seu próprio segmento (diario-<pid>-<sufixo>-<n>.jsonl) e segura um flock
+#   nele. Um segmento sem flock é de um worker que morreu: o primeiro worker que o encontrar (ao iniciar
+#   ou na busca periódica do flusher) reaplica as linhas dele e o apaga. Segmentos cujas linhas já
+#   foram todas gravadas no banco são truncados (o atual) ou apagados (os antigos).
+# - Reaplicar é seguro: toda conclusão entra no diário com idempotency_key e o INSERT ignora
+#   chaves já registradas (ver progresso.registrar_conclusoes), então nada é contado duas vezes.
+# - O formato de cada item é conferido antes de entrar no diário (app.ler_conclusao). Uma conclusão
+#   que o banco recusa pelos dados (IntegrityError/DataError, ex.: aluno apagado) não volta para a
+#   fila: vai para rejeitadas.jsonl no mesmo diretório, para análise manual. Qualquer outra falha
+#   (banco fora do ar, tabela ou coluna faltando, permissão, bug) devolve o lote para a fila, e ele
+#   é tentado de novo até a causa ser corrigida (ex.: depois de um deploy ou migração).
+# - Enquanto o lote não é gravado, perfil e moedas do aluno ainda não mostram a conclusão
+#   (atraso de até CONCLUSOES_FLUSH_MS em operação normal).
+
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+import psycopg2
+
+from config import (CONCLUSOES_DIARIO_DIR, CONCLUSOES_FSYNC_MS, CONCLUSOES_FLUSH_MS, CONCLUSOES_LOTE_MAX,
+                    CONCLUSOES_SEGMENTO_MAX_BYTES)
+from db_functions import conectar_db, encerrar_db
+from progresso import registrar_conclusoes
+
+_lock = threading.Lock()
+_fsync_feito = threading.Condition(_lock)
+_tem_pendentes = threading.Condition(_lock)
+_estado = None      # estado do worker atual (recriado depois de um fork)
+_ao_gravar = None   # callback(id_professor) chamado depois de cada commit que deu moedas
+_INTERVALO_ORFAOS = 60  # segundos entre as buscas por segmentos de workers que morreram
+
+# Erros causados pelos dados da conclusão (repetir não adianta). Os demais mantêm o lote no diário.
+_ERROS_DE_DADOS = (psycopg2.IntegrityError, psycopg2.DataError)
+
+
+class _Segmento:
+    def __init__(self, caminho, descritor):
+        self.caminho = caminho
+        self.descritor = descritor
+        self.tamanho = os.fstat(descritor).st_size
+        self.pendentes = 0  # linhas ainda não gravadas no banco
+
+
+def _novo_estado():
+    return {
+        "pid": os.getpid(),
+        "prefixo": f"diario-{os.getpid()}-{os.urandom(4).hex()}",  # pids se repetem entre reinícios
+        "segmento": None,
+        "sequencia": 0,
+        "escritas": 0,        # linhas escritas no segmento (contador global do worker)
+        "sincronizadas": 0,   # linhas já cobertas por um fsync
+        "fsync_andando": False,
+        "fila": [],           # (segmento, aluno, item) esperando o flusher
+        "contadores": {"recebidas": 0, "gravadas": 0, "duplicadas": 0, "descartadas": 0,
+                       "reaplicadas": 0, "fsyncs": 0, "lotes": 0, "falhas_lote": 0},
+    }
+
+
+def _sincronizar_diretorio():
+    descritor = os.open(CONCLUSOES_DIARIO_DIR, os.O_RDONLY)
+    try:
+        os.fsync(descritor)
+    finally:
+        os.close(descritor)
+
+
+# Abre um segmento novo deste worker, já com o flock (chamado com _lock)
+def _abrir_segmento():
+    _estado["sequencia"] += 1
+    caminho = os.path.join(CONCLUSOES_DIARIO_DIR, f"{_estado['prefixo']}-{_estado['sequencia']}.jsonl")
+    descritor = os.open(caminho, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+    fcntl.flock(descritor, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    _sincronizar_diretorio()
+    _estado["segmento"] = _Segmento(caminho, descritor)
+
+
+# Segmentos de workers que morreram (sem flock): as linhas voltam para a fila deste worker.
+# Os segmentos do próprio worker ficam de fora, pois o flock vale por descritor aberto.
+def _recuperar_orfaos():
+    for caminho in sorted(glob.glob(os.path.join(CONCLUSOES_DIARIO_DIR, 'diario-*.jsonl'))):
+        try:
+            descritor = os.open(caminho, os.O_RDWR | os.O_APPEND)
+        except FileNotFoundError:
+            continue  # outro worker acabou de reaplicar e apagar
+        try:
+            fcntl.flock(descritor, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(descritor)  # segmento de um worker vivo
+            continue
+        segmento = _Segmento(caminho, descritor)
+        with open(caminho, encoding='utf-8') as arquivo:
+            for linha in arquivo:
+                try:
+                    registro = json.loads(linha)
+                except ValueError:
+                    continue  # última linha cortada por uma queda: nunca foi confirmada ao aluno
+                segmento.pendentes += 1
+                _estado["fila"].append((segmento, registro["aluno"], _ler_item(registro["item"])))
+                _estado["contadores"]["reaplicadas"] += 1
+        if segmento.pendentes:
+            print(f"Diário de conclusões: reaplicando {segmento.pendentes} conclusões de {caminho}")
+        else:
+            _remover_segmento(segmento)
+
+
+def _remover_segmento(segmento):
+    try:
+        os.unlink(segmento.caminho)
+    except FileNotFoundError:
+        pass
+    os.close(segmento.descritor)
+
+
+def _ler_item(dado):
+    return {**dado, "momento": datetime.fromisoformat(dado["momento"])}
+
+
+# Inicia o diário neste worker (idempotente; depois de um fork cria um estado novo).
+# "ao_gravar" é chamado com o id do professor depois de cada commit que deu moedas a um aluno dele.
+def iniciar(ao_gravar=None):
+    global _estado, _ao_gravar
+    if _estado is not None and _estado["pid"] == os.getpid():
+        return
+    with _lock:
+        if _estado is not None and _estado["pid"] == os.getpid():
+            return
+        _ao_gravar = ao_gravar or _ao_gravar
+        os.makedirs(CONCLUSOES_DIARIO_DIR, exist_ok=True)
+        _estado = _novo_estado()
+        _recuperar_orfaos()
+        _abrir_segmento()
+    threading.Thread(target=_flusher, name='diario-conclusoes', daemon=True).start()
+
+
+# Espera o fsync que cobre a linha "numero" (chamado com _lock). O primeiro que chega faz o fsync
+# de tudo que já foi escrito; os demais esperam por ele.
+def _aguardar_fsync(numero):
+    while _estado["sincronizadas"] < numero:
+        if _estado["fsync_andando"]:
+            _fsync_feito.wait()
+            continue
+        _estado["fsync_andando"] = True
+        _lock.release()
+        try:
+            if CONCLUSOES_FSYNC_MS > 0:
+                time.sleep(CONCLUSOES_FSYNC_MS / 1000)  # junta as linhas que chegarem nessa janela
+        finally:
+            _lock.acquire()
+        alvo, segmento = _estado["escritas"], _estado["segmento"]
+        _lock.release()
+        try:
+            os.fsync(segmento.descritor)
+        finally:
+            _lock.acquire()
+            _estado["fsync_andando"] = False
+            _fsync_feito.notify_all()
+        _estado["sincronizadas"] = max(_estado["sincronizadas"], alvo)
+        _estado["contadores"]["fsyncs"] += 1
+
+
+# Grava as conclusões no diário e só retorna depois do fsync. Os itens vêm de ler_conclusao;
+# quem não tiver chave ou momento recebe agora (o momento da conclusão é o do recebimento,
+# não o da gravação no banco).
+def registrar(id_aluno, itens):
+    iniciar()
+    agora = datetime.now(timezone.utc)
+    for item in itens:
+        item['chave'] = item.get('chave') or os.urandom(16).hex()
+        item['momento'] = item.get('momento') or agora
+    linhas = ''.join(
+        json.dumps({"aluno": int(id_aluno), "item": {**item, "momento": item['momento'].isoformat()}},
+                   ensure_ascii=False) + '\n'
+        for item in itens
+    ).encode('utf-8')
+
+    with _lock:
+        segmento = _estado["segmento"]
+        os.write(segmento.descritor, linhas)
+        segmento.tamanho += len(linhas)
+        segmento.pendentes += len(itens)
+        _estado["escritas"] += 1
+        numero = _estado["escritas"]
+        _aguardar_fsync(numero)
+        _estado["fila"].extend((segmento, int(id_aluno), item) for item in itens)
+        _estado["contadores"]["recebidas"] += len(itens)
+        if len(_estado["fila"]) >= CONCLUSOES_LOTE_MAX:
+            _tem_pendentes.notify()
+        # Segmento grande: os próximos acréscimos vão para um novo. Linhas de outras requisições
+        # ainda esperando o fsync ficariam no segmento antigo, então ele é sincronizado aqui.
+        if segmento.tamanho >= CONCLUSOES_SEGMENTO_MAX_BYTES and not _estado["fsync_andando"]:
+            os.fsync(segmento.descritor)
+            _estado["sincronizadas"] = _estado["escritas"]
+            _fsync_feito.notify_all()
+            _abrir_segmento()
+
+
+# Marca as linhas do lote como gravadas e apaga/trunca os segmentos que ficaram sem pendências
+def _concluir_lote(lote):
+    with _lock:
+        for segmento, _, _ in lote:
+            segmento.pendentes -= 1
+        for segmento in {segmento for segmento, _, _ in lote}:
+            if segmento.pendentes:
+                continue
+            if segmento is not _estado["segmento"]:
+                _remover_segmento(segmento)
+            elif segmento.tamanho and not _estado["fsync_andando"]:
+                os.ftruncate(segmento.descritor, 0)
+                segmento.tamanho = 0
+
+
+# Guarda conclusões recusadas pelo banco em rejeitadas.jsonl (com o motivo) em vez de repeti-las
+def _rejeitar(id_aluno, itens, erro):
+    print(f"Diário de conclusões: {len(itens)} conclusões do aluno {id_aluno} rejeitadas: {erro}")
+    linhas = ''.join(
+        json.dumps({"aluno": id_aluno, "item": item, "erro": str(erro)}, ensure_ascii=False, default=str) + '\n'
+        for item in itens
+    ).encode('utf-8')
+    descritor = os.open(os.path.join(CONCLUSOES_DIARIO_DIR, 'rejeitadas.jsonl'), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+    try:
+        os.write(descritor, linhas)
+        os.fsync(descritor)
+    finally:
+        os.close(descritor)
+
+
+# Grava as conclusões de um aluno dentro de um savepoint. Se os dados forem recusados, tenta uma a
+# uma para separar as conclusões ruins das boas; as ruins vão para rejeitadas.jsonl.
+# Devolve a lista de resultados (os rejeitados com status "erro") e o professor, se ganhou moedas.
+def _gravar_aluno(cursor, id_aluno, itens):
+    cursor.execute('SAVEPOINT aluno')
+    try:
+        resultados, moedas_ganhas, _, id_professor = registrar_conclusoes(cursor, id_aluno, itens)
+    except _ERROS_DE_DADOS as e:
+        cursor.execute('ROLLBACK TO SAVEPOINT aluno')
+        if len(itens) == 1:
+            _rejeitar(id_aluno, itens, e)
+            return [{"chave": itens[0]['chave'], "status": "erro", "msg": str(e)}], None
+        resultados, professor = [], None
+        for item in itens:
+            resultado, professor_item = _gravar_aluno(cursor, id_aluno, [item])
+            resultados += resultado
+            professor = professor or professor_item
+        return resultados, professor
+    cursor.execute('RELEASE SAVEPOINT aluno')
+    return resultados, (id_professor if moedas_ganhas else None)
+
+
+# Grava um lote no banco em uma transação: uma chamada de registrar_conclusoes por aluno
+# (em ordem de id, para flushers de workers diferentes não travarem uns aos outros) e um commit.
+def _gravar_lote(lote):
+    por_aluno = {}
+    for _, id_aluno, item in lote:
+        por_aluno.setdefault(id_aluno, []).append(item)
+
+    professores = set()
+    contadores = {"gravadas": 0, "duplicadas": 0, "descartadas": 0}
+    conexao, cursor = conectar_db()
+    try:
+        for id_aluno in sorted(por_aluno):
+            resultados, id_professor = _gravar_aluno(cursor, id_aluno, por_aluno[id_aluno])
+            for resultado in resultados:
+                if resultado['status'] == 'registrado':
+                    contadores["gravadas"] += 1
+                elif resultado['status'] == 'duplicado':
+                    contadores["duplicadas"] += 1
+                else:
+                    print(f"Diário de conclusões: conclusão {resultado['chave']} do aluno {id_aluno} descartada: {resultado['msg']}")
+                    contadores["descartadas"] += 1
+            if id_professor:
+                professores.add(id_professor)
+        conexao.commit()
+    except BaseException:
+        try:
+            conexao.rollback()
+        except psycopg2.Error:
+            pass  # conexão quebrada; o pool a descarta no próximo uso
+        raise
+    finally:
+        encerrar_db(cursor, conexao)
+
+    if _ao_gravar:
+        for id_professor in professores:
+            _ao_gravar(id_professor)
+    return contadores
+
+
+def _flusher():
+    espera = CONCLUSOES_FLUSH_MS / 1000
+    proxima_busca = time.monotonic() + _INTERVALO_ORFAOS
+    while True:
+        if time.monotonic() >= proxima_busca:
+            with _lock:
+                _recuperar_orfaos()
+            proxima_busca = time.monotonic() + _INTERVALO_ORFAOS
+        with _lock:
+            if len(_estado["fila"]) < CONCLUSOES_LOTE_MAX:
+                _tem_pendentes.wait(espera)
+            lote = _estado["fila"][:CONCLUSOES_LOTE_MAX]
+            del _estado["fila"][:len(lote)]
+        if not lote:
+            espera = CONCLUSOES_FLUSH_MS / 1000
+            continue
+        try:
+            contadores = _gravar_lote(lote)
+        except psycopg2.Error as e:
+            # Banco indisponível: o lote volta para o início da fila e a próxima tentativa espera mais
+            print(f"Diário de conclusões: erro ao gravar lote de {len(lote)}, tentando de novo: {e}")
+            with _lock:
+                _estado["fila"][:0] = lote
+                _estado["contadores"]["falhas_lote"] += 1
+            espera = min(max(espera * 2, 0.5), 30)
+            time.sleep(espera)
+            continue
+        except Exception as e:
+            # Ex.: pool esgotado; mesmo tratamento, as linhas continuam no diário
+            print(f"Diário de conclusões: falha inesperada ao gravar lote: {e}")
+            with _lock:
+                _estado["fila"][:0] = lote
+                _estado["contadores"]["falhas_lote"] += 1
+            time.sleep(1)
+            continue
+        _concluir_lote(lote)
+        with _lock:
+            _estado["contadores"]["lotes"] += 1
+            for nome, valor in contadores.items():
+                _estado["contadores"][nome] += valor
+        espera = CONCLUSOES_FLUSH_MS / 1000
+
+
+# Há segmentos no diretório? (usado para reaplicar sobras mesmo com CONCLUSOES_MODO=sincrono)
+def ha_diario_pendente():
+    return bool(glob.glob(os.path.join(CONCLUSOES_DIARIO_DIR, 'diario-*.jsonl')))
+
+
+def estatisticas_diario():
+    if _estado is None or _estado["pid"] != os.getpid():
+        return None
+    with _lock:
+        return {"pendentes": len(_estado["fila"]), **_estado["contadores"]}
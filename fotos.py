@@ -0,0 +1,144 @@
+# fotos.py
+# Armazenamento local de fotos de perfil endereçado por conteúdo.
+# O arquivo é nomeado pelo SHA-256 dos bytes da imagem, então fotos iguais são gravadas uma vez só
+# e o nome nunca muda de conteúdo (o que permite cache "immutable" no navegador).
+# As linhas de Aluno/Professor guardam apenas a referência curta "<sha256>.<ext>".
+
+import base64
+import binascii
+import hashlib
+import io
+import os
+import re
+import tempfile
+
+from flask import url_for
+from config import FOTOS_DIR, FOTOS_TAMANHO_MAX, FOTOS_LADO_MINIATURA, FOTOS_PIXELS_MAX, FOTOS_ENVIO_ATIVO
+
+try:
+    from PIL import Image, ImageOps
+    # Recusa já na abertura imagens muito acima do limite (bombas de descompressão: poucos bytes,
+    # dezenas de megapixels); o limite exato é conferido em _gerar_miniatura
+    Image.MAX_IMAGE_PIXELS = FOTOS_PIXELS_MAX
+except ImportError:  # Sem Pillow as fotos são aceitas, mas a miniatura é a própria original
+    Image = None
+
+
+class FotoInvalida(Exception):
+    """O conteúdo enviado não é uma imagem aceita."""
+
+
+class FotosDesativadas(Exception):
+    """O envio de fotos está desligado neste ambiente (FOTOS_ENVIO_ATIVO=0)."""
+
+
+EXTENSOES = {'image/png': 'png', 'image/jpeg': 'jpg', 'image/jpg': 'jpg', 'image/gif': 'gif', 'image/webp': 'webp'}
+MIMETYPES = {'png': 'image/png', 'jpg': 'image/jpeg', 'gif': 'image/gif', 'webp': 'image/webp'}
+
+# Assinaturas (magic bytes) de cada formato, para não confiar só no que o cliente declarou
+ASSINATURAS = {
+    'png': (b'\x89PNG\r\n\x1a\n',),
+    'jpg': (b'\xff\xd8\xff',),
+    'gif': (b'GIF87a', b'GIF89a'),
+    'webp': (b'RIFF',),
+}
+
+_DATA_URL = re.compile(r'^data:(image/[a-z]+);base64,(.+)$', re.S)
+_REFERENCIA = re.compile(r'^([0-9a-f]{64})\.(png|jpg|gif|webp)$')
+
+
+def eh_referencia(valor):
+    return bool(valor) and _REFERENCIA.match(valor) is not None
+
+
+def _caminho(digest, sufixo):
+    # Subdiretório pelos dois primeiros caracteres para não ter milhares de arquivos numa pasta só
+    return os.path.join(FOTOS_DIR, digest[:2], f"{digest}{sufixo}")
+
+
+def _gravar_atomico(caminho, conteudo):
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    descritor, temporario = tempfile.mkstemp(dir=os.path.dirname(caminho))
+    with os.fdopen(descritor, 'wb') as arquivo:
+        arquivo.write(conteudo)
+    os.replace(temporario, caminho)
+
+
+# A imagem é reduzida antes de qualquer conversão, para a memória usada não crescer com a resolução:
+# no JPEG o draft já decodifica em escala menor; nos demais formatos a resolução é limitada.
+def _gerar_miniatura(conteudo):
+    imagem = Image.open(io.BytesIO(conteudo))
+    lado = FOTOS_LADO_MINIATURA * 2
+    imagem.draft('RGB', (lado, lado))
+    if imagem.width * imagem.height > FOTOS_PIXELS_MAX:
+        raise FotoInvalida("Imagem com resolução grande demais.")
+    imagem.thumbnail((lado, lado))
+    imagem = ImageOps.exif_transpose(imagem).convert('RGB')
+    imagem = ImageOps.fit(imagem, (FOTOS_LADO_MINIATURA, FOTOS_LADO_MINIATURA))
+    saida = io.BytesIO()
+    imagem.save(saida, 'JPEG', quality=85, optimize=True)
+    return saida.getvalue()
+
+
+# Recebe a "data URL" em base64 enviada pelo frontend, grava original + miniatura
+# e devolve a referência a ser salva no banco.
+def salvar_foto(data_url):
+    if not FOTOS_ENVIO_ATIVO:
+        raise FotosDesativadas("O envio de fotos de perfil não está disponível neste servidor.")
+    encontrado = _DATA_URL.match(data_url.strip())
+    if not encontrado or encontrado.group(1) not in EXTENSOES:
+        raise FotoInvalida("Formato de imagem não suportado.")
+    extensao = EXTENSOES[encontrado.group(1)]
+    try:
+        conteudo = base64.b64decode(encontrado.group(2), validate=False)
+    except (binascii.Error, ValueError):
+        raise FotoInvalida("Imagem em base64 inválida.")
+    if len(conteudo) > FOTOS_TAMANHO_MAX:
+        raise FotoInvalida("Imagem grande demais.")
+    if not conteudo.startswith(ASSINATURAS[extensao]):
+        raise FotoInvalida("O conteúdo não corresponde ao tipo da imagem.")
+
+    digest = hashlib.sha256(conteudo).hexdigest()
+    original = _caminho(digest, f".{extensao}")
+    if not os.path.exists(original):  # Deduplicação: mesma foto, mesmo arquivo
+        if Image is not None:
+            try:
+                miniatura = _gerar_miniatura(conteudo)
+            except FotoInvalida:
+                raise
+            except Exception:
+                raise FotoInvalida("Não foi possível ler a imagem.")
+            _gravar_atomico(_caminho(digest, '_mini.jpg'), miniatura)
+        _gravar_atomico(original, conteudo)
+    return f"{digest}.{extensao}"
+
+
+# Devolve (caminho, mimetype, etag) do arquivo pedido, ou None se não existir
+def localizar_foto(referencia, miniatura=False):
+    encontrado = _REFERENCIA.match(referencia)
+    if not encontrado:
+        return None
+    digest, extensao = encontrado.groups()
+    if miniatura:
+        caminho = _caminho(digest, '_mini.jpg')
+        if os.path.exists(caminho):
+            return caminho, 'image/jpeg', f"{digest}-mini"
+    caminho = _caminho(digest, f".{extensao}")
+    if not os.path.exists(caminho):
+        return None
+    return caminho, MIMETYPES[extensao], digest
+
+
+# Converte o valor da coluna urlFotoPerfil para URLs que o frontend pode usar em <img src>.
+# Valores antigos (data URL em base64 ou URLs externas) passam sem alteração.
+# Fora de uma requisição Flask (modo ASGI) a base da URL é passada em "base_url".
+def urls_foto(valor, base_url=None):
+    if not eh_referencia(valor):
+        return valor, valor
+    if base_url is not None:
+        url = f"{base_url.rstrip('/')}/api/fotos/{valor}"
+        return url, f"{url}?tamanho=mini"
+    return (
+        url_for('obter_foto', referencia=valor, _external=True),
+        url_for('obter_foto', referencia=valor, tamanho='mini', _external=True),
+    )
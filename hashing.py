@@ -0,0 +1,151 @@
+# hashing.py
+# Serviço de hash de senhas: o KDF (scrypt/pbkdf2) roda em um pool de processos limitado,
+# para que requisições baratas não fiquem presas atrás de um cálculo de hash.
+# Importações em lote usam um pool separado (HASH_PROCESSOS_LOTE), então uma turma inteira
+# sendo importada não entra na frente dos logins. Estourar o prazo levanta TimeoutError
+# (concurrent.futures), que o app responde com 503.
+
+import os
+import threading
+import time
+from concurrent.futures import TimeoutError as TempoEsgotado
+
+from werkzeug.security import generate_password_hash, check_password_hash
+from config import HASH_METODO, HASH_PROCESSOS, HASH_FILA_MAX, HASH_TIMEOUT, HASH_PROCESSOS_LOTE, HASH_LOTE_TIMEOUT
+
+
+class FilaHashCheia(Exception):
+    """Há hashes demais na fila; a requisição deve ser recusada (503) em vez de esperar."""
+
+
+_executores = {}  # "interativo"/"lote" -> (pid, ProcessPoolExecutor)
+_executor_lock = threading.Lock()
+_vagas = threading.BoundedSemaphore(HASH_FILA_MAX)
+_vaga_lote = threading.BoundedSemaphore(1)  # uma importação por vez em cada worker
+
+
+def _obter_executor(tipo='interativo'):
+    # Um executor por processo (o gunicorn faz fork dos workers depois do import)
+    pid, executor = _executores.get(tipo, (None, None))
+    if executor is None or pid != os.getpid():
+        with _executor_lock:
+            pid, executor = _executores.get(tipo, (None, None))
+            if executor is None or pid != os.getpid():
+                # Import adiado: o multiprocessing só é carregado quando o pool é usado
+                # (com HASH_PROCESSOS=0, como no serverless.py, nunca)
+                from concurrent.futures import ProcessPoolExecutor
+                processos = HASH_PROCESSOS if tipo == 'interativo' else HASH_PROCESSOS_LOTE
+                executor = ProcessPoolExecutor(max_workers=processos)
+                _executores[tipo] = (os.getpid(), executor)
+    return executor
+
+
+def _submeter(funcao, *args):
+    if not _vagas.acquire(blocking=False):
+        raise FilaHashCheia(f"Fila de hash cheia ({HASH_FILA_MAX} pendentes).")
+    try:
+        futuro = _obter_executor().submit(funcao, *args)
+    except Exception:
+        _vagas.release()
+        raise
+    futuro.add_done_callback(lambda _: _vagas.release())
+    return futuro
+
+
+def _executar(funcao, *args):
+    # HASH_PROCESSOS=0 desliga o pool (útil em ambientes sem multiprocessing, como serverless)
+    if HASH_PROCESSOS <= 0:
+        return funcao(*args)
+    return _submeter(funcao, *args).result(timeout=HASH_TIMEOUT)
+
+
+# Versão para o modo assíncrono (asgi.py): espera o pool de processos sem bloquear o event loop
+async def _executar_async(funcao, *args):
+    import asyncio
+    if HASH_PROCESSOS <= 0:
+        return await asyncio.get_running_loop().run_in_executor(None, funcao, *args)
+    return await asyncio.wait_for(asyncio.wrap_future(_submeter(funcao, *args)), HASH_TIMEOUT)
+
+
+def metodo_atual():
+    return HASH_METODO
+
+
+def gerar_hash(senha):
+    return _executar(generate_password_hash, senha, HASH_METODO)
+
+
+def _gerar_lote(senhas, metodo):
+    return [generate_password_hash(senha, metodo) for senha in senhas]
+
+
+# Hash de muitas senhas de uma vez (importação de turmas): divide em lotes que rodam no pool de
+# importação (HASH_PROCESSOS_LOTE processos, separado do pool dos logins). Uma importação por vez
+# em cada worker; a importação inteira tem HASH_LOTE_TIMEOUT segundos.
+def gerar_hashes(senhas):
+    senhas = list(senhas)
+    if not _vaga_lote.acquire(blocking=False):
+        raise FilaHashCheia("Já há uma importação calculando hashes neste servidor.")
+    try:
+        prazo = time.monotonic() + HASH_LOTE_TIMEOUT
+        if HASH_PROCESSOS_LOTE <= 0 or len(senhas) <= 1:
+            hashes = []
+            for senha in senhas:
+                if time.monotonic() > prazo:
+                    raise TempoEsgotado(f"Importação passou de {HASH_LOTE_TIMEOUT} s calculando hashes.")
+                hashes.append(generate_password_hash(senha, HASH_METODO))
+            return hashes
+
+        tamanho = max(1, -(-len(senhas) // (HASH_PROCESSOS_LOTE * 4)))
+        lotes = [senhas[i:i + tamanho] for i in range(0, len(senhas), tamanho)]
+        executor = _obter_executor('lote')
+        futuros = [executor.submit(_gerar_lote, lote, HASH_METODO) for lote in lotes]
+        try:
+            return [h for futuro in futuros for h in futuro.result(timeout=max(prazo - time.monotonic(), 0))]
+        except TempoEsgotado:
+            for futuro in futuros:
+                futuro.cancel()  # lotes que ainda não começaram saem da fila
+            raise
+    finally:
+        _vaga_lote.release()
+
+
+def verificar_hash(senha_hash, senha):
+    return _executar(check_password_hash, senha_hash, senha)
+
+
+async def gerar_hash_async(senha):
+    return await _executar_async(generate_password_hash, senha, HASH_METODO)
+
+
+async def verificar_hash_async(senha_hash, senha):
+    return await _executar_async(check_password_hash, senha_hash, senha)
+
+
+# Hashes no formato do werkzeug começam com os parâmetros: "scrypt:32768:8:1$sal$hash".
+# Se eles forem diferentes do método configurado, o hash deve ser refeito no próximo login.
+def precisa_rehash(senha_hash):
+    return senha_hash.split('$', 1)[0] != HASH_METODO
+
+
+# Mede o custo do KDF nesta máquina e sugere parâmetros para atingir o tempo alvo.
+# Usado pelo comando "flask calibrar-hash"; o resultado vai para HASH_METODO no .env,
+# assim todos os workers usam o mesmo custo (e não ficam refazendo hashes uns dos outros).
+def calibrar(alvo_ms, algoritmo='scrypt'):
+    def medir(metodo):
+        inicio = time.perf_counter()
+        generate_password_hash('calibracao', metodo)
+        return (time.perf_counter() - inicio) * 1000
+
+    if algoritmo == 'pbkdf2':
+        base = 100000
+        tempo = medir(f'pbkdf2:sha256:{base}')
+        iteracoes = max(base, int(base * alvo_ms / tempo) // 10000 * 10000)
+        metodo = f'pbkdf2:sha256:{iteracoes}'
+    else:
+        # No scrypt o custo cresce com N (potência de 2); r=8 e p=1 são os padrões do werkzeug
+        n = 2 ** 14
+        while n < 2 ** 17 and medir(f'scrypt:{n * 2}:8:1') <= alvo_ms:
+            n *= 2
+        metodo = f'scrypt:{n}:8:1'
+    return metodo, round(medir(metodo), 1)
@@ -0,0 +1,83 @@
+# importacao.py
+# Leitura e validação de listas de alunos (CSV ou JSON) para a importação em lote.
+
+import csv
+import io
+
+from db_functions import limpar_input
+
+CAMPOS = ('nomeAluno', 'cpfAluno', 'emailAluno', 'senhaAluno', 'anoAluno')
+MAX_LINHAS = 5000
+
+
+class ImportacaoInvalida(Exception):
+    """O arquivo/corpo enviado não pôde ser lido como lista de alunos."""
+
+
+# Aceita: JSON {"alunos": [...]} ou uma lista; CSV no corpo (text/csv) ou no campo "arquivo"
+# de um formulário multipart. No CSV a primeira linha deve ter os nomes das colunas (CAMPOS).
+# CSV salvo pelo Excel em português costuma vir em cp1252 (Latin-1), não em UTF-8. O cp1252 decodifica
+# quase qualquer sequência de bytes; o que ele recusa é, na prática, arquivo binário (ex.: um .xlsx).
+# Um charset declarado no Content-Type (text/csv; charset=...) é tentado primeiro.
+def _decodificar(conteudo, charset=None):
+    codificacoes = ['utf-8-sig', 'cp1252']
+    if charset and charset.lower().replace('_', '-') not in ('utf-8', 'utf8'):
+        codificacoes.insert(0, charset)
+    for codificacao in codificacoes:
+        try:
+            return conteudo.decode(codificacao)
+        except (LookupError, UnicodeDecodeError):
+            continue
+    raise ImportacaoInvalida("O arquivo não parece ser um CSV de texto: salve a planilha como CSV.")
+
+
+def ler_linhas(request):
+    if 'arquivo' in request.files or request.mimetype == 'text/csv':
+        if 'arquivo' in request.files:
+            texto = _decodificar(request.files['arquivo'].read())
+        else:
+            texto = _decodificar(request.get_data(), request.mimetype_params.get('charset'))
+        linhas = list(csv.DictReader(io.StringIO(texto), delimiter=_detectar_delimitador(texto)))
+    else:
+        dados = request.get_json(silent=True)
+        linhas = dados.get('alunos') if isinstance(dados, dict) else dados
+        if not isinstance(linhas, list) or not all(isinstance(l, dict) for l in linhas):
+            raise ImportacaoInvalida("Envie um CSV ou um JSON com a lista 'alunos'.")
+
+    if not linhas:
+        raise ImportacaoInvalida("Nenhum aluno encontrado no arquivo.")
+    if len(linhas) > MAX_LINHAS:
+        raise ImportacaoInvalida(f"Máximo de {MAX_LINHAS} alunos por importação.")
+    return linhas
+
+
+def _detectar_delimitador(texto):
+    # Planilhas exportadas em português costumam usar ";" como separador
+    cabecalho = texto.split('\n', 1)[0]
+    return ';' if cabecalho.count(';') > cabecalho.count(',') else ','
+
+
+# Normaliza e valida as linhas. Devolve (validas, relatorio): "validas" são dicts prontos
+# para inserir (com o índice da linha) e "relatorio" já contém os erros encontrados.
+def validar_linhas(linhas):
+    validas = []
+    relatorio = []
+    emails_vistos = set()
+    cpfs_vistos = set()
+    for numero, linha in enumerate(linhas, start=1):
+        aluno = {campo: str(linha.get(campo) or '').strip() for campo in CAMPOS}
+        aluno['cpfAluno'] = limpar_input(aluno['cpfAluno'])
+
+        faltando = [campo for campo in CAMPOS if not aluno[campo]]
+        if faltando:
+            relatorio.append({"linha": numero, "status": "erro", "msg": f"Campos ausentes: {', '.join(faltando)}."})
+        elif not aluno['cpfAluno'].isdigit() or len(aluno['cpfAluno']) != 11:
+            relatorio.append({"linha": numero, "status": "erro", "msg": "CPF inválido."})
+        elif aluno['emailAluno'] in emails_vistos or aluno['cpfAluno'] in cpfs_vistos:
+            relatorio.append({"linha": numero, "status": "duplicado", "msg": "Email ou CPF repetido no arquivo."})
+        else:
+            emails_vistos.add(aluno['emailAluno'])
+            cpfs_vistos.add(aluno['cpfAluno'])
+            aluno['linha'] = numero
+            validas.append(aluno)
+    return validas, relatorio
@@ -0,0 +1,97 @@
+# inicializacao.py
+# Relatório de inicialização a frio (cold start) usado pelo modo serverless (serverless.py):
+# quanto tempo cada módulo levou para ser importado e quanto tempo se passou do início do
+# processo até a primeira resposta. Aparece uma vez no log da função e em /api/admin/estatisticas.
+#
+# - O tempo por módulo é medido envolvendo o __import__ durante o import do app; "proprio" desconta
+#   os módulos importados por ele (como o "self" do python -X importtime), "total" não.
+# - Só o primeiro import de cada módulo é medido; os seguintes já vêm de sys.modules.
+
+import builtins
+import json
+import sys
+import threading
+import time
+
+_lock = threading.Lock()
+_relatorio = None
+_importacoes = {}   # módulo -> [total_s, proprio_s]
+_marcos = {}        # nome do marco -> segundos desde o início do processo
+_inicio = None
+
+
+# Marca o início do processo (chamada na primeira linha do serverless.py)
+def iniciar(inicio=None):
+    global _inicio
+    _inicio = time.perf_counter() if inicio is None else inicio
+
+
+def marcar(nome):
+    if _inicio is not None:
+        _marcos.setdefault(nome, time.perf_counter() - _inicio)
+
+
+# Contexto que cronometra os módulos importados dentro dele
+class medir_importacoes:
+    def __enter__(self):
+        self._original = builtins.__import__
+        pilha = []  # [inicio, tempo dos filhos] de cada import em andamento (só na thread principal)
+        thread = threading.get_ident()
+        original = self._original
+
+        def importar(nome, globais=None, locais=None, lista=(), nivel=0):
+            if nivel or nome in sys.modules or threading.get_ident() != thread:
+                return original(nome, globais, locais, lista, nivel)
+            pilha.append([time.perf_counter(), 0.0])
+            try:
+                return original(nome, globais, locais, lista, nivel)
+            finally:
+                inicio, filhos = pilha.pop()
+                total = time.perf_counter() - inicio
+                if pilha:
+                    pilha[-1][1] += total
+                _importacoes.setdefault(nome, [total, total - filhos])
+
+        builtins.__import__ = importar
+        return self
+
+    def __exit__(self, *exc):
+        builtins.__import__ = self._original
+        return False
+
+
+# Chamado ao fim da primeira resposta: fecha o relatório e o escreve no log (uma linha JSON)
+def registrar_primeira_resposta():
+    global _relatorio
+    if _relatorio is not None or _inicio is None:
+        return
+    with _lock:
+        if _relatorio is not None:
+            return
+        marcar('primeira_resposta')
+        modulos = sorted(_importacoes.items(), key=lambda item: item[1][1], reverse=True)
+        _relatorio = {
+            "marcos_ms": {nome: round(segundos * 1000, 1) for nome, segundos in _marcos.items()},
+            "modulos_ms": [{"modulo": nome, "proprio": round(proprio * 1000, 1), "total": round(total * 1000, 1)}
+                           for nome, (total, proprio) in modulos[:25]],
+            "modulos_importados": len(_importacoes),
+        }
+    print(f"Inicialização a frio: {json.dumps(_relatorio, ensure_ascii=False)}")
+
+
+# Relatório da inicialização deste processo (None fora do modo serverless ou antes da primeira resposta)
+def relatorio_inicializacao():
+    return _relatorio
+
+
+# Envolve o wsgi_app do Flask para registrar o tempo até a primeira resposta
+def cronometrar_primeira_resposta(wsgi_app):
+    def envolvido(environ, start_response):
+        if _relatorio is not None:
+            return wsgi_app(environ, start_response)
+
+        def iniciar_resposta(status, headers, exc_info=None):
+            registrar_primeira_resposta()
+            return start_response(status, headers, exc_info)
+        return wsgi_app(environ, iniciar_resposta)
+    return envolvido
@@ -1,43 +1,232 @@
 -- Script para PostgreSQL
 
-CREATE TABLE Professor (
+CREATE TABLE IF NOT EXISTS Professor (
     idProfessor SERIAL PRIMARY KEY,
     nomeProfessor VARCHAR(100) NOT NULL,
     cpfProfessor VARCHAR(11) NOT NULL UNIQUE,
     emailProfessor VARCHAR(100) NOT NULL UNIQUE,
     senhaProfessor VARCHAR(255) NOT NULL,
-    status VARCHAR(10) NOT NULL DEFAULT 'ativo' CHECK (status IN ('ativo', 'inativo'))
+    status VARCHAR(10) NOT NULL DEFAULT 'ativo' CHECK (status IN ('ativo', 'inativo', 'bloqueado')),
+    urlFotoPerfil TEXT
 );
 
-CREATE TABLE Aluno (
+CREATE TABLE IF NOT EXISTS Aluno (
     idAluno SERIAL PRIMARY KEY,
     nomeAluno VARCHAR(100) NOT NULL,
     cpfAluno VARCHAR(11) NOT NULL UNIQUE,
     emailAluno VARCHAR(100) NOT NULL UNIQUE,
     senhaAluno VARCHAR(255) NOT NULL,
-    status VARCHAR(10) NOT NULL DEFAULT 'ativo' CHECK (status IN ('ativo', 'inativo')),
+    status VARCHAR(10) NOT NULL DEFAULT 'ativo' CHECK (status IN ('ativo', 'inativo', 'bloqueado')),
     moedas INT NOT NULL DEFAULT 100,
     nivel VARCHAR(50) NOT NULL DEFAULT 'Iniciante 1',
-    sala_aluno VARCHAR(50) NOT NULL,
+    anoAluno VARCHAR(50),
+    urlFotoPerfil TEXT,
     idProfessor INT,
     FOREIGN KEY (idProfessor) REFERENCES Professor(idProfessor)
 );
 
-CREATE TABLE Atividade (
+-- Atividades criadas pelos professores; idProfessor NULL = atividade pública.
+-- conteudo_json e turmas guardam JSON serializado (ver criar_atividade_professor).
+CREATE TABLE IF NOT EXISTS Atividade (
     idAtividade SERIAL PRIMARY KEY,
-    idProfessor INT NOT NULL,
-    nomeAtividade VARCHAR(100) NOT NULL,
-    tipoAtividade VARCHAR(20) NOT NULL CHECK (tipoAtividade IN ('correcao_texto', 'multipla_escolha', 'acentuacao')),
-    dificuldade VARCHAR(10) NOT NULL CHECK (dificuldade IN ('facil', 'medio', 'dificil')),
-    descricaoAtividade TEXT,
+    idProfessor INT,
+    titulo VARCHAR(200) NOT NULL,
+    tipo VARCHAR(50) NOT NULL,
+    descricao TEXT,
+    conteudo_json TEXT,
+    icon VARCHAR(50) DEFAULT 'file-text',
+    status VARCHAR(20) NOT NULL DEFAULT 'available',
+    turmas TEXT DEFAULT '[]',
     FOREIGN KEY (idProfessor) REFERENCES Professor(idProfessor)
 );
 
-CREATE TABLE AtividadeFeita (
+CREATE TABLE IF NOT EXISTS AtividadeFeita (
     idAtividadeFeita SERIAL PRIMARY KEY,
     idAluno INT NOT NULL,
     idAtividade INT NOT NULL,
     dataAtividadeFeita TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+    pontuacao INT DEFAULT 0,
+    feedback_gemini TEXT,
     FOREIGN KEY (idAluno) REFERENCES Aluno(idAluno),
     FOREIGN KEY (idAtividade) REFERENCES Atividade(idAtividade)
-); 
\ No newline at end of file
+);
+
+-- Bancos criados antes do status 'bloqueado' e da foto de perfil: o CHECK de status é recriado
+-- (nome padrão do Postgres, <tabela>_status_check) e as colunas novas são adicionadas.
+ALTER TABLE Professor ADD COLUMN IF NOT EXISTS urlFotoPerfil TEXT;
+ALTER TABLE Aluno ADD COLUMN IF NOT EXISTS anoAluno VARCHAR(50);
+ALTER TABLE Aluno ADD COLUMN IF NOT EXISTS urlFotoPerfil TEXT;
+ALTER TABLE Professor DROP CONSTRAINT IF EXISTS professor_status_check,
+    ADD CONSTRAINT professor_status_check CHECK (status IN ('ativo', 'inativo', 'bloqueado'));
+ALTER TABLE Aluno DROP CONSTRAINT IF EXISTS aluno_status_check,
+    ADD CONSTRAINT aluno_status_check CHECK (status IN ('ativo', 'inativo', 'bloqueado'));
+
+-- Credenciais unificadas para o login: resolve email -> papel, id, hash e status em uma única consulta.
+-- O filtro por email é empurrado para dentro de cada ramo do UNION ALL, então o Postgres usa
+-- os índices UNIQUE de emailProfessor e emailAluno (no máximo duas buscas por índice, uma ida ao banco).
+CREATE OR REPLACE VIEW CredencialUsuario AS
+    SELECT 'professor'::text AS papel, 1 AS prioridade, idProfessor AS id, nomeProfessor AS nome,
+           emailProfessor AS email, senhaProfessor AS senha, status
+    FROM Professor
+    UNION ALL
+    SELECT 'aluno'::text AS papel, 2 AS prioridade, idAluno AS id, nomeAluno AS nome,
+           emailAluno AS email, senhaAluno AS senha, status
+    FROM Aluno;
+
+-- Paginação por keyset da lista de atividades do aluno (idAtividade DESC por professor).
+-- Atende tanto "idProfessor = X" quanto "idProfessor IS NULL" (atividades públicas).
+CREATE INDEX IF NOT EXISTS idx_atividade_professor_id ON Atividade (idProfessor, idAtividade DESC);
+
+-- Resumo de progresso por aluno, mantido na mesma transação de cada AtividadeFeita (ver progresso.py).
+-- Pode ser reconstruído a partir do histórico com "flask reconstruir-resumos".
+CREATE TABLE IF NOT EXISTS ResumoProgressoAluno (
+    idAluno INT PRIMARY KEY REFERENCES Aluno(idAluno) ON DELETE CASCADE,
+    total_concluidas INT NOT NULL DEFAULT 0,
+    total_pontuadas INT NOT NULL DEFAULT 0,
+    soma_pontuacao BIGINT NOT NULL DEFAULT 0,
+    melhor_pontuacao INT,
+    ultima_atividade TIMESTAMPTZ
+);
+
+-- Busca de alunos (type-ahead): sem acento, sem diferenciar maiúsculas e com índice de trigramas.
+-- unaccent() não é IMMUTABLE, por isso o wrapper f_unaccent para poder ser usado em índice.
+CREATE EXTENSION IF NOT EXISTS unaccent;
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+    AS $$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$;
+
+CREATE INDEX IF NOT EXISTS idx_aluno_professor ON Aluno (idProfessor);
+CREATE INDEX IF NOT EXISTS idx_aluno_nome_trgm ON Aluno USING gin (lower(f_unaccent(nomeAluno)) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_aluno_email_trgm ON Aluno USING gin (lower(emailAluno) gin_trgm_ops);
+
+-- Chave de idempotência das conclusões (sincronização offline em lote): reenvios do mesmo item
+-- são ignorados. NULLs não conflitam entre si, então registros antigos continuam válidos.
+ALTER TABLE AtividadeFeita ADD COLUMN IF NOT EXISTS chave_idempotencia VARCHAR(100);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_atividadefeita_chave ON AtividadeFeita (idAluno, chave_idempotencia);
+
+-- Ranking de moedas por professor e por turma (anoAluno). Os índices já vêm ordenados por moedas,
+-- então o top-N é uma leitura de N entradas e a posição do aluno é uma contagem só pela parte do
+-- índice acima dele. Aluno.moedas é atualizado pela compactação do extrato de moedas (ver moedas.py),
+-- então o ranking acompanha o saldo com o atraso de MOEDAS_COMPACTAR_SEGUNDOS.
+CREATE INDEX IF NOT EXISTS idx_aluno_ranking_professor ON Aluno (idProfessor, moedas DESC, idAluno) WHERE status = 'ativo';
+CREATE INDEX IF NOT EXISTS idx_aluno_ranking_turma ON Aluno (idProfessor, anoAluno, moedas DESC, idAluno) WHERE status = 'ativo';
+
+-- Progresso por período (dia 'd' e semana 's', semana começando na segunda) para os gráficos.
+-- Mantido na mesma transação de cada AtividadeFeita (ver progresso.atualizar_progresso_periodos);
+-- um gráfico lê no máximo algumas centenas de linhas, não importa o tamanho do histórico.
+-- "turma" é o anoAluno do aluno no momento da conclusão ('' = sem turma).
+-- Pode ser reconstruído a partir do histórico com "flask reconstruir-progresso".
+CREATE TABLE IF NOT EXISTS ProgressoPeriodoAluno (
+    idAluno INT NOT NULL REFERENCES Aluno(idAluno) ON DELETE CASCADE,
+    periodo CHAR(1) NOT NULL CHECK (periodo IN ('d', 's')),
+    inicio DATE NOT NULL,
+    concluidas INT NOT NULL DEFAULT 0,
+    soma_pontuacao BIGINT NOT NULL DEFAULT 0,
+    moedas INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (idAluno, periodo, inicio)
+);
+
+CREATE TABLE IF NOT EXISTS ProgressoPeriodoTurma (
+    idProfessor INT NOT NULL REFERENCES Professor(idProfessor) ON DELETE CASCADE,
+    turma VARCHAR(50) NOT NULL,
+    periodo CHAR(1) NOT NULL CHECK (periodo IN ('d', 's')),
+    inicio DATE NOT NULL,
+    concluidas INT NOT NULL DEFAULT 0,
+    soma_pontuacao BIGINT NOT NULL DEFAULT 0,
+    moedas INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (idProfessor, turma, periodo, inicio)
+);
+
+-- Versão de cada atividade para o cache de atividades processadas (ver cache_atividades.py).
+-- O trigger incrementa a versão em qualquer UPDATE, então nenhum worker serve conteúdo antigo.
+ALTER TABLE Atividade ADD COLUMN IF NOT EXISTS versao INT NOT NULL DEFAULT 1;
+ALTER TABLE Atividade ADD COLUMN IF NOT EXISTS atualizado_em TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP;
+
+CREATE OR REPLACE FUNCTION atividade_nova_versao() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+BEGIN
+    NEW.versao := OLD.versao + 1;
+    NEW.atualizado_em := CURRENT_TIMESTAMP;
+    RETURN NEW;
+END
+$$;
+
+DROP TRIGGER IF EXISTS trg_atividade_versao ON Atividade;
+CREATE TRIGGER trg_atividade_versao BEFORE UPDATE ON Atividade
+    FOR EACH ROW EXECUTE FUNCTION atividade_nova_versao();
+
+-- Turmas alvo de cada atividade (antes só no texto JSON Atividade.turmas, filtrado no frontend).
+-- Atividade.direcionada = tem ao menos uma turma; atividades não direcionadas valem para todos.
+-- A consulta do aluno testa "NOT direcionada OR EXISTS (idAtividade, anoAluno)" pela chave primária.
+-- Atividade.turmas continua sendo gravada (é devolvida ao frontend como está).
+CREATE TABLE IF NOT EXISTS AtividadeTurma (
+    idAtividade INT NOT NULL REFERENCES Atividade(idAtividade) ON DELETE CASCADE,
+    turma VARCHAR(50) NOT NULL,
+    PRIMARY KEY (idAtividade, turma)
+);
+ALTER TABLE Atividade ADD COLUMN IF NOT EXISTS direcionada BOOLEAN NOT NULL DEFAULT FALSE;
+
+-- Migração das atividades existentes a partir do JSON em Atividade.turmas
+INSERT INTO AtividadeTurma (idAtividade, turma)
+SELECT DISTINCT a.idAtividade, btrim(t.turma)
+FROM Atividade a
+CROSS JOIN LATERAL jsonb_array_elements_text(a.turmas::jsonb) AS t(turma)
+WHERE a.turmas LIKE '[%' AND btrim(t.turma) <> ''
+ON CONFLICT DO NOTHING;
+
+UPDATE Atividade a SET direcionada = TRUE
+WHERE NOT a.direcionada AND EXISTS (SELECT 1 FROM AtividadeTurma t WHERE t.idAtividade = a.idAtividade);
+
+-- Extrato de moedas (ver moedas.py): cada crédito ou débito é uma linha nova, em vez de um UPDATE na
+-- linha larga de Aluno a cada conclusão. A compactação periódica soma os movimentos pendentes
+-- (compactado = FALSE) em SaldoMoedas e copia o saldo para Aluno.moedas (usado pelo ranking).
+-- Saldo atual = COALESCE(SaldoMoedas.saldo, Aluno.moedas) + movimentos pendentes.
+CREATE TABLE IF NOT EXISTS MovimentoMoedas (
+    idMovimento BIGSERIAL PRIMARY KEY,
+    idAluno INT NOT NULL REFERENCES Aluno(idAluno) ON DELETE CASCADE,
+    valor INT NOT NULL,                       -- positivo = crédito, negativo = débito
+    motivo VARCHAR(30) NOT NULL,              -- 'atividade', 'historico', ...
+    chave_idempotencia VARCHAR(100),          -- mesma chave da AtividadeFeita que gerou o crédito
+    criado_em TIMESTAMPTZ NOT NULL DEFAULT now(),
+    compactado BOOLEAN NOT NULL DEFAULT FALSE
+);
+CREATE INDEX IF NOT EXISTS idx_movimento_pendente ON MovimentoMoedas (idAluno) WHERE NOT compactado;
+CREATE INDEX IF NOT EXISTS idx_movimento_extrato ON MovimentoMoedas (idAluno, idMovimento DESC);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_movimento_chave ON MovimentoMoedas (idAluno, motivo, chave_idempotencia);
+
+CREATE TABLE IF NOT EXISTS SaldoMoedas (
+    idAluno INT PRIMARY KEY REFERENCES Aluno(idAluno) ON DELETE CASCADE,
+    saldo INT NOT NULL,
+    atualizado_em TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- Bancos em que as colunas acima foram criadas como TIMESTAMP (sem fuso): converte para TIMESTAMPTZ,
+-- lendo os valores no TimeZone da sessão que roda o script (o mesmo em que foram gravados).
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM information_schema.columns
+               WHERE table_name = 'movimentomoedas' AND column_name = 'criado_em'
+                 AND data_type = 'timestamp without time zone') THEN
+        ALTER TABLE MovimentoMoedas ALTER COLUMN criado_em TYPE TIMESTAMPTZ, ALTER COLUMN criado_em SET DEFAULT now();
+    END IF;
+    IF EXISTS (SELECT 1 FROM information_schema.columns
+               WHERE table_name = 'saldomoedas' AND column_name = 'atualizado_em'
+                 AND data_type = 'timestamp without time zone') THEN
+        ALTER TABLE SaldoMoedas ALTER COLUMN atualizado_em TYPE TIMESTAMPTZ, ALTER COLUMN atualizado_em SET DEFAULT now();
+    END IF;
+END
+$$;
+
+-- Migração: o extrato começa com as conclusões já registradas (como movimentos já compactados,
+-- pois Aluno.moedas já as inclui) e o saldo de cada aluno é o valor atual de Aluno.moedas.
+INSERT INTO MovimentoMoedas (idAluno, valor, motivo, chave_idempotencia, criado_em, compactado)
+SELECT f.idAluno, 10 + COALESCE(f.pontuacao, 0) / 10, 'historico', f.chave_idempotencia, f.dataAtividadeFeita, TRUE
+FROM AtividadeFeita f
+WHERE NOT EXISTS (SELECT 1 FROM MovimentoMoedas);
+
+INSERT INTO SaldoMoedas (idAluno, saldo)
+SELECT idAluno, moedas FROM Aluno
+ON CONFLICT DO NOTHING;
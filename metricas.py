@@ -0,0 +1,158 @@
+# metricas.py
+# Instrumentação de latência por rota e por consulta SQL, exposta no formato texto do Prometheus.
+# Os valores são por processo: com vários workers do gunicorn, cada um tem as suas séries
+# (o label "pid" diferencia quem respondeu a coleta).
+
+import bisect
+import os
+import re
+import threading
+
+from config import METRICAS_CONSULTA_LENTA_MS
+
+# Limites dos buckets em segundos (mesmos para requisições, consultas e espera por conexão)
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+
+
+class Histograma:
+    __slots__ = ('contagens', 'soma', 'total')
+
+    def __init__(self):
+        self.contagens = [0] * (len(BUCKETS) + 1)
+        self.soma = 0.0
+        self.total = 0
+
+    def observar(self, valor):
+        self.contagens[bisect.bisect_left(BUCKETS, valor)] += 1
+        self.soma += valor
+        self.total += 1
+
+
+_requisicoes = {}        # (rota, metodo, status) -> contagem
+_duracao_rotas = {}      # (rota, metodo) -> Histograma
+_duracao_consultas = {}  # rótulo -> Histograma
+_linhas_consultas = {}   # rótulo -> linhas devolvidas/afetadas
+_espera_conexao = Histograma()
+
+
+# --- Rótulo normalizado de um comando SQL: "verbo tabela" (ex.: "select aluno") ---
+_VERBOS = ('select', 'insert', 'update', 'delete')
+_TABELA = {
+    'select': re.compile(r'\bfrom\s+([a-z_][a-z0-9_]*)', re.I),
+    'insert': re.compile(r'\binsert\s+into\s+([a-z_][a-z0-9_]*)', re.I),
+    'update': re.compile(r'\bupdate\s+([a-z_][a-z0-9_]*)', re.I),
+    'delete': re.compile(r'\bdelete\s+from\s+([a-z_][a-z0-9_]*)', re.I),
+}
+_DML_EM_CTE = re.compile(r'\b(insert|update|delete)\b', re.I)
+_rotulos = {}  # cache: texto do SQL -> rótulo (o mesmo texto se repete a cada requisição)
+
+
+def rotular(sql):
+    rotulo = _rotulos.get(sql)
+    if rotulo is not None:
+        return rotulo
+
+    texto = sql.decode('utf-8', 'replace') if isinstance(sql, bytes) else str(sql)
+    palavras = texto.split(None, 1)
+    verbo = palavras[0].lower().lstrip('(') if palavras else ''
+    if verbo == 'with':
+        # Em uma CTE o que importa é a escrita, se houver (ex.: INSERT ... RETURNING dentro do WITH)
+        dml = _DML_EM_CTE.search(texto)
+        verbo = dml.group(1).lower() if dml else 'select'
+    if verbo in _VERBOS:
+        tabela = _TABELA[verbo].search(texto)
+        rotulo = f"{verbo} {tabela.group(1).lower()}" if tabela else verbo
+    else:
+        rotulo = verbo or 'vazio'
+
+    if len(_rotulos) < 2000:
+        _rotulos[sql] = rotulo
+    return rotulo
+
+
+# --- Registro ---
+def registrar_requisicao(rota, metodo, status, duracao):
+    with _lock:
+        chave = (rota, metodo, status)
+        _requisicoes[chave] = _requisicoes.get(chave, 0) + 1
+        histograma = _duracao_rotas.get((rota, metodo))
+        if histograma is None:
+            histograma = _duracao_rotas[(rota, metodo)] = Histograma()
+        histograma.observar(duracao)
+
+
+def registrar_consulta(sql, duracao, linhas, rotulo=None):
+    rotulo = rotulo or rotular(sql)
+    with _lock:
+        histograma = _duracao_consultas.get(rotulo)
+        if histograma is None:
+            histograma = _duracao_consultas[rotulo] = Histograma()
+        histograma.observar(duracao)
+        if linhas > 0:
+            _linhas_consultas[rotulo] = _linhas_consultas.get(rotulo, 0) + linhas
+
+    # Log de consultas lentas
+    if duracao * 1000 >= METRICAS_CONSULTA_LENTA_MS:
+        texto = ' '.join(str(sql).split())
+        print(f"Consulta lenta ({duracao * 1000:.1f} ms, {rotulo}): {texto[:300]}")
+
+
+def registrar_espera_conexao(duracao):
+    with _lock:
+        _espera_conexao.observar(duracao)
+
+
+# --- Exposição no formato texto do Prometheus ---
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return ','.join(f'{nome}="{_escapar(valor)}"' for nome, valor in labels.items())
+
+
+def _histograma(linhas, nome, histograma, **labels):
+    base = _labels(pid=os.getpid(), **labels)
+    acumulado = 0
+    for limite, contagem in zip(BUCKETS, histograma.contagens):
+        acumulado += contagem
+        linhas.append(f'{nome}_bucket{{{base},le="{limite}"}} {acumulado}')
+    linhas.append(f'{nome}_bucket{{{base},le="+Inf"}} {histograma.total}')
+    linhas.append(f'{nome}_sum{{{base}}} {histograma.soma:.6f}')
+    linhas.append(f'{nome}_count{{{base}}} {histograma.total}')
+
+
+# "medidores" são valores instantâneos extras (ex.: estado do pool), {nome: (ajuda, valor)}
+def renderizar(medidores=None):
+    linhas = []
+    with _lock:
+        linhas += ['# HELP http_requisicoes_total Requisições atendidas por rota, método e status.',
+                   '# TYPE http_requisicoes_total counter']
+        for (rota, metodo, status), contagem in sorted(_requisicoes.items()):
+            linhas.append(f'http_requisicoes_total{{{_labels(pid=os.getpid(), rota=rota, metodo=metodo, status=status)}}} {contagem}')
+
+        linhas += ['# HELP http_requisicao_duracao_segundos Latência das requisições por rota.',
+                   '# TYPE http_requisicao_duracao_segundos histogram']
+        for (rota, metodo), histograma in sorted(_duracao_rotas.items()):
+            _histograma(linhas, 'http_requisicao_duracao_segundos', histograma, rota=rota, metodo=metodo)
+
+        linhas += ['# HELP db_consulta_duracao_segundos Duração de cursor.execute por comando normalizado.',
+                   '# TYPE db_consulta_duracao_segundos histogram']
+        for rotulo, histograma in sorted(_duracao_consultas.items()):
+            _histograma(linhas, 'db_consulta_duracao_segundos', histograma, consulta=rotulo)
+
+        linhas += ['# HELP db_consulta_linhas_total Linhas devolvidas ou afetadas por comando normalizado.',
+                   '# TYPE db_consulta_linhas_total counter']
+        for rotulo, total in sorted(_linhas_consultas.items()):
+            linhas.append(f'db_consulta_linhas_total{{{_labels(pid=os.getpid(), consulta=rotulo)}}} {total}')
+
+        linhas += ['# HELP db_conexao_espera_segundos Tempo para obter uma conexão do pool.',
+                   '# TYPE db_conexao_espera_segundos histogram']
+        _histograma(linhas, 'db_conexao_espera_segundos', _espera_conexao)
+
+    for nome, (ajuda, valor) in (medidores or {}).items():
+        linhas += [f'# HELP {nome} {ajuda}', f'# TYPE {nome} gauge',
+                   f'{nome}{{{_labels(pid=os.getpid())}}} {valor}']
+    return '\n'.join(linhas) + '\n'
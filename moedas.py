@@ -0,0 +1,155 @@
+# moedas.py
+# Extrato de moedas dos alunos (tabelas MovimentoMoedas e SaldoMoedas, ver init.sql).
+#
+# - Ganhar moedas é um INSERT de movimento (só acréscimo); a linha de Aluno, larga por causa da foto,
+#   não é travada nem reescrita a cada conclusão.
+# - Saldo atual = COALESCE(SaldoMoedas.saldo, Aluno.moedas) + movimentos ainda não compactados,
+#   que são poucos por aluno (só os desde a última compactação), lidos pelo índice parcial.
+# - A compactação (a cada MOEDAS_COMPACTAR_SEGUNDOS em uma thread de cada worker, ou com
+#   "flask compactar-moedas") soma os movimentos pendentes no saldo, marca-os como compactados e
+#   copia o saldo para Aluno.moedas, que alimenta os índices do ranking. Os movimentos continuam no
+#   extrato como histórico. Um advisory lock garante uma compactação por vez entre os workers.
+
+import os
+import random
+import threading
+import time
+
+from config import MOEDAS_COMPACTAR_SEGUNDOS, MOEDAS_COMPACTAR_LOTE
+from consultas_preparadas import preparar, executar
+from db_functions import conectar_db, encerrar_db
+
+_TRAVA_COMPACTACAO = 7312025  # chave do pg_try_advisory_xact_lock
+_compactacao_pid = None
+_compactacao_lock = threading.Lock()
+
+# Saldo atual do aluno "a" (alias da tabela Aluno na consulta que usa a expressão)
+SALDO_ALUNO = """(COALESCE((SELECT s.saldo FROM SaldoMoedas s WHERE s.idAluno = a.idAluno), a.moedas)
+        + COALESCE((SELECT SUM(m.valor) FROM MovimentoMoedas m WHERE m.idAluno = a.idAluno AND NOT m.compactado), 0))::int"""
+
+# Lança os movimentos e devolve o saldo já com eles. O SELECT principal não enxerga as linhas
+# inseridas pelo próprio comando, por isso a soma de "novos" é adicionada à parte.
+COMANDO_LANCAR_MOVIMENTOS = preparar('lancar_moedas', f"""
+    WITH novos AS (
+        INSERT INTO MovimentoMoedas (idAluno, valor, motivo, chave_idempotencia)
+        SELECT %s::int, m.valor, %s::varchar, m.chave
+        FROM unnest(%s::int[], %s::varchar[]) AS m(valor, chave)
+        RETURNING valor
+    )
+    SELECT {SALDO_ALUNO} + COALESCE((SELECT SUM(valor) FROM novos), 0)::int AS moedas, a.idProfessor
+    FROM Aluno a
+    WHERE a.idAluno = %s
+""")
+
+CONSULTA_SALDO = preparar('consultar_saldo', f"""
+    SELECT {SALDO_ALUNO} AS moedas, a.idProfessor FROM Aluno a WHERE a.idAluno = %s
+""")
+
+
+# Lança créditos (valores positivos) ou débitos (negativos) para o aluno, na transação do cursor.
+# "chaves" liga cada movimento à sua origem (ex.: a idempotency_key da AtividadeFeita).
+# Devolve {"moedas": saldo atualizado, "idprofessor": ...}, ou None se o aluno não existe.
+def lancar_movimentos(cursor, id_aluno, valores, chaves=None, motivo='atividade'):
+    if not valores:
+        executar(cursor, CONSULTA_SALDO, (id_aluno,))
+        return cursor.fetchone()
+    chaves = list(chaves) if chaves is not None else [None] * len(valores)
+    executar(cursor, COMANDO_LANCAR_MOVIMENTOS, (id_aluno, motivo, list(valores), chaves, id_aluno))
+    return cursor.fetchone()
+
+
+# Extrato do aluno, do movimento mais recente para o mais antigo (keyset por idMovimento)
+def extrato_moedas(cursor, id_aluno, antes=None, limite=50):
+    filtro = 'AND idMovimento < %(antes)s' if antes is not None else ''
+    cursor.execute(f"""
+        SELECT idMovimento, valor, motivo, criado_em
+        FROM MovimentoMoedas
+        WHERE idAluno = %(aluno)s {filtro}
+        ORDER BY idMovimento DESC
+        LIMIT %(limite)s
+    """, {'aluno': id_aluno, 'antes': antes, 'limite': limite})
+    return [{
+        "id": linha['idmovimento'],
+        "valor": linha['valor'],
+        "motivo": linha['motivo'],
+        "data": linha['criado_em'].isoformat(),
+    } for linha in cursor.fetchall()]
+
+
+# Compacta os movimentos pendentes de até "limite" alunos (sem commit).
+# Devolve quantos alunos foram compactados, ou None se outra compactação está em andamento.
+def compactar_moedas(cursor, limite=MOEDAS_COMPACTAR_LOTE):
+    cursor.execute('SELECT pg_try_advisory_xact_lock(%s) AS livre', (_TRAVA_COMPACTACAO,))
+    if not cursor.fetchone()['livre']:
+        return None
+    # Movimentos de transações ainda não commitadas não aparecem aqui e ficam para a próxima vez
+    cursor.execute("""
+        WITH alvo AS (
+            SELECT DISTINCT idAluno FROM MovimentoMoedas
+            WHERE NOT compactado
+            ORDER BY idAluno
+            LIMIT %(limite)s
+        ), movimentos AS (
+            UPDATE MovimentoMoedas m SET compactado = TRUE
+            FROM alvo
+            WHERE m.idAluno = alvo.idAluno AND NOT m.compactado
+            RETURNING m.idAluno, m.valor
+        ), somas AS (
+            SELECT idAluno, SUM(valor)::int AS soma FROM movimentos GROUP BY idAluno
+        ), saldos AS (
+            INSERT INTO SaldoMoedas AS s (idAluno, saldo, atualizado_em)
+            SELECT so.idAluno, COALESCE(atual.saldo, a.moedas) + so.soma, CURRENT_TIMESTAMP
+            FROM somas so
+            JOIN Aluno a ON a.idAluno = so.idAluno
+            LEFT JOIN SaldoMoedas atual ON atual.idAluno = so.idAluno
+            ORDER BY so.idAluno
+            ON CONFLICT (idAluno) DO UPDATE SET saldo = EXCLUDED.saldo, atualizado_em = EXCLUDED.atualizado_em
+            RETURNING s.idAluno, s.saldo
+        ), alunos AS (
+            UPDATE Aluno a SET moedas = saldos.saldo
+            FROM saldos
+            WHERE a.idAluno = saldos.idAluno AND a.moedas <> saldos.saldo
+        )
+        SELECT COUNT(*) AS alunos FROM saldos
+    """, {'limite': limite})
+    return cursor.fetchone()['alunos']
+
+
+# Compacta tudo o que estiver pendente, um commit por lote. Devolve o total de alunos compactados.
+def compactar_pendentes():
+    total = 0
+    conexao, cursor = conectar_db()
+    try:
+        while True:
+            alunos = compactar_moedas(cursor)
+            conexao.commit()
+            if not alunos:
+                return total
+            total += alunos
+    except BaseException:
+        conexao.rollback()
+        raise
+    finally:
+        encerrar_db(cursor, conexao)
+
+
+def _laco_compactacao():
+    while True:
+        # Intervalo com variação para os workers não compactarem sempre juntos
+        time.sleep(MOEDAS_COMPACTAR_SEGUNDOS * random.uniform(0.8, 1.2))
+        try:
+            compactar_pendentes()
+        except Exception as e:
+            print(f"Erro na compactação de moedas: {e}")
+
+
+# Inicia a compactação periódica neste worker (idempotente; depois de um fork inicia de novo)
+def iniciar_compactacao():
+    global _compactacao_pid
+    if MOEDAS_COMPACTAR_SEGUNDOS <= 0 or _compactacao_pid == os.getpid():
+        return
+    with _compactacao_lock:
+        if _compactacao_pid == os.getpid():
+            return
+        _compactacao_pid = os.getpid()
+    threading.Thread(target=_laco_compactacao, name='compactacao-moedas', daemon=True).start()
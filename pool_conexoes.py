@@ -0,0 +1,177 @@
+# pool_conexoes.py
+# Pool de conexões PostgreSQL limitado e thread-safe.
+# Cada worker do gunicorn tem o seu próprio pool (ele é recriado depois de um fork).
+
+import os
+import threading
+import time
+
+import psycopg2
+from psycopg2 import extensions
+
+
+class PoolEsgotado(Exception):
+    """Nenhuma conexão ficou livre dentro do tempo limite de espera."""
+
+
+class ConexaoPool(extensions.connection):
+    """Conexão aberta pelo pool; guarda os comandos já preparados nesta sessão (ver consultas_preparadas.py)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.preparadas = set()
+        self.desalocar = False  # a sessão perdeu parte dos comandos: DEALLOCATE ALL antes do próximo PREPARE
+
+
+class PoolConexoes:
+    def __init__(self, dsn, minimo=0, maximo=10, timeout=10.0, idade_maxima=1800, checar_apos=30):
+        self.dsn = dsn
+        self.minimo = minimo
+        self.maximo = maximo
+        self.timeout = timeout                # segundos esperando uma conexão livre
+        self.idade_maxima = idade_maxima      # segundos até reciclar uma conexão
+        self.checar_apos = checar_apos        # segundos ociosa antes de testar com SELECT 1
+        self.pid = os.getpid()
+
+        self._cond = threading.Condition()
+        self._ociosas = []   # lista de (conexao, devolvida_em), usada como pilha (LIFO)
+        self._criadas = {}   # id(conexao) -> momento em que foi aberta
+        self._total = 0      # conexões abertas + vagas reservadas para abrir
+
+        # Estatísticas (protegidas pelo mesmo lock)
+        self._checkouts = 0
+        self._esperas = 0
+        self._tempo_espera_total = 0.0
+        self._tempo_espera_max = 0.0
+        self._esgotamentos = 0
+        self._recicladas = 0
+        self._falhas_checagem = 0
+
+        for _ in range(minimo):
+            with self._cond:
+                self._total += 1
+            conexao = self._abrir()
+            self._ociosas.append((conexao, time.monotonic()))
+
+    # --- Abertura e fechamento físico das conexões ---
+    def _abrir(self):
+        try:
+            conexao = psycopg2.connect(self.dsn, connection_factory=ConexaoPool)
+        except Exception:
+            # Libera a vaga reservada para não "vazar" capacidade do pool
+            with self._cond:
+                self._total -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._criadas[id(conexao)] = time.monotonic()
+        return conexao
+
+    def _fechar(self, conexao):
+        with self._cond:
+            self._criadas.pop(id(conexao), None)
+        try:
+            conexao.close()
+        except Exception:
+            pass
+
+    def _saudavel(self, conexao, devolvida_em):
+        if conexao.closed:
+            return False
+        agora = time.monotonic()
+        criada_em = self._criadas.get(id(conexao), agora)
+        if agora - criada_em > self.idade_maxima:
+            with self._cond:
+                self._recicladas += 1
+            return False
+        if agora - devolvida_em > self.checar_apos:
+            try:
+                with conexao.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                conexao.rollback()
+            except psycopg2.Error:
+                with self._cond:
+                    self._falhas_checagem += 1
+                return False
+        return True
+
+    # --- Checkout / devolução ---
+    def obter(self):
+        inicio = time.monotonic()
+        prazo = inicio + self.timeout
+        candidata = None
+        with self._cond:
+            while True:
+                if self._ociosas:
+                    candidata = self._ociosas.pop()
+                    break
+                if self._total < self.maximo:
+                    self._total += 1
+                    break
+                restante = prazo - time.monotonic()
+                if restante <= 0:
+                    self._esgotamentos += 1
+                    raise PoolEsgotado(f"Nenhuma conexão livre após {self.timeout}s (máximo {self.maximo}).")
+                self._cond.wait(restante)
+
+            espera = time.monotonic() - inicio
+            self._checkouts += 1
+            if espera > 0.001:
+                self._esperas += 1
+            self._tempo_espera_total += espera
+            self._tempo_espera_max = max(self._tempo_espera_max, espera)
+
+        # A checagem de saúde acontece fora do lock; a vaga já está reservada para nós
+        if candidata is not None:
+            conexao, devolvida_em = candidata
+            if self._saudavel(conexao, devolvida_em):
+                return conexao
+            self._fechar(conexao)
+        return self._abrir()
+
+    def devolver(self, conexao, descartar=False):
+        if not descartar and not conexao.closed:
+            try:
+                # Nunca devolve ao pool uma transação pendurada
+                if conexao.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conexao.rollback()
+            except psycopg2.Error:
+                descartar = True
+
+        criada_em = self._criadas.get(id(conexao), 0)
+        if descartar or conexao.closed or time.monotonic() - criada_em > self.idade_maxima:
+            self._fechar(conexao)
+            with self._cond:
+                self._total -= 1
+                self._cond.notify()
+            return
+
+        with self._cond:
+            self._ociosas.append((conexao, time.monotonic()))
+            self._cond.notify()
+
+    def fechar_todas(self):
+        with self._cond:
+            ociosas, self._ociosas = self._ociosas, []
+            self._total -= len(ociosas)
+        for conexao, _ in ociosas:
+            self._fechar(conexao)
+
+    def estatisticas(self):
+        with self._cond:
+            ociosas = len(self._ociosas)
+            return {
+                "pid": self.pid,
+                "maximo": self.maximo,
+                "total": self._total,
+                "em_uso": self._total - ociosas,
+                "ociosas": ociosas,
+                "checkouts": self._checkouts,
+                "esperas": self._esperas,
+                "tempo_espera_total_ms": round(self._tempo_espera_total * 1000, 2),
+                "tempo_espera_max_ms": round(self._tempo_espera_max * 1000, 2),
+                "tempo_espera_medio_ms": round(self._tempo_espera_total * 1000 / self._checkouts, 3) if self._checkouts else 0,
+                "esgotamentos": self._esgotamentos,
+                "recicladas": self._recicladas,
+                "falhas_checagem": self._falhas_checagem,
+            }
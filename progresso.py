@@ -0,0 +1,393 @@
+# progresso.py
+# Registro de atividades concluídas e tudo o que é derivado delas.
+# Resumo de progresso por aluno (tabela ResumoProgressoAluno), mantido incrementalmente
+# na mesma transação que registra a AtividadeFeita. O perfil lê uma linha só, em vez de
+# rodar COUNT/AVG sobre todo o histórico do aluno.
+
+import uuid
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from config import PROGRESSO_FUSO
+from consultas_preparadas import preparar, executar
+from moedas import lancar_movimentos
+
+
+# Lógica de recompensa: 10 moedas base + 1 moeda para cada 10 pontos
+def calcular_moedas(pontuacao):
+    return 10 + (pontuacao // 10)
+
+
+# --- Comandos preparados do registro de conclusões (ver consultas_preparadas.py) ---
+# Um INSERT de várias linhas (via unnest) em AtividadeFeita, ignorando chaves de idempotência
+# já registradas; devolve a situação de cada item.
+COMANDO_REGISTRAR_CONCLUSOES = preparar('registrar_conclusoes', """
+    WITH entrada AS (
+        SELECT * FROM unnest(%s::int[], %s::int[], %s::text[], %s::timestamptz[], %s::text[])
+            AS e(idAtividade, pontuacao, feedback, momento, chave)
+    ), inseridos AS (
+        INSERT INTO AtividadeFeita (idAluno, idAtividade, pontuacao, feedback_gemini, dataAtividadeFeita, chave_idempotencia)
+        SELECT %s::int, e.idAtividade, e.pontuacao, e.feedback,
+               LEAST(COALESCE(e.momento, CURRENT_TIMESTAMP), CURRENT_TIMESTAMP), e.chave
+        FROM entrada e
+        JOIN Atividade a ON a.idAtividade = e.idAtividade
+        ON CONFLICT (idAluno, chave_idempotencia) DO NOTHING
+        RETURNING chave_idempotencia, dataAtividadeFeita
+    )
+    SELECT e.chave,
+           i.chave_idempotencia IS NOT NULL AS inserido,
+           i.dataAtividadeFeita AS momento,
+           EXISTS (SELECT 1 FROM Atividade a WHERE a.idAtividade = e.idAtividade) AS atividade_existe
+    FROM entrada e
+    LEFT JOIN inseridos i ON i.chave_idempotencia = e.chave
+""")
+
+COMANDO_ATUALIZAR_RESUMO = preparar('atualizar_resumo', """
+    INSERT INTO ResumoProgressoAluno AS r
+        (idAluno, total_concluidas, total_pontuadas, soma_pontuacao, melhor_pontuacao, ultima_atividade)
+    SELECT %s::int, COUNT(*), COUNT(e.p), COALESCE(SUM(e.p), 0), MAX(e.p), MAX(e.momento)
+    FROM unnest(%s::int[], %s::timestamptz[]) AS e(p, momento)
+    ON CONFLICT (idAluno) DO UPDATE SET
+        total_concluidas = r.total_concluidas + EXCLUDED.total_concluidas,
+        total_pontuadas = r.total_pontuadas + EXCLUDED.total_pontuadas,
+        soma_pontuacao = r.soma_pontuacao + EXCLUDED.soma_pontuacao,
+        melhor_pontuacao = GREATEST(r.melhor_pontuacao, EXCLUDED.melhor_pontuacao),
+        ultima_atividade = GREATEST(r.ultima_atividade, EXCLUDED.ultima_atividade)
+""")
+
+COMANDO_PROGRESSO_PERIODOS = preparar('progresso_periodos', """
+    WITH entrada AS (
+        SELECT (e.momento AT TIME ZONE %(fuso)s::text)::date AS dia, e.pontuacao, e.moedas
+        FROM unnest(%(momentos)s::timestamptz[], %(pontuacoes)s::int[], %(moedas)s::int[])
+            AS e(momento, pontuacao, moedas)
+    ), periodos AS (
+        SELECT 'd' AS periodo, dia AS inicio, pontuacao, moedas FROM entrada
+        UNION ALL
+        SELECT 's', date_trunc('week', dia)::date, pontuacao, moedas FROM entrada
+    ), somas AS (
+        SELECT periodo, inicio, COUNT(*) AS concluidas,
+               COALESCE(SUM(pontuacao), 0) AS soma_pontuacao, SUM(moedas) AS moedas
+        FROM periodos
+        GROUP BY periodo, inicio
+    ), por_aluno AS (
+        INSERT INTO ProgressoPeriodoAluno AS r (idAluno, periodo, inicio, concluidas, soma_pontuacao, moedas)
+        SELECT %(aluno)s::int, periodo, inicio, concluidas, soma_pontuacao, moedas
+        FROM somas
+        ORDER BY periodo, inicio
+        ON CONFLICT (idAluno, periodo, inicio) DO UPDATE SET
+            concluidas = r.concluidas + EXCLUDED.concluidas,
+            soma_pontuacao = r.soma_pontuacao + EXCLUDED.soma_pontuacao,
+            moedas = r.moedas + EXCLUDED.moedas
+    )
+    INSERT INTO ProgressoPeriodoTurma AS r (idProfessor, turma, periodo, inicio, concluidas, soma_pontuacao, moedas)
+    SELECT a.idProfessor, COALESCE(a.anoAluno, ''), s.periodo, s.inicio, s.concluidas, s.soma_pontuacao, s.moedas
+    FROM somas s
+    JOIN Aluno a ON a.idAluno = %(aluno)s AND a.idProfessor IS NOT NULL
+    ORDER BY s.periodo, s.inicio
+    ON CONFLICT (idProfessor, turma, periodo, inicio) DO UPDATE SET
+        concluidas = r.concluidas + EXCLUDED.concluidas,
+        soma_pontuacao = r.soma_pontuacao + EXCLUDED.soma_pontuacao,
+        moedas = r.moedas + EXCLUDED.moedas
+""")
+
+
+# Registra várias conclusões do mesmo aluno em uma transação (sem commit):
+# um INSERT de várias linhas (via unnest), um movimento de moedas por conclusão no extrato
+# (ver moedas.py) e o resumo.
+# Cada item: {"idAtividade", "pontuacao", "feedback", "momento" (datetime ou None), "chave"}.
+# Itens com "chave" (idempotency key) já registrada são ignorados, então reenvios são seguros.
+# Devolve (resultados por item, moedas ganhas, novo total de moedas, id do professor do aluno);
+# o id do professor serve para a rota invalidar o cache das análises da turma depois do commit.
+def registrar_conclusoes(cursor, id_aluno, itens):
+    # Chave repetida dentro do próprio lote conta uma vez só
+    unicos = {}
+    for item in itens:
+        item['chave'] = item.get('chave') or uuid.uuid4().hex
+        unicos.setdefault(item['chave'], item)
+    vistos = set()
+
+    executar(cursor, COMANDO_REGISTRAR_CONCLUSOES, (
+        [item['idAtividade'] for item in unicos.values()],
+        [item['pontuacao'] for item in unicos.values()],
+        [item.get('feedback') or '' for item in unicos.values()],
+        [item.get('momento') for item in unicos.values()],
+        list(unicos),
+        id_aluno,
+    ))
+    situacao = {linha['chave']: linha for linha in cursor.fetchall()}
+
+    resultados = []
+    pontuacoes = []
+    momentos = []
+    moedas_itens = []
+    chaves = []
+    moedas_ganhas = 0
+    for item in itens:
+        linha = situacao[item['chave']]
+        repetido = item['chave'] in vistos
+        vistos.add(item['chave'])
+        if linha['inserido'] and not repetido:
+            moedas = calcular_moedas(item['pontuacao'])
+            moedas_ganhas += moedas
+            pontuacoes.append(item['pontuacao'])
+            momentos.append(linha['momento'])
+            moedas_itens.append(moedas)
+            chaves.append(item['chave'])
+            resultados.append({"chave": item['chave'], "status": "registrado", "moedasGanhas": moedas})
+        elif not linha['atividade_existe']:
+            resultados.append({"chave": item['chave'], "status": "erro", "msg": "Atividade não encontrada."})
+        else:
+            resultados.append({"chave": item['chave'], "status": "duplicado", "moedasGanhas": 0})
+
+    atualizar_resumo_progresso(cursor, id_aluno, pontuacoes, momentos)
+    atualizar_progresso_periodos(cursor, id_aluno, momentos, pontuacoes, moedas_itens)
+
+    # Um comando para os créditos do lote inteiro, já devolvendo o saldo
+    linha = lancar_movimentos(cursor, id_aluno, moedas_itens, chaves)
+    if not linha:
+        return resultados, moedas_ganhas, None, None
+    return resultados, moedas_ganhas, linha['moedas'], linha['idprofessor']
+
+
+# Soma as novas pontuações ao resumo do aluno (upsert). Deve rodar na mesma transação
+# do INSERT em AtividadeFeita, antes do commit. "momentos" são as dataAtividadeFeita gravadas
+# (conclusões offline chegam com a hora em que foram feitas, não a do envio).
+def atualizar_resumo_progresso(cursor, id_aluno, pontuacoes, momentos):
+    if not pontuacoes:
+        return
+    executar(cursor, COMANDO_ATUALIZAR_RESUMO, (id_aluno, list(pontuacoes), list(momentos)))
+
+
+# Soma as novas conclusões nos totais por dia e por semana do aluno e da sua turma (upsert),
+# na mesma transação do INSERT em AtividadeFeita. O dia é o de dataAtividadeFeita no PROGRESSO_FUSO.
+# As linhas são gravadas sempre na mesma ordem para conclusões concorrentes da mesma turma
+# não travarem umas às outras.
+def atualizar_progresso_periodos(cursor, id_aluno, momentos, pontuacoes, moedas):
+    if not momentos:
+        return
+    executar(cursor, COMANDO_PROGRESSO_PERIODOS, {
+        'fuso': PROGRESSO_FUSO,
+        'momentos': list(momentos),
+        'pontuacoes': list(pontuacoes),
+        'moedas': list(moedas),
+        'aluno': id_aluno,
+    })
+
+
+# Recalcula os resumos a partir de AtividadeFeita (todos os alunos ou só um).
+# O LOCK faz as conclusões concorrentes esperarem o fim da reconstrução; como a agregação
+# só enxerga o que já foi commitado, nenhuma conclusão é contada duas vezes ou perdida.
+def reconstruir_resumos(cursor, id_aluno=None):
+    cursor.execute('LOCK TABLE ResumoProgressoAluno IN EXCLUSIVE MODE')
+    filtro = 'WHERE idAluno = %(aluno)s' if id_aluno is not None else ''
+    cursor.execute(f"""
+        DELETE FROM ResumoProgressoAluno r
+        WHERE {'r.idAluno = %(aluno)s AND' if id_aluno is not None else ''}
+              NOT EXISTS (SELECT 1 FROM AtividadeFeita f WHERE f.idAluno = r.idAluno)
+    """, {'aluno': id_aluno})
+    cursor.execute(f"""
+        INSERT INTO ResumoProgressoAluno
+            (idAluno, total_concluidas, total_pontuadas, soma_pontuacao, melhor_pontuacao, ultima_atividade)
+        SELECT idAluno, COUNT(*), COUNT(pontuacao), COALESCE(SUM(pontuacao), 0), MAX(pontuacao), MAX(dataAtividadeFeita)
+        FROM AtividadeFeita
+        {filtro}
+        GROUP BY idAluno
+        ON CONFLICT (idAluno) DO UPDATE SET
+            total_concluidas = EXCLUDED.total_concluidas,
+            total_pontuadas = EXCLUDED.total_pontuadas,
+            soma_pontuacao = EXCLUDED.soma_pontuacao,
+            melhor_pontuacao = EXCLUDED.melhor_pontuacao,
+            ultima_atividade = EXCLUDED.ultima_atividade
+    """, {'aluno': id_aluno})
+    return cursor.rowcount
+
+
+# Recalcula os totais por dia e por semana a partir de AtividadeFeita (todos os alunos).
+# As moedas seguem calcular_moedas(); a turma é o anoAluno atual de cada aluno.
+def reconstruir_progresso_periodos(cursor):
+    cursor.execute('LOCK TABLE ProgressoPeriodoAluno, ProgressoPeriodoTurma IN EXCLUSIVE MODE')
+    cursor.execute('DELETE FROM ProgressoPeriodoAluno')
+    cursor.execute('DELETE FROM ProgressoPeriodoTurma')
+    cursor.execute("""
+        WITH feitas AS (
+            SELECT f.idAluno, a.idProfessor, COALESCE(a.anoAluno, '') AS turma,
+                   (f.dataAtividadeFeita AT TIME ZONE %(fuso)s)::date AS dia,
+                   COALESCE(f.pontuacao, 0) AS pontuacao,
+                   10 + COALESCE(f.pontuacao, 0) / 10 AS moedas
+            FROM AtividadeFeita f
+            JOIN Aluno a ON a.idAluno = f.idAluno
+        ), periodos AS (
+            SELECT idAluno, idProfessor, turma, 'd' AS periodo, dia AS inicio, pontuacao, moedas FROM feitas
+            UNION ALL
+            SELECT idAluno, idProfessor, turma, 's', date_trunc('week', dia)::date, pontuacao, moedas FROM feitas
+        ), por_aluno AS (
+            INSERT INTO ProgressoPeriodoAluno (idAluno, periodo, inicio, concluidas, soma_pontuacao, moedas)
+            SELECT idAluno, periodo, inicio, COUNT(*), SUM(pontuacao), SUM(moedas)
+            FROM periodos
+            GROUP BY idAluno, periodo, inicio
+        )
+        INSERT INTO ProgressoPeriodoTurma (idProfessor, turma, periodo, inicio, concluidas, soma_pontuacao, moedas)
+        SELECT idProfessor, turma, periodo, inicio, COUNT(*), SUM(pontuacao), SUM(moedas)
+        FROM periodos
+        WHERE idProfessor IS NOT NULL
+        GROUP BY idProfessor, turma, periodo, inicio
+    """, {'fuso': PROGRESSO_FUSO})
+    cursor.execute('SELECT COUNT(*) AS total FROM ProgressoPeriodoAluno')
+    return cursor.fetchone()['total']
+
+
+# --- Séries para os gráficos ---
+PERIODOS = {'dia': ('d', timedelta(days=1)), 'semana': ('s', timedelta(weeks=1))}
+MAX_PONTOS_SERIE = 366
+PONTOS_PADRAO = {'dia': 30, 'semana': 12}
+
+
+# Valida ?periodo=dia|semana&de=AAAA-MM-DD&ate=AAAA-MM-DD e devolve (periodo, de, ate).
+# Sem datas: os últimos 30 dias ou 12 semanas. Semanas são alinhadas na segunda-feira.
+# Levanta ValueError com a mensagem para o usuário.
+def ler_intervalo_serie(args):
+    periodo = args.get('periodo', 'dia')
+    if periodo not in PERIODOS:
+        raise ValueError("periodo deve ser 'dia' ou 'semana'.")
+    passo = PERIODOS[periodo][1]
+    try:
+        ate = date.fromisoformat(args['ate']) if args.get('ate') else datetime.now(ZoneInfo(PROGRESSO_FUSO)).date()
+        de = date.fromisoformat(args['de']) if args.get('de') else ate - passo * (PONTOS_PADRAO[periodo] - 1)
+    except ValueError:
+        raise ValueError("Datas devem estar no formato AAAA-MM-DD.")
+    if periodo == 'semana':
+        de -= timedelta(days=de.weekday())
+        ate -= timedelta(days=ate.weekday())
+    if de > ate:
+        raise ValueError("'de' deve ser anterior a 'ate'.")
+    if (ate - de) // passo + 1 > MAX_PONTOS_SERIE:
+        raise ValueError(f"Intervalo grande demais (máximo de {MAX_PONTOS_SERIE} pontos).")
+    return periodo, de, ate
+
+
+# Série com um ponto por dia/semana do intervalo (períodos sem conclusões voltam zerados).
+# Filtra por aluno, ou por professor (e opcionalmente uma turma, '' = sem turma).
+def serie_progresso(cursor, periodo, de, ate, id_aluno=None, id_professor=None, turma=None):
+    if id_aluno is not None:
+        tabela, filtro = 'ProgressoPeriodoAluno', 'r.idAluno = %(aluno)s'
+    else:
+        tabela, filtro = 'ProgressoPeriodoTurma', 'r.idProfessor = %(professor)s'
+        if turma is not None:
+            filtro += ' AND r.turma = %(turma)s'
+    codigo, passo = PERIODOS[periodo]
+    cursor.execute(f"""
+        SELECT s.inicio::date AS inicio,
+               COALESCE(SUM(r.concluidas), 0)::bigint AS concluidas,
+               COALESCE(SUM(r.soma_pontuacao), 0)::bigint AS soma_pontuacao,
+               COALESCE(SUM(r.moedas), 0)::bigint AS moedas
+        FROM generate_series(%(de)s::date, %(ate)s::date, %(passo)s) AS s(inicio)
+        LEFT JOIN {tabela} r ON r.periodo = %(periodo)s AND r.inicio = s.inicio::date AND {filtro}
+        GROUP BY s.inicio
+        ORDER BY s.inicio
+    """, {'de': de, 'ate': ate, 'passo': passo, 'periodo': codigo,
+          'aluno': id_aluno, 'professor': id_professor, 'turma': turma})
+    return [{
+        "inicio": linha['inicio'].isoformat(),
+        "concluidas": linha['concluidas'],
+        "somaPontuacao": linha['soma_pontuacao'],
+        "mediaPontuacao": round(linha['soma_pontuacao'] / linha['concluidas'], 2) if linha['concluidas'] else None,
+        "moedas": linha['moedas'],
+    } for linha in cursor.fetchall()]
+
+
+# Versão dos dados usados por analisar_turmas, para o cache da rota (ver cache_respostas.py):
+# muda com cada conclusão (soma dos totais semanais da turma, mantidos a cada AtividadeFeita),
+# com alunos que entram, saem ou trocam de turma (md5 dos pares aluno:turma em ordem de id; uma
+# soma não mudaria com dois alunos trocando de turma) e com atividades criadas, editadas ou apagadas.
+# Lê só índices do professor, bem mais barato que a análise.
+def versao_analises(cursor, id_professor):
+    cursor.execute("""
+        SELECT concat_ws(':',
+            (SELECT COALESCE(SUM(concluidas), 0) FROM ProgressoPeriodoTurma
+             WHERE idProfessor = %(professor)s AND periodo = 's'),
+            (SELECT COALESCE(md5(string_agg(idAluno || ':' || COALESCE(anoAluno, ''), ',' ORDER BY idAluno)), '')
+             FROM Aluno WHERE idProfessor = %(professor)s),
+            (SELECT COUNT(*) || '-' || COALESCE(MAX(atualizado_em)::text, '') FROM Atividade
+             WHERE idProfessor = %(professor)s OR idProfessor IS NULL)
+        ) AS versao
+    """, {'professor': id_professor})
+    return cursor.fetchone()['versao']
+
+
+# Análise das turmas de um professor em um único comando SQL:
+# - pares (aluno, atividade) esperados: atividades do professor ou públicas, restritas às turmas
+#   alvo em AtividadeTurma (atividade não direcionada = todos os alunos);
+# - melhor pontuação de cada aluno em cada atividade; COUNT(...) OVER (PARTITION BY aluno) marca
+#   quem ainda não concluiu nenhuma atividade;
+# - GROUPING SETS agrega por turma, por atividade e no geral em uma passada só, com média e
+#   mediana (percentile_cont) das pontuações.
+# Devolve {"geral": {...}, "turmas": [...], "atividades": [...], "alunosSemInicio": [...]}.
+def analisar_turmas(cursor, id_professor):
+    cursor.execute("""
+        WITH alunos AS (
+            SELECT idAluno, nomeAluno, anoAluno,
+                   COALESCE(NULLIF(anoAluno, ''), 'Alunos Sem Turma') AS turma
+            FROM Aluno
+            WHERE idProfessor = %(professor)s
+        ), atividades AS (
+            SELECT idAtividade, titulo, direcionada
+            FROM Atividade
+            WHERE idProfessor = %(professor)s OR idProfessor IS NULL
+        ), feitas AS (
+            SELECT f.idAluno, f.idAtividade, MAX(f.pontuacao) AS pontuacao
+            FROM AtividadeFeita f
+            JOIN alunos al ON al.idAluno = f.idAluno
+            GROUP BY f.idAluno, f.idAtividade
+        ), pares AS (
+            -- LEFT JOIN: alunos sem nenhuma atividade esperada continuam contando na turma
+            SELECT al.idAluno, al.nomeAluno, al.turma, at.idAtividade, at.titulo, f.pontuacao,
+                   f.idAluno IS NOT NULL AS concluida,
+                   COUNT(f.idAluno) OVER (PARTITION BY al.idAluno) AS concluidas_aluno
+            FROM alunos al
+            LEFT JOIN atividades at
+                   ON NOT at.direcionada
+                      OR EXISTS (SELECT 1 FROM AtividadeTurma t
+                                 WHERE t.idAtividade = at.idAtividade AND t.turma = al.anoAluno)
+            LEFT JOIN feitas f ON f.idAluno = al.idAluno AND f.idAtividade = at.idAtividade
+        ), agregados AS (
+            SELECT GROUPING(turma) AS sem_turma, GROUPING(idAtividade) AS sem_atividade,
+                   turma, idAtividade, titulo,
+                   COUNT(DISTINCT idAluno) AS alunos,
+                   COUNT(DISTINCT idAluno) FILTER (WHERE concluidas_aluno = 0) AS alunos_sem_inicio,
+                   COUNT(idAtividade) AS esperadas,
+                   COUNT(*) FILTER (WHERE concluida) AS concluidas,
+                   ROUND(AVG(pontuacao), 2) AS media,
+                   ROUND((percentile_cont(0.5) WITHIN GROUP (ORDER BY pontuacao))::numeric, 2) AS mediana
+            FROM pares
+            GROUP BY GROUPING SETS ((turma), (idAtividade, titulo), ())
+        ), formatados AS (
+            SELECT a.*,
+                   json_build_object(
+                       'alunos', alunos,
+                       'alunosSemInicio', alunos_sem_inicio,
+                       'esperadas', esperadas,
+                       'concluidas', concluidas,
+                       'taxaConclusao', ROUND(100.0 * concluidas / NULLIF(esperadas, 0), 1),
+                       'mediaPontuacao', media,
+                       'medianaPontuacao', mediana
+                   ) AS dados
+            FROM agregados a
+        )
+        SELECT
+            (SELECT dados FROM formatados WHERE sem_turma = 1 AND sem_atividade = 1) AS geral,
+            (SELECT COALESCE(json_agg((dados::jsonb || jsonb_build_object('turma', turma)) ORDER BY turma), '[]')
+             FROM formatados WHERE sem_turma = 0) AS turmas,
+            (SELECT COALESCE(json_agg((dados::jsonb || jsonb_build_object('idAtividade', idAtividade, 'titulo', titulo))
+                                      ORDER BY idAtividade DESC), '[]')
+             FROM formatados WHERE sem_atividade = 0 AND idAtividade IS NOT NULL) AS atividades,
+            (SELECT COALESCE(json_agg(json_build_object('idAluno', idAluno, 'nomeAluno', nomeAluno, 'turma', turma)
+                                      ORDER BY turma, nomeAluno), '[]')
+             FROM (SELECT DISTINCT idAluno, nomeAluno, turma FROM pares WHERE concluidas_aluno = 0) s) AS alunos_sem_inicio
+    """, {'professor': id_professor})
+    linha = cursor.fetchone()
+    return {
+        "geral": linha['geral'],
+        "turmas": linha['turmas'],
+        "atividades": linha['atividades'],
+        "alunosSemInicio": linha['alunos_sem_inicio'],
+    }
@@ -0,0 +1,144 @@
+# replicas.py
+# Leituras em réplicas do PostgreSQL (DATABASE_REPLICA_URLS), escritas sempre no primário.
+#
+# - Rotas só de leitura são marcadas com @leitura_replica (abaixo de @jwt_required()); as demais
+#   continuam no primário (ver db_functions.conectar_db).
+# - "Ler o que escreveu": depois de uma escrita bem-sucedida o usuário fica ESCRITA_RECENTE_SEGUNDOS
+#   lendo do primário, para não ver um dado anterior à escrita por causa do atraso da réplica
+#   (ex.: o aluno que acabou de ganhar moedas). A janela fica em uma tabela em memória compartilhada
+#   (ESCRITA_RECENTE_ARQUIVO, em /dev/shm) vista por todos os workers da máquina, então o GET seguinte
+#   vai para o primário mesmo se cair em outro worker. Cada usuário ocupa uma posição escolhida por
+#   hash; uma colisão só manda mais uma leitura para o primário. Com várias máquinas, o balanceador
+#   deve usar sessões "sticky". Se o arquivo não puder ser aberto, a janela volta a ser por processo.
+# - Uma réplica que falha ao conectar fica fora por REPLICA_PAUSA_FALHA segundos e a leitura
+#   vai para a próxima réplica ou, sem nenhuma, para o primário.
+
+import itertools
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from functools import wraps
+
+import psycopg2
+from flask import g
+from flask_jwt_extended import get_jwt
+
+from config import (DATABASE_REPLICA_URLS, DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, DB_POOL_IDADE_MAXIMA,
+                    DB_POOL_CHECAR_APOS, ESCRITA_RECENTE_SEGUNDOS, ESCRITA_RECENTE_ARQUIVO, REPLICA_PAUSA_FALHA)
+from pool_conexoes import PoolConexoes, PoolEsgotado
+
+_lock = threading.Lock()
+_pools = None         # lista de PoolConexoes, uma por réplica (recriada depois de um fork)
+_pid = None
+_proxima = itertools.count()
+_fora_ate = {}        # índice da réplica -> momento até quando ela fica fora da rotação
+_escritas = {}        # reserva por processo: "papel:id" -> momento até quando as leituras vão para o primário
+_POSICOES = 65536     # posições da tabela compartilhada (8 bytes cada: time.time() do fim da janela)
+_tabela = None        # mmap da tabela compartilhada; False = indisponível, usa _escritas
+
+
+def _obter_pools():
+    global _pools, _pid
+    if _pools is None or _pid != os.getpid():
+        with _lock:
+            if _pools is None or _pid != os.getpid():
+                _pools = [PoolConexoes(dsn, minimo=DB_POOL_MIN, maximo=DB_POOL_MAX, timeout=DB_POOL_TIMEOUT,
+                                       idade_maxima=DB_POOL_IDADE_MAXIMA, checar_apos=DB_POOL_CHECAR_APOS)
+                          for dsn in DATABASE_REPLICA_URLS]
+                _pid = os.getpid()
+                _fora_ate.clear()
+    return _pools
+
+
+# Devolve (conexao, pool) de uma réplica em rodízio, ou (None, None) se nenhuma estiver disponível
+def obter_conexao_replica():
+    pools = _obter_pools()
+    if not pools:
+        return None, None
+    inicio = next(_proxima)
+    agora = time.monotonic()
+    for deslocamento in range(len(pools)):
+        indice = (inicio + deslocamento) % len(pools)
+        if _fora_ate.get(indice, 0) > agora:
+            continue
+        try:
+            return pools[indice].obter(), pools[indice]
+        except (psycopg2.OperationalError, PoolEsgotado) as e:
+            print(f"Réplica {indice} indisponível, usando a próxima opção: {e}")
+            _fora_ate[indice] = agora + REPLICA_PAUSA_FALHA
+    return None, None
+
+
+def estatisticas_replicas():
+    return [pool.estatisticas() for pool in _obter_pools()]
+
+
+# Usuário do token da requisição ("papel:id"), ou None se a rota não verificou um JWT
+def usuario_atual():
+    try:
+        claims = get_jwt()
+    except RuntimeError:
+        return None
+    return f"{claims.get('role')}:{claims.get('sub')}" if claims else None
+
+
+# Tabela de janelas compartilhada entre os processos (MAP_SHARED), aberta no primeiro uso
+def _obter_tabela():
+    global _tabela
+    if _tabela is None:
+        with _lock:
+            if _tabela is None:
+                try:
+                    descritor = os.open(ESCRITA_RECENTE_ARQUIVO, os.O_RDWR | os.O_CREAT, 0o600)
+                    try:
+                        if os.fstat(descritor).st_size < _POSICOES * 8:
+                            os.ftruncate(descritor, _POSICOES * 8)
+                        _tabela = mmap.mmap(descritor, _POSICOES * 8)
+                    finally:
+                        os.close(descritor)
+                except OSError as e:
+                    print(f"Janela de escrita recente só por processo ({ESCRITA_RECENTE_ARQUIVO}: {e})")
+                    _tabela = False
+    return _tabela
+
+
+def _posicao(usuario):
+    return (zlib.crc32(usuario.encode()) % _POSICOES) * 8
+
+
+def marcar_escrita(usuario):
+    if usuario is None:
+        return
+    tabela = _obter_tabela()
+    if tabela:
+        struct.pack_into('d', tabela, _posicao(usuario), time.time() + ESCRITA_RECENTE_SEGUNDOS)
+        return
+    agora = time.monotonic()
+    with _lock:
+        _escritas[usuario] = agora + ESCRITA_RECENTE_SEGUNDOS
+        if len(_escritas) > 10000:  # limpeza das janelas vencidas
+            for chave in [c for c, ate in _escritas.items() if ate <= agora]:
+                del _escritas[chave]
+
+
+def escrita_recente(usuario):
+    if usuario is None:
+        return False
+    tabela = _obter_tabela()
+    if tabela:
+        return struct.unpack_from('d', tabela, _posicao(usuario))[0] > time.time()
+    return _escritas.get(usuario, 0) > time.monotonic()
+
+
+# Decorador para rotas só de leitura: a conexão da requisição vem de uma réplica,
+# exceto quando não há réplicas configuradas ou o usuário escreveu há pouco.
+def leitura_replica(view):
+    @wraps(view)
+    def envolvida(*args, **kwargs):
+        if DATABASE_REPLICA_URLS and not escrita_recente(usuario_atual()):
+            g._usar_replica = True
+        return view(*args, **kwargs)
+    return envolvida
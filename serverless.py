@@ -0,0 +1,45 @@
+# serverless.py
+# Ponto de entrada para a Vercel (ver vercel.json), otimizado para a inicialização a frio.
+#
+# Cada container da Vercel atende uma requisição por vez e é congelado entre invocações, então:
+# - o pool fica com no máximo 2 conexões e nenhuma é aberta no import (DB_POOL_MIN=0): a primeira
+#   requisição conecta e as invocações seguintes no mesmo container reaproveitam a conexão quente
+#   (o pool confere com SELECT 1 a conexão que ficou ociosa, ex.: depois do container descongelar);
+# - o hash de senha roda na própria thread (HASH_PROCESSOS=0), sem subir um pool de processos;
+# - sem thread de compactação de moedas (o container fica congelado entre invocações,
+#   MOEDAS_COMPACTAR_SEGUNDOS=0): o "crons" do vercel.json chama /api/cron/compactar-moedas a cada
+#   5 minutos. Defina CRON_SECRET no painel (sem ele a rota recusa) e, no plano Hobby, que só
+#   permite um cron por dia, ajuste o "schedule";
+# - o envio de fotos fica desligado (FOTOS_ENVIO_ATIVO=0) e responde 503 com uma mensagem clara: o
+#   diretório do projeto é só leitura e o /tmp não é compartilhado nem persiste entre containers;
+# - na Vercel as variáveis vêm do painel e o .env não é lido (ver config.py);
+# - o import do app é cronometrado por módulo e o tempo até a primeira resposta vai para o log
+#   (ver inicializacao.py). Valores definidos no ambiente têm prioridade sobre os padrões abaixo.
+#
+# Relatório local, em um processo novo:  python serverless.py
+
+import time
+
+_inicio = time.perf_counter()
+
+import os
+import inicializacao
+
+inicializacao.iniciar(_inicio)
+
+for _variavel, _padrao in (('DB_POOL_MIN', '0'), ('DB_POOL_MAX', '2'), ('HASH_PROCESSOS', '0'),
+                          ('MOEDAS_COMPACTAR_SEGUNDOS', '0'), ('FOTOS_ENVIO_ATIVO', '0')):
+    os.environ.setdefault(_variavel, _padrao)
+
+with inicializacao.medir_importacoes():
+    from app import app
+
+inicializacao.marcar('app_importado')
+app.wsgi_app = inicializacao.cronometrar_primeira_resposta(app.wsgi_app)
+
+
+if __name__ == '__main__':
+    # Simula a primeira invocação com uma URL que não toca no banco (404) e imprime o relatório
+    import json
+    app.test_client().get('/')
+    print(json.dumps(inicializacao.relatorio_inicializacao(), ensure_ascii=False, indent=2))
@@ -0,0 +1,62 @@
+# status_contas.py
+# Cache (por worker) do status das contas para barrar tokens de contas bloqueadas ou removidas
+# sem uma consulta ao banco a cada requisição. No caminho quente o custo é uma busca em dict.
+#
+# - TTL curto (STATUS_CACHE_TTL): limita por quanto tempo outro worker ainda aceita uma conta
+#   recém-bloqueada, já que cada processo tem o seu cache.
+# - Versão por conta: invalidar_status() incrementa a versão; uma leitura do banco iniciada antes
+#   da invalidação não é gravada por cima dela (evita "ressuscitar" um status antigo).
+
+import threading
+import time
+
+from config import STATUS_CACHE_TTL
+
+_lock = threading.Lock()
+_cache = {}    # (papel, id) -> (status, expira_em); status None = conta não existe mais
+_versoes = {}  # (papel, id) -> contador de invalidações
+
+
+def _chave(papel, id_conta):
+    return (papel, str(id_conta))
+
+
+# Devolve (encontrado, status, versao). A versão deve ser passada para guardar_status().
+def obter_em_cache(papel, id_conta):
+    chave = _chave(papel, id_conta)
+    entrada = _cache.get(chave)
+    if entrada and entrada[1] > time.monotonic():
+        return True, entrada[0], None
+    return False, None, _versoes.get(chave, 0)
+
+
+def guardar_status(papel, id_conta, status, versao):
+    chave = _chave(papel, id_conta)
+    with _lock:
+        if _versoes.get(chave, 0) == versao:
+            _cache[chave] = (status, time.monotonic() + STATUS_CACHE_TTL)
+
+
+# Consulta com cache; "carregar(papel, id)" busca o status no banco quando não há entrada válida
+def status_conta(papel, id_conta, carregar):
+    encontrado, status, versao = obter_em_cache(papel, id_conta)
+    if encontrado:
+        return status
+    status = carregar(papel, id_conta)
+    guardar_status(papel, id_conta, status, versao)
+    return status
+
+
+# Gancho chamado depois do commit que muda o status ou remove a conta
+def invalidar_status(papel, id_conta):
+    chave = _chave(papel, id_conta)
+    with _lock:
+        _versoes[chave] = _versoes.get(chave, 0) + 1
+        _cache.pop(chave, None)
+
+
+# Consultas de status por papel (o asgi.py troca %s por $1 para o asyncpg)
+CONSULTAS_STATUS = {
+    'professor': 'SELECT status FROM Professor WHERE idProfessor = %s',
+    'aluno': 'SELECT status FROM Aluno WHERE idAluno = %s',
+}
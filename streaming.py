@@ -0,0 +1,93 @@
+# streaming.py
+# Respostas JSON em streaming para listas grandes: as linhas saem de um cursor do lado do
+# servidor (named cursor, buscando "itersize" linhas por vez) e são serializadas uma a uma,
+# com compressão gzip/deflate negociada pelo Accept-Encoding. A memória do worker fica
+# constante, não importa o tamanho da turma ou do banco de atividades.
+
+import zlib
+
+from flask import Response, current_app, request, stream_with_context
+
+TAMANHO_BLOCO = 16 * 1024  # bytes acumulados antes de enviar um pedaço ao cliente
+
+
+def _codificacao_aceita():
+    for codificacao in ('gzip', 'deflate'):
+        if request.accept_encodings[codificacao]:
+            return codificacao
+    return None
+
+
+# Recebe um gerador de pedaços de texto e devolve a Response em streaming (comprimida se possível).
+# stream_with_context mantém a requisição (e a conexão do pool em g) viva até o último pedaço.
+def resposta_json_streaming(pedacos):
+    codificacao = _codificacao_aceita()
+
+    def gerar():
+        # wbits 31 = formato gzip; 15 = zlib ("deflate" no HTTP)
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31 if codificacao == 'gzip' else 15) if codificacao else None
+        buffer = []
+        tamanho = 0
+        for pedaco in pedacos:
+            dados = pedaco.encode('utf-8')
+            if compressor:
+                dados = compressor.compress(dados)
+            if dados:
+                buffer.append(dados)
+                tamanho += len(dados)
+            if tamanho >= TAMANHO_BLOCO:
+                yield b''.join(buffer)
+                buffer, tamanho = [], 0
+        if compressor:
+            buffer.append(compressor.flush())
+        if buffer:
+            yield b''.join(buffer)
+
+    resposta = Response(stream_with_context(gerar()), mimetype='application/json')
+    if codificacao:
+        resposta.headers['Content-Encoding'] = codificacao
+    resposta.vary.add('Accept-Encoding')
+    return resposta
+
+
+# Serializa as linhas como uma lista JSON: [item, item, ...]. Fecha o cursor no final
+# (inclusive se o cliente desconectar no meio). "serializar" devolve o texto JSON já pronto
+# de uma linha (ex.: vindo de um cache), ou None para pular a linha.
+def lista_json(cursor, formatar=None, serializar=None):
+    dumps = current_app.json.dumps
+    try:
+        yield '['
+        primeiro = True
+        for linha in cursor:
+            if serializar:
+                texto = serializar(linha)
+                if texto is None:
+                    continue
+            else:
+                texto = dumps(formatar(linha) if formatar else linha)
+            yield ('' if primeiro else ',') + texto
+            primeiro = False
+        yield ']'
+    finally:
+        cursor.close()
+
+
+# Serializa linhas já ordenadas pelo grupo como um objeto {grupo: [itens], ...}.
+# "grupo" é uma função que devolve o nome do grupo de cada linha; grupos devem vir contíguos.
+def objeto_agrupado_json(cursor, grupo):
+    dumps = current_app.json.dumps
+    try:
+        yield '{'
+        grupo_atual = None
+        primeiro = True
+        for linha in cursor:
+            nome = grupo(linha)
+            if nome != grupo_atual:
+                yield ('],' if grupo_atual is not None else '') + dumps(nome) + ':['
+                grupo_atual = nome
+                primeiro = True
+            yield ('' if primeiro else ',') + dumps(linha)
+            primeiro = False
+        yield (']' if grupo_atual is not None else '') + '}'
+    finally:
+        cursor.close()